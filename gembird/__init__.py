@@ -0,0 +1,10 @@
+"""Control library and command-line tool for the Gembird KB-G460 keyboard.
+
+Importing the package is deliberately cheap: it pulls in no submodules and
+no third-party code, so the one-shot ``python -m gembird`` command only pays
+for what the chosen subcommand actually uses.
+"""
+
+# --- Device Configuration ---
+VENDOR_ID = 0x320F
+PRODUCT_ID = 0x5055
@@ -0,0 +1,5 @@
+import sys
+
+from gembird.cli import main
+
+sys.exit(main())
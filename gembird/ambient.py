@@ -0,0 +1,241 @@
+"""Ambient lighting that follows the colours of a frame source.
+
+Each frame from a source is reduced to one colour per key (or per zone):
+a strided view keeps about ``SAMPLES`` x ``SAMPLES`` pixels per grid cell,
+is reshaped (still a view) into ``cells x pixels`` and averaged, so the
+cost does not depend on the source resolution. The colours are smoothed
+with an exponential moving average, and a key is only resent when it has
+moved by at least ``threshold`` in some channel; frames where nothing moved
+that much send nothing. What changed goes through a ``FrameWriter``, which
+sends only the chunks that differ.
+
+Sources are iterables of H x W x 3 uint8 arrays with an ``fps`` attribute:
+
+* ``RawFileSource``: raw RGB24 frames back to back, memory-mapped
+  (``ffmpeg -i clip.mp4 -f rawvideo -pix_fmt rgb24 clip.rgb``);
+* ``VideoSource``: anything ``gembird.animation`` can decode;
+* ``ScreenSource``: the screen, through ``mss`` (X11, or XWayland windows
+  on Wayland);
+* ``SyntheticSource``: generated frames, for tests and benchmarks.
+
+NumPy is required.
+"""
+
+import math
+import time
+
+from gembird.protocol import FRAME_SIZE, SLOT_BLUE, SLOT_GREEN, SLOT_RED
+
+# Pixels sampled along each edge of a grid cell.
+SAMPLES = 8
+
+
+# --- Sources ---
+
+class RawFileSource:
+    """Raw RGB24 frames of a fixed size, read through a memory map."""
+
+    def __init__(self, path, width, height, fps=30, loop=True):
+        import numpy
+
+        data = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+        count = len(data) // (width * height * 3)
+        if not count:
+            raise ValueError(f"{path} holds no complete {width}x{height} RGB24 frame")
+        self.frames = data[:count * width * height * 3].reshape(count, height, width, 3)
+        self.fps = fps
+        self.loop = loop
+
+    def __iter__(self):
+        while True:
+            yield from self.frames
+            if not self.loop:
+                return
+
+    def close(self):
+        self.frames = None
+
+
+class VideoSource:
+    """Frames decoded from a GIF or video file."""
+
+    def __init__(self, path, fps=30, loop=True):
+        self.path = path
+        self.fps = fps
+        self.loop = loop
+
+    def __iter__(self):
+        from gembird.animation import decode_file
+
+        while True:
+            for pixels, _ in decode_file(self.path, self.fps):
+                yield pixels
+            if not self.loop:
+                return
+
+    def close(self):
+        pass
+
+
+class ScreenSource:
+    """Grabs a monitor through ``mss`` (``pip install mss``)."""
+
+    def __init__(self, monitor=1, fps=30):
+        import mss
+
+        self.grabber = mss.mss()
+        self.monitor = self.grabber.monitors[monitor]
+        self.fps = fps
+
+    def __iter__(self):
+        import numpy
+
+        while True:
+            # BGRA; reversing the first three channels is a view, not a copy.
+            yield numpy.asarray(self.grabber.grab(self.monitor))[..., 2::-1]
+
+    def close(self):
+        self.grabber.close()
+
+
+class SyntheticSource:
+    """A slowly drifting gradient, ``count`` frames (None: endless)."""
+
+    def __init__(self, width=1920, height=1080, fps=30, count=None, variants=16):
+        import numpy
+
+        x = numpy.linspace(0, 255, width, dtype=numpy.float32)[None, :]
+        y = numpy.linspace(0, 255, height, dtype=numpy.float32)[:, None]
+        self.frames = []
+        for i in range(variants):
+            pixels = numpy.empty((height, width, 3), dtype=numpy.uint8)
+            pixels[..., 0] = (x + i * 4) % 256
+            pixels[..., 1] = y
+            pixels[..., 2] = 255 - (x + i * 2) % 256
+            self.frames.append(pixels)
+        self.fps = fps
+        self.count = count
+
+    def __iter__(self):
+        number = 0
+        while self.count is None or number < self.count:
+            yield self.frames[number % len(self.frames)]
+            number += 1
+
+    def close(self):
+        pass
+
+
+def open_source(spec, fps=30):
+    """
+    Opens a source from a command-line spec: ``screen`` or ``screen:N``,
+    ``raw:WIDTHxHEIGHT:PATH``, ``synthetic``, or a GIF/video path.
+    """
+    kind, _, rest = spec.partition(":")
+    if kind == "screen":
+        return ScreenSource(int(rest or 1), fps)
+    if kind == "synthetic":
+        return SyntheticSource(fps=fps)
+    if kind == "raw":
+        size, _, path = rest.partition(":")
+        width, _, height = size.partition("x")
+        return RawFileSource(path, int(width), int(height), fps)
+    return VideoSource(spec, fps)
+
+
+# --- Sampling ---
+
+class Ambient:
+    """
+    Turns source frames into per-key colours and hands changes to a
+    FrameWriter. ``zones`` splits the keyboard into that many vertical
+    zones instead of sampling one cell per key.
+    """
+
+    def __init__(self, writer, layout, zones=None, smoothing=0.15, threshold=4, brightness=1.0):
+        import numpy
+
+        self.writer = writer
+        xs = numpy.array([x for x, _ in layout.positions])
+        ys = numpy.array([y for _, y in layout.positions])
+        if zones:
+            self.grid = (1, zones)
+            self.cells = (numpy.zeros_like(ys), xs * zones // max(1, layout.width))
+        else:
+            self.grid = (layout.height, layout.width)
+            self.cells = (ys, xs)
+        bases = numpy.array([slot * 3 for slot in layout.slots])
+        self.channels = (bases + SLOT_RED, bases + SLOT_GREEN, bases + SLOT_BLUE)
+        self.smoothing = smoothing
+        self.threshold = threshold
+        self.brightness = brightness
+        self.state = None
+        self.sent = numpy.zeros((len(layout), 3), dtype=numpy.int16)
+        self.frame = numpy.zeros(FRAME_SIZE, dtype=numpy.uint8)
+        self.last_time = None
+        self.frames = 0
+        self.pushed = 0
+        self.keys_sent = 0
+
+    def sample(self, pixels):
+        """Returns the mean colour of every grid cell (rows x columns x 3, float32)."""
+        import numpy
+
+        rows, columns = self.grid
+        height, width = pixels.shape[:2]
+        step = max(1, min(height // (rows * SAMPLES), width // (columns * SAMPLES)))
+        view = pixels[::step, ::step]
+        cell_h, cell_w = view.shape[0] // rows, view.shape[1] // columns
+        view = view[:cell_h * rows, :cell_w * columns]
+        return view.reshape(rows, cell_h, columns, cell_w, 3).mean(axis=(1, 3), dtype=numpy.float32)
+
+    def update(self, pixels, now=None):
+        """Processes one frame; returns the number of keys sent (0: nothing went out)."""
+        import numpy
+
+        now = time.monotonic() if now is None else now
+        target = self.sample(pixels)[self.cells]
+        if self.brightness != 1.0:
+            target *= self.brightness
+        if self.state is None:
+            self.state = target
+        else:
+            # Time-based smoothing, so the feel does not depend on the frame rate.
+            alpha = 1.0 if not self.smoothing else 1.0 - math.exp(-(now - self.last_time) / self.smoothing)
+            self.state += alpha * (target - self.state)
+        self.last_time = now
+        self.frames += 1
+
+        values = numpy.clip(numpy.rint(self.state), 0, 255).astype(numpy.int16)
+        changed = numpy.abs(values - self.sent).max(axis=1) >= self.threshold
+        if self.pushed and not changed.any():
+            return 0
+        if not self.pushed:
+            changed[:] = True
+        self.sent[changed] = values[changed]
+        colors = values[changed].astype(numpy.uint8)
+        red, green, blue = self.channels
+        self.frame[red[changed]] = colors[:, 0]
+        self.frame[green[changed]] = colors[:, 1]
+        self.frame[blue[changed]] = colors[:, 2]
+        self.writer.submit(self.frame.tobytes())
+        self.pushed += 1
+        count = int(changed.sum())
+        self.keys_sent += count
+        return count
+
+    def run(self, source, stop=None, paced=True):
+        """Follows ``source`` at its frame rate until it ends or ``stop`` is set."""
+        interval = 1.0 / source.fps
+        next_time = time.monotonic()
+        for pixels in source:
+            if stop is not None and stop.is_set():
+                break
+            self.update(pixels)
+            if paced:
+                next_time += interval
+                wait = next_time - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                else:
+                    next_time = time.monotonic()
@@ -0,0 +1,377 @@
+"""Compiling images and video clips into pre-encoded per-key animations.
+
+Compiling a clip is done once:
+
+1. decode the frames (Pillow for GIF/APNG/WebP, ``imageio`` for video),
+   dropping frames above ``max_fps`` and merging their durations;
+2. area-average every frame onto the layout's key grid, in linear light,
+   with NumPy ``reduceat`` over whole batches of frames;
+3. apply the output LUT (brightness and LED gamma) and scatter the colours
+   into 384-byte framebuffers;
+4. encode each frame as the per-key reports that differ from the previous
+   frame.
+
+Steps 2-3 run in a process pool for long clips. The reports are written to
+a packet file in the cache directory, named after a hash of the clip's
+bytes and every setting that affects the output, so playing the clip again
+is only a matter of mapping that file and streaming its reports.
+
+Packet file layout (little-endian)::
+
+    header   b"GBAN" | version | frames | reports | prelude (uint32 each)
+    index    frames * (first report uint32 | report count uint16 | duration ms uint16)
+    reports  reports * 64 bytes
+
+The first ``prelude`` reports are frame 0 in full, sent once before
+playback starts. Frame 0's own entry is its delta from the last frame, so
+loops are seamless.
+
+NumPy and Pillow are needed to compile (``pip install numpy pillow``;
+``imageio[ffmpeg]`` for video), but not to play a compiled clip.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+from gembird.protocol import FRAME_SIZE, REPORT_SIZE, SLOT_BLUE, SLOT_GREEN, SLOT_RED, per_key_sequence
+
+MAGIC = b"GBAN"
+VERSION = 1
+HEADER = struct.Struct("<4sIIII")
+ENTRY = struct.Struct("<IHH")
+# Frames are rendered in batches of up to BATCH frames or BATCH_PIXELS pixels.
+BATCH = 64
+BATCH_PIXELS = 1 << 21
+PIL_SUFFIXES = (".gif", ".png", ".apng", ".webp")
+# Import name -> pip package of the optional decoders.
+PACKAGES = {"PIL": "Pillow", "imageio": "imageio[ffmpeg]", "numpy": "numpy"}
+
+
+def cache_dir():
+    """Directory holding compiled packet files."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "gembird", "animations")
+
+
+# --- Decoding ---
+
+def decode_file(path, max_fps=30):
+    """Yields (H x W x 3 uint8 array, duration ms) for each frame kept."""
+    if path.lower().endswith(PIL_SUFFIXES):
+        frames = _decode_pillow(path)
+    else:
+        frames = _decode_imageio(path)
+    return limit_fps(frames, max_fps)
+
+
+def _missing(path, ex):
+    name = (ex.name or "").partition(".")[0]
+    package = PACKAGES.get(name, name)
+    return OSError(f"decoding {path} needs {package}, which is not installed (pip install {package})")
+
+
+def _decode_pillow(path):
+    try:
+        import numpy
+        from PIL import Image, ImageSequence
+    except ImportError as ex:
+        raise _missing(path, ex) from None
+
+    with Image.open(path) as image:
+        for frame in ImageSequence.Iterator(image):
+            yield numpy.asarray(frame.convert("RGB")), frame.info.get("duration") or 100
+
+
+def _decode_imageio(path):
+    try:
+        import imageio.v3 as iio
+    except ImportError as ex:
+        raise _missing(path, ex) from None
+
+    fps = iio.immeta(path).get("fps") or 30
+    for frame in iio.imiter(path):
+        yield frame[..., :3], 1000.0 / fps
+
+
+def limit_fps(frames, max_fps):
+    """Drops frames shown for less than 1/max_fps, adding their time to the kept frame."""
+    interval = 1000.0 / max_fps if max_fps else 0.0
+    kept, duration = None, 0.0
+    for frame, ms in frames:
+        if kept is None:
+            kept, duration = frame, ms
+        elif duration < interval:
+            duration += ms
+        else:
+            yield kept, duration
+            kept, duration = frame, ms
+    if kept is not None:
+        yield kept, duration
+
+
+# --- Rendering ---
+
+class Plan:
+    """Everything a worker needs to turn pixels into framebuffers."""
+
+    def __init__(self, layout, brightness=1.0, gamma=1.0):
+        self.width = layout.width
+        self.height = layout.height
+        self.xs = [x for x, _ in layout.positions]
+        self.ys = [y for _, y in layout.positions]
+        self.bases = [slot * 3 for slot in layout.slots]
+        self.output = bytes(min(255, round(255 * brightness * (i / 255) ** gamma)) for i in range(256))
+        self.tables = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["tables"] = None
+        return state
+
+    def key(self):
+        """The part of the cache key that depends on these settings."""
+        return repr((self.width, self.height, self.xs, self.ys, self.bases, self.output)).encode()
+
+
+def _numpy_tables(plan):
+    """NumPy versions of the colour LUTs and scatter indices, built once per process."""
+    if plan.tables is None:
+        import numpy
+
+        from gembird.transitions import LINEAR_TO_SRGB, SRGB_TO_LINEAR
+
+        bases = numpy.array(plan.bases)
+        plan.tables = (
+            numpy.array(SRGB_TO_LINEAR, dtype=numpy.float32),
+            numpy.frombuffer(LINEAR_TO_SRGB, dtype=numpy.uint8),
+            numpy.frombuffer(plan.output, dtype=numpy.uint8),
+            numpy.array(plan.ys), numpy.array(plan.xs),
+            bases + SLOT_RED, bases + SLOT_GREEN, bases + SLOT_BLUE,
+        )
+    return plan.tables
+
+
+def render(plan, pixels):
+    """
+    Turns a batch of frames (N x H x W x 3 uint8) into N framebuffers
+    (N x 384 uint8): area average per grid cell in linear light, back to
+    sRGB, output LUT, scatter into the slots.
+    """
+    import numpy
+
+    from gembird.transitions import LINEAR_STEPS
+
+    to_linear, to_srgb, output, ys, xs, red, green, blue = _numpy_tables(plan)
+    count, height, width, _ = pixels.shape
+    # Cells must not be empty: repeat pixels of images smaller than the grid.
+    if height < plan.height:
+        pixels = pixels.repeat(-(-plan.height // height), axis=1)
+    if width < plan.width:
+        pixels = pixels.repeat(-(-plan.width // width), axis=2)
+    count, height, width, _ = pixels.shape
+
+    rows = numpy.linspace(0, height, plan.height + 1).astype(numpy.intp)
+    cols = numpy.linspace(0, width, plan.width + 1).astype(numpy.intp)
+    linear = to_linear[pixels]
+    sums = numpy.add.reduceat(numpy.add.reduceat(linear, rows[:-1], axis=1), cols[:-1], axis=2)
+    areas = numpy.outer(numpy.diff(rows), numpy.diff(cols)).astype(numpy.float32)
+    means = sums / areas[None, :, :, None]
+    steps = numpy.clip(means * (LINEAR_STEPS - 1) + 0.5, 0, LINEAR_STEPS - 1).astype(numpy.intp)
+    colors = output[to_srgb[steps]]
+
+    keys = colors[:, ys, xs]
+    frames = numpy.zeros((count, FRAME_SIZE), dtype=numpy.uint8)
+    frames[:, red] = keys[:, :, 0]
+    frames[:, green] = keys[:, :, 1]
+    frames[:, blue] = keys[:, :, 2]
+    return frames
+
+
+_worker_plan = None
+
+
+def _init_worker(plan):
+    global _worker_plan
+    _worker_plan = plan
+
+
+def _render_batch(pixels):
+    return render(_worker_plan, pixels).tobytes()
+
+
+def _batches(frames, durations):
+    import numpy
+
+    batch, size = [], 0
+    for pixels, ms in frames:
+        durations.append(ms)
+        if batch and pixels.shape != batch[0].shape:
+            yield numpy.stack(batch)
+            batch, size = [], 0
+        batch.append(pixels)
+        size += pixels.shape[0] * pixels.shape[1]
+        if len(batch) == BATCH or size >= BATCH_PIXELS:
+            yield numpy.stack(batch)
+            batch, size = [], 0
+    if batch:
+        yield numpy.stack(batch)
+
+
+def render_frames(frames, plan, workers=None):
+    """
+    Returns (framebuffers, durations) for an iterable of (pixels, ms).
+    Clips longer than one batch are rendered in a process pool of
+    ``workers`` processes (default: one per core, and no pool on a single
+    core), with a bounded number of batches in flight so long clips do not
+    pile up in memory.
+    """
+    durations = []
+    batches = _batches(frames, durations)
+    first = next(batches, None)
+    if first is None:
+        return [], durations
+    second = next(batches, None)
+    workers = workers or os.cpu_count() or 1
+    if second is None or workers == 1:
+        rendered = (render(plan, pixels).tobytes() for pixels in _chain(first, second, batches))
+        return _split(rendered), durations
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(plan,)) as pool:
+        pending, rendered = [], []
+        for pixels in _chain(first, second, batches):
+            pending.append(pool.submit(_render_batch, pixels))
+            if len(pending) >= 2 * workers:
+                rendered.append(pending.pop(0).result())
+        rendered.extend(future.result() for future in pending)
+    return _split(rendered), durations
+
+
+def _chain(first, second, rest):
+    yield first
+    if second is not None:
+        yield second
+        yield from rest
+
+
+def _split(rendered):
+    return [bytes(data[i:i + FRAME_SIZE]) for data in rendered for i in range(0, len(data), FRAME_SIZE)]
+
+
+# --- Packet files ---
+
+def write_clip(path, framebuffers, durations):
+    """Encodes framebuffers as per-frame deltas and writes a packet file atomically."""
+    from gembird.frames import delta_sequence
+
+    prelude = per_key_sequence(framebuffers[0])
+    index, reports = [], list(prelude)
+    previous = framebuffers[-1]
+    for frame, ms in zip(framebuffers, durations):
+        delta = delta_sequence(previous, frame)
+        index.append(ENTRY.pack(len(reports), len(delta), min(0xFFFF, round(ms))))
+        reports.extend(delta)
+        previous = frame
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(framebuffers), len(reports), len(prelude)))
+        f.write(b"".join(index))
+        f.write(b"".join(reports))
+    os.replace(temporary, path)
+    return path
+
+
+class Clip:
+    """A compiled packet file, memory-mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.frames, self.reports, self.prelude_count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise OSError(f"{path} is not a gembird packet file")
+        self.index_offset = HEADER.size
+        self.reports_offset = HEADER.size + self.frames * ENTRY.size
+
+    def _reports(self, first, count):
+        start = self.reports_offset + first * REPORT_SIZE
+        data = self.map
+        return [data[start + i * REPORT_SIZE:start + (i + 1) * REPORT_SIZE] for i in range(count)]
+
+    def prelude(self):
+        return self._reports(0, self.prelude_count)
+
+    def frame(self, number):
+        """Returns (reports, duration in seconds) for one frame."""
+        first, count, ms = ENTRY.unpack_from(self.map, self.index_offset + number * ENTRY.size)
+        return self._reports(first, count), ms / 1000.0
+
+    def duration(self):
+        return sum(self.frame(number)[1] for number in range(self.frames))
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def content_key(path, plan, max_fps):
+    """Hash of the clip's bytes and the settings that shape the output."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(b"\0%d\0%r\0" % (VERSION, max_fps))
+    digest.update(plan.key())
+    return digest.hexdigest()[:32]
+
+
+def compile_file(path, layout, max_fps=30, brightness=1.0, gamma=1.0, workers=None, cache=True):
+    """
+    Returns the Clip for ``path``, compiling it unless it is cached.
+    Raises OSError if it cannot be decoded or has no frames.
+    """
+    plan = Plan(layout, brightness, gamma)
+    target = os.path.join(cache_dir(), content_key(path, plan, max_fps) + ".gban")
+    if cache and os.path.exists(target):
+        return Clip(target)
+    framebuffers, durations = render_frames(decode_file(path, max_fps), plan, workers)
+    if not framebuffers:
+        raise OSError(f"{path} has no frames")
+    return Clip(write_clip(target, framebuffers, durations))
+
+
+# --- Playback ---
+
+def play(clip, sink, loops=1):
+    """
+    Streams a compiled clip through ``sink`` (anything with ``send``);
+    ``loops=0`` repeats forever. Frames are held for their duration; when
+    the link is slower than the clip, frames simply take longer, since
+    deltas cannot be skipped.
+    """
+    import itertools
+
+    sink.send(clip.prelude())
+    next_time = time.monotonic()
+    for loop in (itertools.count() if loops == 0 else range(loops)):
+        for number in range(clip.frames):
+            reports, seconds = clip.frame(number)
+            if (loop or number) and reports:
+                sink.send(reports)
+            next_time += seconds
+            wait = next_time - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
@@ -0,0 +1,348 @@
+"""Cross-process arbitration of the keyboard's control interface.
+
+Only one process at a time may write to the vendor interface, otherwise
+reports from two tools interleave. Ownership is an advisory ``flock`` on a
+lock file keyed by the interface path (the kernel drops it when the holder
+dies). The holder also publishes a lease file with its pid, a handoff
+socket and a heartbeat timestamp.
+
+A process that finds the lock taken does not fail: it connects to the
+holder's handoff socket and the holder forwards its sequences through its
+own ``Controller``, so they are serialized with everything else the holder
+writes. The heartbeat tells a waiting process whether the holder is alive
+or hung. A holder that must not wake up while idle (``gembird embedded``)
+publishes its lease without a TTL instead: it is taken to be alive while
+it holds the lock and its socket accepts connections.
+
+Handoff wire format (Unix stream socket), one request per sequence::
+
+    request:  b"S" | priority (int8) | count (uint8) | count * 64-byte reports
+    response: b"\\x00" on success, or b"\\x01" | uint16 length | UTF-8 error
+"""
+
+import fcntl
+import os
+import time
+
+from gembird.protocol import REPORT_SIZE, sequence_gap
+
+LEASE_TTL = 3.0
+HEARTBEAT_INTERVAL = 1.0
+
+
+class DeviceBusy(OSError):
+    """Raised when the device is held by a process that cannot take handoffs."""
+
+
+def runtime_dir():
+    """Directory holding the lock, lease and socket files."""
+    base = os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/gembird-{os.getuid()}"
+    path = os.path.join(base, "gembird")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def lock_key(path):
+    """Turns an interface path such as /dev/hidraw3 into a file name stem."""
+    text = path.decode() if isinstance(path, bytes) else str(path)
+    return "".join(c if c.isalnum() else "_" for c in text.strip("/")) or "default"
+
+
+class Lease:
+    """The advisory lock plus the lease file describing its holder."""
+
+    def __init__(self, path, owner=None, directory=None):
+        directory = directory or runtime_dir()
+        stem = os.path.join(directory, lock_key(path))
+        self.lock_path = stem + ".lock"
+        self.lease_path = stem + ".lease"
+        self.socket_path = stem + ".sock"
+        self.owner = owner or f"pid {os.getpid()}"
+        self.fd = None
+        self.heartbeat_thread = None
+        self.stop = None
+
+    def try_acquire(self):
+        """Takes the lock without waiting; returns whether it succeeded."""
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self.fd = fd
+        return True
+
+    def publish(self, ttl=LEASE_TTL):
+        """Writes the lease file (atomically) with a fresh heartbeat; ``ttl=None``: no heartbeat."""
+        import json
+
+        lease = {
+            "pid": os.getpid(),
+            "owner": self.owner,
+            "socket": self.socket_path,
+            "heartbeat": time.time(),
+            "ttl": ttl,
+        }
+        tmp = f"{self.lease_path}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(lease, f)
+        os.replace(tmp, self.lease_path)
+
+    def start_heartbeat(self):
+        import threading
+
+        self.stop = threading.Event()
+        self.publish()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat, name="gembird-lease", daemon=True)
+        self.heartbeat_thread.start()
+
+    def _heartbeat(self):
+        while not self.stop.wait(HEARTBEAT_INTERVAL):
+            self.publish()
+
+    def read(self):
+        """Returns the holder's lease, or None if there is none."""
+        import json
+
+        try:
+            with open(self.lease_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def release(self):
+        if self.fd is None:
+            return
+        if self.heartbeat_thread is not None:
+            self.stop.set()
+            self.heartbeat_thread.join()
+        for stale in (self.lease_path, self.socket_path):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+
+def lease_is_fresh(lease, now=None):
+    """Whether the holder's heartbeat is within its TTL."""
+    if lease is None:
+        return False
+    ttl = lease.get("ttl", LEASE_TTL)
+    if ttl is None:
+        # No heartbeat by design; connecting to the socket tells.
+        return True
+    now = time.time() if now is None else now
+    return now - lease.get("heartbeat", 0) <= ttl
+
+
+# --- Handoff protocol ---
+
+def recv_exact(sock, count):
+    data = bytearray()
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise ConnectionError("handoff peer closed the connection")
+        data += chunk
+    return bytes(data)
+
+
+def encode_request(sequence, priority=0):
+    header = bytes((ord("S"), priority & 0xFF, len(sequence)))
+    return header + b"".join(bytes(report).ljust(REPORT_SIZE, b"\x00") for report in sequence)
+
+
+def read_request(sock):
+    """Reads one request; returns (sequence, priority) or None at EOF."""
+    first = sock.recv(1)
+    if not first:
+        return None
+    if first != b"S":
+        raise ValueError(f"unknown handoff request {first!r}")
+    priority, count = recv_exact(sock, 2)
+    priority = priority - 256 if priority > 127 else priority
+    body = recv_exact(sock, count * REPORT_SIZE)
+    return [body[i:i + REPORT_SIZE] for i in range(0, len(body), REPORT_SIZE)], priority
+
+
+class HandoffServer:
+    """Accepts forwarded sequences on the lease's socket and submits them."""
+
+    def __init__(self, socket_path, controller):
+        import socket
+        import threading
+
+        self.socket_path = socket_path
+        self.controller = controller
+        try:
+            os.remove(socket_path)
+        except FileNotFoundError:
+            pass
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(socket_path)
+        self.listener.listen(16)
+        self.thread = threading.Thread(target=self._accept, name="gembird-handoff", daemon=True)
+        self.thread.start()
+
+    def _accept(self):
+        import threading
+
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = read_request(conn)
+                except (OSError, ValueError):
+                    return
+                if request is None:
+                    return
+                sequence, priority = request
+                try:
+                    self.controller.send(sequence, priority=priority)
+                except Exception as ex:
+                    message = str(ex).encode()[:0xFFFF]
+                    reply = b"\x01" + len(message).to_bytes(2, "little") + message
+                else:
+                    reply = b"\x00"
+                try:
+                    conn.sendall(reply)
+                except OSError:
+                    return
+
+    def close(self):
+        import socket
+
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.listener.close()
+        self.thread.join()
+
+
+# --- Sessions ---
+
+class LocalSession:
+    """
+    This process holds the lock and writes to the device itself. When
+    serving, it publishes a lease and forwards other processes' sequences
+    through its Controller; a one-shot session just writes directly.
+    """
+
+    def __init__(self, lease, transport, serve=True, pacing=sequence_gap):
+        self.lease = lease
+        self.transport = transport
+        self.pacing = pacing
+        self.controller = None
+        self.server = None
+        if serve:
+            from gembird.controller import Controller
+
+            self.controller = Controller(transport, gap_for=pacing)
+            self.server = HandoffServer(lease.socket_path, self.controller)
+            lease.start_heartbeat()
+
+    def send(self, sequence, priority=0):
+        if self.controller is None:
+            self.transport.send_sequence(sequence, self.pacing(sequence))
+        else:
+            self.controller.send(sequence, priority=priority)
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.controller.close()
+        self.transport.close()
+        self.lease.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RemoteSession:
+    """Another process holds the lease; sequences are forwarded to it."""
+
+    def __init__(self, lease_info):
+        import socket
+
+        self.holder = lease_info
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(lease_info["socket"])
+
+    def send(self, sequence, priority=0):
+        self.sock.sendall(encode_request(sequence, priority))
+        status = recv_exact(self.sock, 1)
+        if status != b"\x00":
+            length = int.from_bytes(recv_exact(self.sock, 2), "little")
+            raise OSError(f"holder ({self.holder['owner']}) failed: {recv_exact(self.sock, length).decode()}")
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_session(path=None, backend="auto", serve=True, owner=None, wait=2.0):
+    """
+    Returns a session that can ``send`` sequences to the keyboard: a
+    LocalSession (writing through a ResilientTransport, paced by this host's
+    calibration profile) if the lock was free, otherwise a RemoteSession
+    forwarding to the current holder. ``serve`` controls whether a local holder
+    accepts handoffs (one-shot commands do not need to).
+    Raises DeviceBusy if the holder does not accept handoffs or is hung.
+    """
+    from gembird import device as gdevice
+    from gembird.pacing import device_serial, load_pacing
+    from gembird.resilient import ResilientTransport
+
+    path = gdevice.resolve_path(path)
+    lease = Lease(path, owner=owner)
+    deadline = time.monotonic() + wait
+    while True:
+        if lease.try_acquire():
+            try:
+                transport = ResilientTransport(
+                    lambda rediscover: gdevice.open_device(None if rediscover else path,
+                                                           use_cache=not rediscover, backend=backend))
+            except BaseException:
+                lease.release()
+                raise
+            return LocalSession(lease, transport, serve=serve, pacing=load_pacing(device_serial(path)))
+
+        info = lease.read()
+        if lease_is_fresh(info) and info.get("socket"):
+            try:
+                return RemoteSession(info)
+            except OSError:
+                pass
+        if time.monotonic() >= deadline:
+            break
+        # The holder is a one-shot command, is between lock and lease
+        # publication, or is exiting: the lock frees up shortly.
+        time.sleep(0.05)
+
+    if info is None:
+        raise DeviceBusy(f"{path!r} is still locked after {wait:g}s")
+    if not lease_is_fresh(info):
+        raise DeviceBusy(f"{path!r} is locked by {info.get('owner')} (pid {info.get('pid')}), "
+                         "which stopped heartbeating")
+    raise DeviceBusy(f"{path!r} is held by {info['owner']} (pid {info['pid']}), "
+                     "which does not accept handoffs")
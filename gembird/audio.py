@@ -0,0 +1,308 @@
+"""Audio-reactive lighting fed from a PCM stream.
+
+Audio arrives as blocks of samples from a source; every ``rate / fps``
+samples the ``Visualizer`` looks at the newest ``WINDOW`` samples through
+a Hann window, takes their FFT and sums the power into log-spaced bands,
+one per key column of the layout. Levels are in dB relative to a
+full-scale sine, mapped onto ``range_db`` of headroom, and fall back
+slowly (``release`` per second) so bars do not flicker.
+
+* ``spectrum``: each column is a bar, green at the bottom to red on top,
+  the topmost key of a bar dimmed by how far into it the level reaches;
+* ``vu``: the whole keyboard is one level meter, filling left to right.
+
+Levels are quantised to whole colour steps, and a frame identical to the
+last one is not submitted at all; the rest goes to a ``FrameWriter``,
+which sends only the chunks that changed and drops frames the link could
+not carry in time.
+
+Sources yield mono float32 blocks and have ``rate`` and ``realtime``:
+
+* ``PcmSource``: raw PCM (s16le or f32le, interleaved channels) from stdin,
+  a FIFO or a file, e.g. ``parec --format=s16le --rate=48000 | gembird
+  audio -`` or ``ffmpeg -i song.mp3 -f s16le -ar 48000 -ac 2 -``;
+* ``WavSource``: a WAV file (8, 16 or 32-bit PCM), played in real time;
+* ``SyntheticAudio``: a tone sweep, for tests and benchmarks.
+
+NumPy is required.
+"""
+
+import math
+import time
+
+from gembird.protocol import FRAME_SIZE, SLOT_BLUE, SLOT_GREEN, SLOT_RED
+
+WINDOW = 2048
+MODES = ("spectrum", "vu")
+
+
+# --- Sources ---
+
+class PcmSource:
+    """Raw interleaved PCM from a binary file object (stdin, a FIFO, a file)."""
+
+    FORMATS = {"s16le": ("<i2", 32768.0), "f32le": ("<f4", 1.0)}
+
+    def __init__(self, stream, rate=48000, channels=2, format="s16le", block=1024):
+        if format not in self.FORMATS:
+            raise ValueError(f"unknown PCM format {format!r}; use one of {', '.join(self.FORMATS)}")
+        self.stream = stream
+        self.rate = rate
+        self.channels = channels
+        self.dtype, self.scale = self.FORMATS[format]
+        self.block = block
+        # A pipe or FIFO delivers audio as it is played; nothing to pace.
+        self.realtime = True
+
+    def __iter__(self):
+        import numpy
+
+        width = int(self.dtype[-1]) * self.channels
+        size = self.block * width
+        while True:
+            data = self.stream.read(size)
+            if not data:
+                return
+            data = data[:len(data) - len(data) % width]
+            samples = numpy.frombuffer(data, dtype=self.dtype).astype(numpy.float32)
+            if self.scale != 1.0:
+                samples /= self.scale
+            yield samples.reshape(-1, self.channels).mean(axis=1) if self.channels > 1 else samples
+
+    def close(self):
+        self.stream.close()
+
+
+class WavSource:
+    """A PCM WAV file, in blocks of ``block`` frames."""
+
+    def __init__(self, path, block=1024, loop=False):
+        import wave
+
+        self.path = path
+        self.block = block
+        self.loop = loop
+        with wave.open(path, "rb") as wav:
+            self.rate = wav.getframerate()
+            self.channels = wav.getnchannels()
+            self.width = wav.getsampwidth()
+        if self.width not in (1, 2, 4):
+            raise ValueError(f"{path}: {self.width * 8}-bit samples are not supported")
+        self.realtime = False
+
+    def __iter__(self):
+        import wave
+
+        import numpy
+
+        dtype, offset, scale = {1: ("u1", 128.0, 128.0), 2: ("<i2", 0.0, 32768.0),
+                                4: ("<i4", 0.0, 2147483648.0)}[self.width]
+        while True:
+            with wave.open(self.path, "rb") as wav:
+                while True:
+                    data = wav.readframes(self.block)
+                    if not data:
+                        break
+                    samples = (numpy.frombuffer(data, dtype=dtype).astype(numpy.float32) - offset) / scale
+                    yield samples.reshape(-1, self.channels).mean(axis=1)
+            if not self.loop:
+                return
+
+    def close(self):
+        pass
+
+
+class SyntheticAudio:
+    """A sine sweeping from ``low`` to ``high`` Hz and back, ``seconds`` long."""
+
+    def __init__(self, rate=48000, seconds=10.0, block=1024, low=50.0, high=12000.0, amplitude=0.5):
+        self.rate = rate
+        self.seconds = seconds
+        self.block = block
+        self.low = low
+        self.high = high
+        self.amplitude = amplitude
+        self.realtime = False
+
+    def __iter__(self):
+        import numpy
+
+        total = int(self.rate * self.seconds)
+        phase = 0.0
+        for start in range(0, total, self.block):
+            t = (numpy.arange(start, min(total, start + self.block), dtype=numpy.float64)) / self.rate
+            # Exponential sweep up and back down, once per ``seconds``.
+            position = 1.0 - numpy.abs(2.0 * t / self.seconds - 1.0)
+            frequency = self.low * (self.high / self.low) ** position
+            phases = phase + 2.0 * math.pi * numpy.cumsum(frequency) / self.rate
+            phase = float(phases[-1]) % (2.0 * math.pi)
+            yield (self.amplitude * numpy.sin(phases)).astype(numpy.float32)
+
+    def close(self):
+        pass
+
+
+def open_audio(spec, rate=48000, channels=2, format="s16le", block=1024):
+    """
+    Opens a source from a command-line spec: ``-`` (stdin), ``synthetic``,
+    a ``.wav`` file, or any other path (a FIFO or file of raw PCM).
+    """
+    if spec == "-":
+        import sys
+
+        return PcmSource(sys.stdin.buffer, rate, channels, format, block)
+    if spec == "synthetic":
+        return SyntheticAudio(rate, block=block)
+    if spec.lower().endswith(".wav"):
+        return WavSource(spec, block)
+    return PcmSource(open(spec, "rb"), rate, channels, format, block)
+
+
+# --- Analysis ---
+
+def band_matrix(rate, size, bands, low=40.0, high=16000.0):
+    """
+    Returns a (bands x bins) matrix that sums FFT power into log-spaced
+    bands; a band narrower than one bin takes the bin nearest its centre.
+    """
+    import numpy
+
+    high = min(high, rate / 2.0)
+    edges = low * (high / low) ** (numpy.arange(bands + 1) / bands)
+    frequencies = numpy.fft.rfftfreq(size, 1.0 / rate)
+    matrix = numpy.zeros((bands, len(frequencies)), dtype=numpy.float32)
+    for band in range(bands):
+        inside = (frequencies >= edges[band]) & (frequencies < edges[band + 1])
+        if not inside.any():
+            inside[numpy.argmin(numpy.abs(frequencies - math.sqrt(edges[band] * edges[band + 1])))] = True
+        matrix[band, inside] = 1.0
+    return matrix
+
+
+class Visualizer:
+    """
+    Turns audio blocks into per-key frames and submits them to ``writer``
+    (a FrameWriter), ``fps`` times per second of audio.
+    """
+
+    def __init__(self, writer, layout, rate=48000, fps=60, mode="spectrum", range_db=60.0, gain_db=0.0,
+                 release=1.5, low=40.0, high=16000.0, brightness=1.0):
+        import numpy
+
+        if mode not in MODES:
+            raise ValueError(f"unknown mode {mode!r}; use one of {', '.join(MODES)}")
+        self.writer = writer
+        self.rate = rate
+        self.fps = fps
+        self.mode = mode
+        self.hop = max(1, round(rate / fps))
+        self.range_db = range_db
+        self.gain_db = gain_db
+        self.fall = release / fps
+        self.brightness = brightness
+
+        self.window = numpy.hanning(WINDOW).astype(numpy.float32)
+        # Power of a full-scale sine's peak bin through this window: 0 dB.
+        self.reference = (self.window.sum() / 2.0) ** 2
+        self.history = numpy.zeros(WINDOW, dtype=numpy.float32)
+        self.waiting = 0
+
+        xs = numpy.array([x for x, _ in layout.positions], dtype=numpy.float32)
+        ys = numpy.array([y for _, y in layout.positions], dtype=numpy.float32)
+        width, height = max(1, layout.width), max(1, layout.height)
+        self.bands = width
+        self.matrix = band_matrix(rate, WINDOW, width, low, high)
+        if mode == "spectrum":
+            self.column = xs.astype(numpy.intp)
+            # Rows counted from the bottom; bars grow upwards.
+            self.position = (height - 1) - ys
+            self.span = height
+            shade = self.position / max(1, height - 1)
+        else:
+            self.column = numpy.zeros(len(xs), dtype=numpy.intp)
+            self.position = xs
+            self.span = width
+            shade = xs / max(1, width - 1)
+        # Green, through yellow, to red.
+        self.colors = numpy.stack([numpy.clip(2.0 * shade, 0, 1) * 255,
+                                   numpy.clip(2.0 - 2.0 * shade, 0, 1) * 255,
+                                   numpy.zeros_like(shade)], axis=1).astype(numpy.float32)
+        self.colors *= brightness
+        bases = numpy.array([slot * 3 for slot in layout.slots])
+        self.channels = (bases + SLOT_RED, bases + SLOT_GREEN, bases + SLOT_BLUE)
+        self.levels = numpy.zeros(self.bands if mode == "spectrum" else 1, dtype=numpy.float32)
+        self.frame = numpy.zeros(FRAME_SIZE, dtype=numpy.uint8)
+        self.last = None
+        self.frames = 0
+        self.submitted = 0
+
+    def analyse(self):
+        """Returns the current levels (0..1): one per band, or one for ``vu``."""
+        import numpy
+
+        if self.mode == "spectrum":
+            spectrum = numpy.fft.rfft(self.history * self.window)
+            power = spectrum.real ** 2 + spectrum.imag ** 2
+            energy = self.matrix @ power.astype(numpy.float32)
+            decibels = 10.0 * numpy.log10(energy / self.reference + 1e-12)
+        else:
+            recent = self.history[-self.hop:]
+            # RMS of a full-scale sine is 1/sqrt(2): 0 dB.
+            decibels = numpy.array([20.0 * math.log10(math.sqrt(2.0 * float(recent @ recent) / len(recent))
+                                                      + 1e-12)], dtype=numpy.float32)
+        return numpy.clip((decibels + self.gain_db + self.range_db) / self.range_db, 0.0, 1.0)
+
+    def render(self):
+        """Builds the frame for the current levels; returns whether it changed."""
+        import numpy
+
+        self.levels = numpy.maximum(self.analyse(), self.levels - self.fall)
+        lit = numpy.clip(self.levels[self.column] * self.span - self.position, 0.0, 1.0)
+        colors = numpy.rint(self.colors * lit[:, None]).astype(numpy.uint8)
+        red, green, blue = self.channels
+        self.frame[red] = colors[:, 0]
+        self.frame[green] = colors[:, 1]
+        self.frame[blue] = colors[:, 2]
+        self.frames += 1
+        if self.last is not None and numpy.array_equal(self.frame, self.last):
+            return False
+        self.last = self.frame.copy()
+        return True
+
+    def feed(self, samples):
+        """Takes one block of mono samples; renders and submits a frame every ``hop`` samples."""
+        import numpy
+
+        samples = numpy.asarray(samples, dtype=numpy.float32)
+        rendered = 0
+        while len(samples):
+            take = min(len(samples), self.hop - self.waiting)
+            history = self.history
+            if take >= WINDOW:
+                history[:] = samples[take - WINDOW:take]
+            else:
+                history[:-take] = history[take:]
+                history[-take:] = samples[:take]
+            samples = samples[take:]
+            self.waiting += take
+            if self.waiting == self.hop:
+                self.waiting = 0
+                rendered += 1
+                if self.render():
+                    self.writer.submit(self.frame.tobytes())
+                    self.submitted += 1
+        return rendered
+
+    def run(self, source, stop=None, paced=True):
+        """Follows ``source`` until it ends; file sources are paced to real time unless ``paced`` is False."""
+        start = time.monotonic()
+        played = 0
+        for block in source:
+            if stop is not None and stop.is_set():
+                break
+            self.feed(block)
+            played += len(block)
+            if paced and not source.realtime:
+                wait = start + played / source.rate - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
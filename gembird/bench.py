@@ -0,0 +1,1644 @@
+"""Built-in benchmarks, run with ``python -m gembird bench NAME``.
+
+Each benchmark prints its measurements and returns a non-zero exit status
+when it misses its budget, so they can gate changes from a shell or CI job.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS = {}
+
+# Modules that must never be imported on the one-shot colour path.
+HEAVY_MODULES = ("hid", "numpy", "asyncio", "concurrent", "multiprocessing")
+
+
+def benchmark(name):
+    """Registers a benchmark function under ``name``."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+# Checks that failed in the running benchmark; any makes it exit non-zero.
+_failures = 0
+
+
+def run(name, args):
+    """Runs one benchmark, or ``all`` of them; non-zero if any check failed."""
+    global _failures
+
+    if name == "all":
+        failed = []
+        for each in sorted(BENCHMARKS):
+            print(f"== {each}")
+            if run(each, args):
+                failed.append(each)
+        print(f"{'✅' if not failed else '❌'} {len(BENCHMARKS) - len(failed)} of {len(BENCHMARKS)} "
+              f"benchmarks passed" + (f"; failed: {', '.join(failed)}" if failed else ""))
+        return 1 if failed else 0
+    func = BENCHMARKS.get(name)
+    if func is None:
+        print(f"Unknown benchmark '{name}'. Available: all, {', '.join(sorted(BENCHMARKS))}", file=sys.stderr)
+        return 2
+    _failures = 0
+    result = func(args)
+    return result or (1 if _failures else 0)
+
+
+def check(passed, label):
+    """Prints one pass/fail line, records a failure and returns ``passed``."""
+    global _failures
+
+    if not passed:
+        _failures += 1
+    print(f"{'✅' if passed else '❌'} {label}")
+    return passed
+
+
+def report(label, value, budget, unit="ms"):
+    """
+    Prints one measurement against its budget and returns whether it passed;
+    without a budget it is only printed, with no pass mark.
+    """
+    if budget is None:
+        print(f"   {label}: {value:.2f} {unit}")
+        return True
+    return check(value <= budget, f"{label}: {value:.2f} {unit} (budget {budget:g} {unit})")
+
+
+def parse_importtime(stderr):
+    """Returns {module: (self_us, cumulative_us)} from ``-X importtime`` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def importtime(argv, env=None):
+    """Runs the interpreter with ``-X importtime`` and returns (modules, wall ms)."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", *argv],
+                          cwd=root, env=env, capture_output=True, text=True, check=True)
+    return parse_importtime(proc.stderr), (time.perf_counter() - start) * 1000
+
+
+@benchmark("startup")
+def bench_startup(args, runs=15):
+    """Cold-start budget of ``gembird set 255 0 0`` on a stand-in hidraw node, and of ``--dump``."""
+    import json
+    import tempfile
+
+    from gembird.pacing import DEFAULT_GAPS, host_name, profile_key
+
+    budget = args.budget_ms if args.budget_ms is not None else 60.0
+
+    interpreter, _ = importtime(["-c", "pass"])
+    with tempfile.TemporaryDirectory() as root:
+        # The real write path (arbitration, lease, resilient transport, pacing
+        # profile) on a FIFO standing in for /dev/hidrawN. The profile sets
+        # every gap to zero: the firmware's pauses are not startup time.
+        node = os.path.join(root, "hidraw-standin")
+        os.mkfifo(node)
+        os.makedirs(os.path.join(root, "gembird"))
+        with open(os.path.join(root, "gembird", "pacing.json"), "w") as f:
+            json.dump({profile_key("", host_name()): {"gaps": {kind: 0.0 for kind in DEFAULT_GAPS},
+                                                     "method": "bench"}}, f)
+        env = dict(os.environ, XDG_CONFIG_HOME=root, XDG_RUNTIME_DIR=root, XDG_CACHE_HOME=root)
+        # Held open so the reports stay in the pipe between runs.
+        reader = os.open(node, os.O_RDONLY | os.O_NONBLOCK)
+        commands = {
+            "set": ["-m", "gembird", "--path", node, "--backend", "hidraw", "set", "255", "0", "0"],
+            "--dump set": ["-m", "gembird", "--dump", "set", "255", "0", "0"],
+        }
+        extra_us, walls, heavy = {}, {}, set()
+        for _ in range(runs):
+            # Interleaved, so drift in the machine's speed hits both alike.
+            for label, argv in commands.items():
+                modules, wall = importtime(argv, env)
+                walls.setdefault(label, []).append(wall)
+                extra_us.setdefault(label, []).append(
+                    sum(s for name, (s, _) in modules.items() if name not in interpreter))
+                heavy.update(name for name in modules if name.split(".")[0] in HEAVY_MODULES)
+        written = len(os.read(reader, 1 << 16))
+        os.close(reader)
+
+    baseline = statistics.median(importtime(["-c", "pass"])[1] for _ in range(runs))
+    print(f"   interpreter start: {baseline:.2f} ms (median of {runs})")
+    for label in commands:
+        print(f"   {label}: imports beyond the bare interpreter {statistics.median(extra_us[label]) / 1000:.2f} ms, "
+              f"wall {statistics.median(walls[label]):.2f} ms")
+    ok = report("gembird set wall time, through arbitration to a stand-in node", statistics.median(walls["set"]),
+                budget)
+    delivered = written == runs * 3 * 64
+    check(delivered, "every run wrote its 3 reports to the stand-in node")
+    if heavy:
+        check(False, f"heavy modules imported on the colour path: {', '.join(sorted(heavy))}")
+        ok = False
+    return 0 if ok and delivered else 1
+
+
+def drain(fd):
+    """Reads and discards everything arriving on ``fd`` until EOF."""
+    while os.read(fd, 65536):
+        pass
+
+
+def write_throughput(transport, sequence, count):
+    """Writes ``count`` sequences back to back and returns reports per second."""
+    send = transport.send_sequence
+    start = time.perf_counter()
+    for _ in range(count):
+        send(sequence)
+    return count * len(sequence) / (time.perf_counter() - start)
+
+
+@benchmark("transport")
+def bench_transport(args, count=20000):
+    """Raw write throughput of the transports, with pacing disabled."""
+    import socket
+    import threading
+
+    from gembird import protocol
+    from gembird.transport import HidrawTransport
+
+    sequence = protocol.create_uniform_color_sequence(0, 0, 0)
+
+    # A SOCK_SEQPACKET pair keeps report boundaries like a hidraw node does.
+    device_end, host_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    reader = threading.Thread(target=drain, args=(device_end.fileno(),), daemon=True)
+    reader.start()
+    with HidrawTransport(fd=host_end.fileno()) as transport:
+        rate = write_throughput(transport, sequence, count)
+    host_end.close()
+    reader.join()
+    device_end.close()
+    print(f"   hidraw (socketpair stand-in): {rate:,.0f} reports/s")
+
+    try:
+        from gembird import device as gdevice
+
+        path = gdevice.find_control_interface()
+    except ImportError:
+        path = None
+    if not path:
+        print("   hidapi / hidraw on the keyboard: skipped (no hid binding or no device)")
+        return 0
+    for backend in ("hidapi", "hidraw"):
+        if backend == "hidraw" and not path.startswith(b"/dev/hidraw"):
+            continue
+        with gdevice.open_device(path, backend=backend) as transport:
+            rate = write_throughput(transport, sequence, 200)
+        print(f"   {backend} on the keyboard: {rate:,.0f} reports/s")
+    return 0
+
+
+@benchmark("libusb")
+def bench_libusb(args, frames=50, latency=0.002, interval=0.00025):
+    """Serial versus pipelined per-key frames on a fake libusb context."""
+    from gembird import protocol
+    from gembird.libusb import FakeContext, LibusbTransport
+
+    sequence = protocol.create_uniform_color_sequence(255, 0, 0)
+    for depth in (1, 4, 7):
+        context = FakeContext(latency=latency, interval=interval)
+        with LibusbTransport(context=context, depth=depth) as transport:
+            start = time.perf_counter()
+            for _ in range(frames):
+                transport.send_sequence(sequence)
+            elapsed = time.perf_counter() - start
+        assert context.written == sequence * frames, "reports arrived out of order"
+        print(f"   depth {depth}: {frames / elapsed:6.1f} frames/s, "
+              f"max in flight {context.max_in_flight}")
+    return bench_libusb_session(sequence, frames // 5, latency, interval)
+
+
+def bench_libusb_session(sequence, frames, latency, interval, gap=0.004):
+    """Paced frames through open_session and ResilientTransport, serial and pipelined."""
+    import tempfile
+
+    from gembird import device as gdevice
+    from gembird.arbitration import open_session
+    from gembird.libusb import FakeContext, LibusbTransport
+    from gembird.pacing import DEFAULT_GAPS, store_pacing
+
+    open_device = gdevice.open_device
+    saved = {name: os.environ.get(name) for name in ("XDG_RUNTIME_DIR", "XDG_CONFIG_HOME")}
+    rates = {}
+    spacing_ok = True
+    with tempfile.TemporaryDirectory() as root:
+        os.environ.update(XDG_RUNTIME_DIR=root, XDG_CONFIG_HOME=root)
+        store_pacing("", {kind: gap for kind in DEFAULT_GAPS}, "bench")
+        try:
+            for mode in ("serial", "pipelined"):
+                arrivals = []
+                context = FakeContext(latency=latency, interval=interval,
+                                      sink=lambda report: arrivals.append(time.monotonic()))
+
+                def opener(*_, **__):
+                    transport = LibusbTransport(context=context, depth=4)
+                    # Serial: one blocking write then the gap, as the other backends do.
+                    transport.pipelined = mode == "pipelined"
+                    return transport
+
+                gdevice.open_device = opener
+                with open_session("bench-libusb", backend="libusb", serve=False) as session:
+                    start = time.perf_counter()
+                    for _ in range(frames):
+                        session.send(sequence)
+                    elapsed = time.perf_counter() - start
+                assert context.written == sequence * frames, "reports arrived out of order"
+                rates[mode] = frames / elapsed
+                # The firmware must still get its gap between packets (less a little timer jitter).
+                closest = min(b - a for a, b in zip(arrivals, arrivals[1:]))
+                spacing_ok = spacing_ok and closest >= gap * 0.9
+                print(f"   session, {mode}, {gap * 1000:g} ms gaps: {rates[mode]:6.1f} frames/s, "
+                      f"closest packets {closest * 1000:.2f} ms apart, max in flight {context.max_in_flight}")
+        finally:
+            gdevice.open_device = open_device
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+    faster = rates["pipelined"] > rates["serial"] * 1.1
+    check(faster, f"pipelined paced frames through a session are "
+          f"{(rates['pipelined'] / rates['serial'] - 1) * 100:.0f}% faster than serial ones")
+    check(spacing_ok, "every pacing gap kept on the wire")
+    return 0 if faster and spacing_ok else 1
+
+
+@benchmark("controller")
+def bench_controller(args, producers=8, per_producer=500):
+    """Many threads submitting sequences; checks that none interleave."""
+    import threading
+
+    from gembird import protocol
+    from gembird.controller import Controller
+    from gembird.transport import MemoryTransport
+
+    transport = MemoryTransport()
+    submit_ns = []
+
+    def produce(n):
+        sequence = (protocol.create_uniform_color_sequence(n, n, n) if n % 2
+                    else protocol.create_true_static_color_sequence(n, n, n))
+        futures = []
+        for _ in range(per_producer):
+            start = time.perf_counter_ns()
+            futures.append(controller.submit(sequence, priority=n % 3, gap=0))
+            submit_ns.append(time.perf_counter_ns() - start)
+        for future in futures:
+            future.result()
+
+    with Controller(transport) as controller:
+        start = time.perf_counter()
+        threads = [threading.Thread(target=produce, args=(n,)) for n in range(producers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    # Every run of packets must be one complete sequence from one producer.
+    written, i, ok = transport.written, 0, True
+    while i < len(written):
+        n = written[i][8] if written[i][3] == protocol.CMD_PER_KEY else written[i + 1][14]
+        expected = (protocol.create_uniform_color_sequence(n, n, n) if n % 2
+                    else protocol.create_true_static_color_sequence(n, n, n))
+        if written[i:i + len(expected)] != expected:
+            ok = False
+            break
+        i += len(expected)
+    total = producers * per_producer
+    print(f"   {total} sequences from {producers} threads in {elapsed * 1000:.1f} ms")
+    print(f"   submit() median {statistics.median(submit_ns) / 1000:.1f} us, "
+          f"max {max(submit_ns) / 1000:.1f} us")
+    check(ok, "sequences written atomically")
+    return 0 if ok else 1
+
+
+@benchmark("discovery")
+def bench_discovery(args, others=300, runs=50):
+    """sysfs discovery on a fixture tree with hundreds of unrelated HID nodes."""
+    import tempfile
+
+    from gembird import discovery
+
+    budget = args.budget_ms if args.budget_ms is not None else 5.0
+    with tempfile.TemporaryDirectory() as root:
+        discovery.build_fixture(root, others=others)
+        discovery.clear_cache()
+        start = time.perf_counter()
+        path = discovery.find_control_interface(sysfs=root)
+        cold = (time.perf_counter() - start) * 1000
+        warm = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            discovery.find_control_interface(sysfs=root)
+            warm.append((time.perf_counter() - start) * 1000)
+        # What a one-shot command pays: the first scan in a fresh interpreter.
+        script = ("import time; from gembird import discovery; start = time.perf_counter(); "
+                  f"discovery.find_control_interface(sysfs={root!r}); "
+                  "print((time.perf_counter() - start) * 1000)")
+        package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        fresh = [float(subprocess.run([sys.executable, "-c", script], cwd=package, capture_output=True,
+                                      text=True, check=True).stdout) for _ in range(9)]
+    print(f"   {others + 3} hidraw nodes, found {path.decode() if path else None}")
+    print(f"   cold scan in this process (descriptors parsed): {cold:.2f} ms")
+    ok = report("cold scan in a fresh process, as one-shot commands run it (median)",
+                statistics.median(fresh), budget) and path is not None
+    ok &= report("warm scan (descriptor cache hit)", statistics.median(warm), budget)
+
+    try:
+        import hid
+    except ImportError:
+        print("   hid.enumerate: skipped (no hid binding)")
+    else:
+        from gembird import PRODUCT_ID, VENDOR_ID
+
+        times = []
+        for _ in range(10):
+            start = time.perf_counter()
+            hid.enumerate(VENDOR_ID, PRODUCT_ID)
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"   hid.enumerate on this host: {statistics.median(times):.2f} ms")
+        times = []
+        for _ in range(10):
+            start = time.perf_counter()
+            discovery.find_control_interface()
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"   sysfs scan on this host: {statistics.median(times):.2f} ms")
+    return 0 if ok else 1
+
+
+@benchmark("resilient")
+def bench_resilient(args, frames=2000, failure_rate=0.02):
+    """Per-key frames over a flaky link: resume-from-chunk versus full resend."""
+    import errno
+    import random
+
+    from gembird import protocol
+    from gembird.resilient import Backoff, FlakyTransport, ResilientTransport
+    from gembird.transport import MemoryTransport
+
+    sequence = protocol.create_uniform_color_sequence(0, 128, 255)
+    rng = random.Random(460)
+    schedule = {n: OSError(rng.choice((errno.EIO, errno.ENODEV)), "flaky hub")
+                for n in range(frames * 10) if rng.random() < failure_rate}
+
+    mem = MemoryTransport()
+    flaky = FlakyTransport(mem, dict(schedule))
+    transport = ResilientTransport(lambda rediscover: flaky, backoff=Backoff(base=0.0), sleep=lambda s: None)
+    for _ in range(frames):
+        transport.send_sequence(sequence)
+    metrics = transport.metrics()
+    resume_writes = flaky.count
+
+    # Baseline: resend the whole sequence whenever any packet fails.
+    flaky = FlakyTransport(MemoryTransport(), dict(schedule))
+    for _ in range(frames):
+        while True:
+            try:
+                flaky.send_sequence(sequence)
+                break
+            except OSError:
+                pass
+    print(f"   {frames} frames, {len(schedule)} injected failures in the schedule")
+    print(f"   write attempts: resume {resume_writes}, full resend {flaky.count}")
+    for key in ("retries", "reopens", "resumed_sequences", "packets_not_resent", "failures"):
+        print(f"   {key}: {metrics[key]}")
+    ok = metrics["failures"] == 0 and len(mem.written) == frames * len(sequence)
+    check(ok, "every frame delivered exactly once")
+    return 0 if ok else 1
+
+
+@benchmark("transitions")
+def bench_transitions(args, renders=2000):
+    """Per-frame render cost, and fades that adapt to a slow link."""
+    from gembird import protocol
+    from gembird.controller import Controller
+    from gembird.frames import FrameWriter
+    from gembird.transitions import EASINGS, SPACES, TransitionEngine, ease, mix
+
+    budget = args.budget_ms if args.budget_ms is not None else 1.0
+    encode, decode = SPACES["oklab"]
+    slots = [(slot, encode((255, 0, slot * 2)), encode((0, 255 - slot, 255)))
+             for slot in range(protocol.SLOT_COUNT) if slot not in protocol.UNUSED_SLOTS]
+    frame, table = protocol.new_frame(), EASINGS["ease-in-out"]
+    start = time.perf_counter()
+    for i in range(renders):
+        k = ease(table, i / renders)
+        for slot, a, b in slots:
+            protocol.set_slot(frame, slot, *decode(mix(a, b, k)))
+    per_frame = (time.perf_counter() - start) * 1000 / renders
+    ok = report(f"per-key Oklab frame render ({len(slots)} keys)", per_frame, budget)
+
+    class PacedTransport:
+        """Stands in for the keyboard: each packet takes its pacing gap."""
+        def send_sequence(self, sequence, gap):
+            time.sleep(len(sequence) * gap)
+
+    with Controller(PacedTransport()) as controller:
+        engine = TransitionEngine(controller, current=(255, 0, 0))
+        for ms in (300, 1000):
+            stats = engine.fade_to((0, 0, 255), ms)
+            late = stats["elapsed"] * 1000 - ms
+            print(f"   normal-mode fade {ms} ms: {stats['frames']} frames "
+                  f"(planned {stats['planned_frames']}), ended {late:+.1f} ms vs target")
+            ok &= abs(late) < 20
+            engine.current = (255, 0, 0)
+
+        writer = FrameWriter(controller)
+        engine = TransitionEngine(controller, writer)
+        stats = engine.fade_frame_to(protocol.fill_frame(protocol.new_frame(), 0, 255, 0), 1000)
+        print(f"   per-key fade 1000 ms: {stats['frames']} frames ({writer.chunks} chunks), "
+              f"ended {stats['elapsed'] * 1000 - 1000:+.1f} ms vs target")
+    return 0 if ok else 1
+
+
+@benchmark("calibration")
+def bench_calibration(args, trials=5):
+    """Calibration against emulated firmware with known processing times."""
+    from gembird import pacing
+    from gembird.calibration import Calibration, EmulatorVerifier
+    from gembird.emulator import virtual_keyboard
+    from gembird.protocol import create_true_static_color_sequence, create_uniform_color_sequence
+
+    processing = {"prepare": 0.0032, "properties": 0.0071, "execute": 0.0049, "per-key": 0.0023}
+    transport, keyboard, clock = virtual_keyboard(processing)
+    calibration = Calibration(transport, EmulatorVerifier(keyboard), trials=trials, sleep=clock.sleep, seed=460)
+    gaps = calibration.run()
+    ok = True
+    for kind, gap in gaps.items():
+        safe = gap >= processing[kind]
+        ok &= safe
+        check(safe, f"{kind}: {gap * 1000:.1f} ms for {processing[kind] * 1000:.1f} ms of "
+              f"processing (default {pacing.DEFAULT_GAPS[kind] * 1000:g} ms)")
+    print(f"   {calibration.sequences} trial sequences, {keyboard.dropped} packets dropped while searching")
+
+    calibrated = pacing.Pacing(gaps)
+    for label, sequence in (("normal-mode", create_true_static_color_sequence(1, 2, 3)),
+                            ("per-key", create_uniform_color_sequence(1, 2, 3))):
+        default = sum(pacing.Pacing()(sequence)) * 1000
+        tuned = sum(calibrated(sequence)) * 1000
+        print(f"   {label} sequence: {tuned:.1f} ms paced (default {default:.1f} ms, {default / tuned:.1f}x)")
+
+    # Run the calibrated pacing back to back: nothing may be dropped.
+    clock.sleep(calibration.high)
+    before = keyboard.dropped
+    for i in range(200):
+        sequence = create_true_static_color_sequence(i, 0, 0) if i % 2 else create_uniform_color_sequence(0, i, 0)
+        transport.send_sequence(sequence, calibrated(sequence))
+    clean = keyboard.dropped == before
+    check(clean, "200 sequences at the calibrated pacing, none dropped")
+    return 0 if ok and clean else 1
+
+
+@benchmark("openrgb")
+def bench_openrgb(args, clients=32, updates=50):
+    """Many OpenRGB clients against the emulator: loop latency and frame coalescing."""
+    import asyncio
+    import random
+
+    from gembird.controller import Controller
+    from gembird.emulator import EmulatorTransport
+    from gembird.layout import default_layout
+    from gembird.openrgb import KeyboardController, OpenRGBClient, OpenRGBServer
+    from gembird.pacing import Pacing
+
+    budget = args.budget_ms if args.budget_ms is not None else 20.0
+    layout = default_layout()
+    transport = EmulatorTransport()
+    sink = Controller(transport, gap_for=Pacing({"per-key": 0.0075}))
+    controller = KeyboardController(sink, layout)
+    server = OpenRGBServer(controller, port=0)
+    latencies = []
+
+    async def client(seed):
+        rng = random.Random(seed)
+        conn = await OpenRGBClient.connect(port=server.port, name=f"bench-{seed}")
+        for _ in range(updates):
+            colors = [(rng.randrange(256), rng.randrange(256), rng.randrange(256))] * len(layout)
+            await conn.update_leds(colors)
+            start = time.perf_counter()
+            await conn.controller_count()
+            latencies.append((time.perf_counter() - start) * 1000)
+        await conn.close()
+
+    async def main():
+        await server.start()
+        check = await OpenRGBClient.connect(port=server.port)
+        name, modes, names, _ = await check.controller_data()
+        print(f"   {name}: {len(names)} LEDs, modes {', '.join(mode.name for mode in modes)}")
+        start = time.perf_counter()
+        await asyncio.gather(*(client(seed) for seed in range(clients)))
+        elapsed = time.perf_counter() - start
+        await check.update_leds([(1, 2, 3)] * len(layout))
+        await check.controller_count()
+        await check.close()
+        await server.close()
+        return elapsed, len(names) == len(layout)
+
+    elapsed, described = asyncio.run(main())
+    controller.writer.flush()
+    latencies.sort()
+    total = clients * updates + 1
+    writer = controller.writer
+    print(f"   {total} updates from {clients} clients in {elapsed * 1000:.0f} ms; "
+          f"{writer.frames} frames written, {writer.dropped} coalesced, {writer.chunks} chunks")
+    ok = report("request round trip, median", statistics.median(latencies), None)
+    ok &= report("request round trip, p99", latencies[int(len(latencies) * 0.99)], budget)
+    shown = transport.keyboard.frame == controller.frame
+    check(shown, f"keyboard shows the newest update, {transport.keyboard.dropped} packets dropped")
+    controller.close()
+    sink.close()
+    return 0 if ok and shown and described else 1
+
+
+def _shm_producer(path, ident, frames, results):
+    """One producer process for bench_shm: writes uniform frames as fast as it can."""
+    from gembird.shm import FrameProducer
+
+    producer = FrameProducer(path=path)
+    pattern = [bytes([(ident * 64 + i) % 256]) * 384 for i in range(256)]
+    timings = []
+    for i in range(frames):
+        start = time.perf_counter()
+        with producer:
+            producer.write(pattern[i % 256])
+        timings.append(time.perf_counter() - start)
+    producer.close()
+    results.put(statistics.median(timings) * 1e6)
+
+
+@benchmark("shm")
+def bench_shm(args, producers=4, frames=20000):
+    """Producer processes writing the shared framebuffer while the owner pushes it."""
+    import multiprocessing
+    import shutil
+    import tempfile
+    import threading
+
+    from gembird.controller import Controller
+    from gembird.emulator import EmulatorTransport
+    from gembird.frames import FrameWriter
+    from gembird.pacing import Pacing
+    from gembird.shm import FramebufferOwner, FrameProducer
+
+    budget = args.budget_ms * 1000 if args.budget_ms is not None else 50.0
+    transport = EmulatorTransport()
+    sink = Controller(transport, gap_for=Pacing({"per-key": 0.0075}))
+    writer = FrameWriter(sink)
+    torn = []
+    checking = [True]
+
+    class CheckingWriter:
+        """Every snapshot must be one producer's whole frame."""
+        def show(self, frame):
+            if checking[0] and frame.count(frame[0]) != len(frame):
+                torn.append(bytes(frame))
+            return writer.show(frame)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="gembird-shm-"), "bench.fb")
+    owner = FramebufferOwner(CheckingWriter(), path=path, interval=1 / 240)
+    stop = threading.Event()
+    thread = threading.Thread(target=owner.run, args=(stop,), daemon=True)
+    thread.start()
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    start = time.perf_counter()
+    workers = [context.Process(target=_shm_producer, args=(path, ident, frames, results)) for ident in range(producers)]
+    for worker in workers:
+        worker.start()
+    medians = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    time.sleep(0.1)
+
+    # A single-key change must cost one data chunk plus the commit chunk.
+    checking[0] = False
+    chunks = writer.chunks
+    producer = FrameProducer(path=path)
+    with producer:
+        producer.set_slot(20, 1, 2, 3)
+    time.sleep(0.1)
+    producer.close()
+    delta = writer.chunks - chunks
+    stop.set()
+    thread.join()
+    owner.close()
+    sink.close()
+    shutil.rmtree(os.path.dirname(path))
+
+    total = producers * frames
+    print(f"   {producers} producers wrote {total} frames in {elapsed * 1000:.0f} ms "
+          f"({total / elapsed:,.0f} frames/s); owner pushed {owner.pushed}, {owner.retries} seqlock retries")
+    ok = report("producer frame (lock, write 384 bytes, stamp, unlock), median", max(medians), budget, "us")
+    clean = not torn and transport.keyboard.frame == owner.snapshot
+    check(clean, f"{len(torn)} torn snapshots; keyboard matches the last frame")
+    partial = delta == 2
+    check(partial, f"single-key change sent as {delta} chunks")
+    return 0 if ok and clean and partial else 1
+
+
+@benchmark("sync")
+def bench_sync(args, keyboards=3, frames=45, fps=15):
+    """Commit alignment across emulated keyboards, one of them slow: sequential versus staged."""
+    from gembird.emulator import EmulatorTransport
+    from gembird.pacing import Pacing
+    from gembird.protocol import fill_frame, new_frame, per_key_sequence
+    from gembird.sync import Lane, SyncGroup
+
+    budget = args.budget_ms if args.budget_ms is not None else 2.0
+    paces = [Pacing({"per-key": 0.0075}) for _ in range(keyboards - 1)] + [Pacing({"per-key": 0.03})]
+    animation = [bytes(fill_frame(new_frame(), i * 5 % 256, 255 - i * 5 % 256, 64)) for i in range(frames)]
+
+    def spreads(transports, count):
+        """Per-frame gap between the first and last keyboard applying it."""
+        commits = [transport.keyboard.commits[-count:] for transport in transports]
+        return [(max(times) - min(times)) * 1000 for times in zip(*commits)]
+
+    transports = [EmulatorTransport() for _ in paces]
+    for frame in animation[:15]:
+        for transport, pacing in zip(transports, paces):
+            sequence = per_key_sequence(frame)
+            transport.send_sequence(sequence, pacing(sequence))
+    sequential = spreads(transports, 15)
+    report("sequential writes, commit spread (median)", statistics.median(sequential), None)
+
+    transports = [EmulatorTransport() for _ in paces]
+    with SyncGroup(Lane(transport, pacing) for transport, pacing in zip(transports, paces)) as group:
+        group.play(animation, fps)
+        stats = group.stats()
+    fast = [time for transport in transports[:-1] for time in transport.keyboard.commits]
+    slow = transports[-1].keyboard.commits
+    ok = report("staged commits, spread (max)", stats["max_spread"] * 1000, budget)
+    for name, lane in stats["lanes"].items():
+        print(f"   {name}: {lane['committed']} committed, {lane['skipped']} skipped, "
+              f"staging {lane['stage_seconds'] * 1000:.0f} ms")
+    # Every frame the slow keyboard applied during playback, a fast one
+    # applied at the same moment (the catch-up to the last frame is alone).
+    in_phase = all(min(abs(time - other) for other in fast) < budget / 1000 for time in slow[:-1])
+    last = all(bytes(transport.keyboard.frame) == animation[-1] for transport in transports)
+    check(in_phase, f"slow keyboard committed {len(slow)} frames, all in phase with the others")
+    check(last, "every keyboard ends on the last frame")
+    return 0 if ok and in_phase and last else 1
+
+
+@benchmark("animation")
+def bench_animation(args, frames=600, width=480, height=180):
+    """Compiling a synthetic clip serially and in a process pool, then replaying it from the cache."""
+    try:
+        import numpy
+    except ImportError:
+        print("   animation: skipped (numpy not installed)")
+        return 0
+    import shutil
+    import tempfile
+
+    from gembird.animation import Clip, Plan, render_frames, write_clip
+    from gembird.layout import default_layout
+    from gembird.transport import MemoryTransport
+
+    x = numpy.linspace(0, 255, width, dtype=numpy.float32)[None, :]
+    y = numpy.linspace(0, 255, height, dtype=numpy.float32)[:, None]
+
+    def clip():
+        for i in range(frames):
+            pixels = numpy.empty((height, width, 3), dtype=numpy.uint8)
+            pixels[..., 0] = (x + i * 4) % 256
+            pixels[..., 1] = y
+            pixels[..., 2] = (x + y + i) % 256
+            yield pixels, 1000 / 30
+
+    plan = Plan(default_layout())
+    timings = {}
+    for label, workers in (("serial", 1), ("process pool", None)):
+        start = time.perf_counter()
+        buffers, durations = render_frames(clip(), plan, workers)
+        timings[label] = time.perf_counter() - start
+        # A timing, not a check: whether the pool pays off depends on the cores.
+        print(f"   render {frames} frames of {width}x{height}, {label}: {timings[label] * 1000:.2f} ms")
+
+    directory = tempfile.mkdtemp(prefix="gembird-animation-")
+    path = write_clip(os.path.join(directory, "bench.gban"), buffers, durations)
+    start = time.perf_counter()
+    sink = MemoryTransport()
+    with Clip(path) as compiled:
+        sink.send_sequence(compiled.prelude())
+        for number in range(compiled.frames):
+            sink.send_sequence(compiled.frame(number)[0])
+        size = os.path.getsize(path)
+    replay = (time.perf_counter() - start) * 1000
+    shutil.rmtree(directory)
+    ok = report(f"replay all {len(sink.written)} reports from the packet file", replay, None)
+    print(f"   packet file: {size / 1024:.0f} KiB, {size / frames:.0f} bytes per frame; "
+          f"pool speedup {timings['serial'] / timings['process pool']:.1f}x on {os.cpu_count()} cores")
+    return 0 if ok else 1
+
+
+@benchmark("ambient")
+def bench_ambient(args, frames=600, fps=30):
+    """CPU cost of following a 1080p source at 30 fps, per key and per zone."""
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print("   ambient: skipped (numpy not installed)")
+        return 0
+    from gembird.ambient import Ambient, SyntheticSource
+    from gembird.frames import FrameWriter
+    from gembird.layout import default_layout
+
+    budget = args.budget_ms if args.budget_ms is not None else 5.0
+
+    class CountingSink:
+        def __init__(self):
+            self.reports = 0
+
+        def send(self, sequence, priority=0):
+            self.reports += len(sequence)
+
+    source = SyntheticSource(1920, 1080, fps)
+    ok = True
+    for label, zones in (("per key", None), ("8 zones", 8)):
+        sink = CountingSink()
+        writer = FrameWriter(sink)
+        ambient = Ambient(writer, default_layout(), zones=zones)
+        pixels = iter(source)
+        start = time.process_time()
+        for number in range(frames):
+            # A simulated 30 fps clock, so smoothing behaves as it would live.
+            ambient.update(next(pixels), now=number / fps)
+        writer.flush()
+        cpu = time.process_time() - start
+        writer.close()
+        share = cpu / (frames / fps) * 100
+        ok &= report(f"{label}: CPU share of one core at {fps} fps", share, budget, "%")
+        print(f"   {cpu / frames * 1e6:.0f} us per frame; {ambient.pushed} of {frames} frames pushed, "
+              f"{ambient.keys_sent} key updates, {sink.reports} reports")
+    return 0 if ok else 1
+
+
+@benchmark("reactive")
+def bench_reactive(args, presses=60):
+    """Keypress-to-light latency through an injected event source and the emulator."""
+    import random
+    import threading
+
+    from gembird.controller import Controller
+    from gembird.emulator import EmulatorTransport
+    from gembird.frames import FrameWriter
+    from gembird.layout import Layout, default_layout
+    from gembird.pacing import Pacing
+    from gembird.protocol import SLOT_RED
+    from gembird.reactive import InjectedSource, Reactive
+
+    class FrameLog(EmulatorTransport):
+        """Keeps (time, framebuffer) for every frame the emulator applied."""
+
+        def __init__(self):
+            super().__init__()
+            self.shown = []
+
+        def write(self, report):
+            applied = self.keyboard.applied
+            written = super().write(report)
+            if self.keyboard.applied != applied:
+                self.shown.append((self.keyboard.commits[-1], bytes(self.keyboard.frame)))
+            return written
+
+    base = default_layout()
+    layout = Layout(base.name, base.slots, base.names, base.positions, range(1, len(base) + 1))
+    rng = random.Random(40)
+    ok = True
+    # A press can wait for one animation frame in flight: two packets for
+    # a fade, up to all seven with ripples (7.5 ms each at this pacing).
+    for label, ripple, budget in (("key", False, 30.0), ("key + ripple", True, 70.0)):
+        if args.budget_ms is not None:
+            budget = args.budget_ms
+        transport = FrameLog()
+        controller = Controller(transport, gap_for=Pacing({"per-key": 0.0075}))
+        writer = FrameWriter(controller)
+        reactive = Reactive(writer, layout, color=(255, 160, 0), fade=0.2, ripple=ripple)
+        source = InjectedSource()
+        thread = threading.Thread(target=reactive.run, args=(source,))
+        thread.start()
+        writer.flush()
+        time.sleep(0.05)
+        pressed = []
+        for _ in range(presses):
+            code = rng.randrange(1, len(layout) + 1)
+            pressed.append((time.monotonic(), layout.slots[code - 1] * 3 + SLOT_RED))
+            source.press(code, pressed[-1][0])
+            time.sleep(rng.uniform(0.03, 0.08))
+            source.release(code)
+            time.sleep(rng.uniform(0.05, 0.15))
+        # Let the last fade and ripple finish, then check nothing wakes up.
+        time.sleep(2.0)
+        writer.flush()
+        wakeups = reactive.wakeups
+        time.sleep(0.5)
+        idle = reactive.wakeups - wakeups
+        source.end()
+        thread.join()
+        writer.close()
+        controller.close()
+        stats = reactive.stats()
+        reactive.close()
+        source.close()
+        dark = not any(transport.keyboard.frame)
+        # The first frame the emulator applied with the pressed key at least half lit.
+        applied = sorted((next(shown for shown, frame in transport.shown if shown >= when and frame[red] >= 128)
+                          - when) * 1000 for when, red in pressed)
+        ok &= report(f"{label}: keypress-to-light latency (p95)", applied[int(0.95 * len(applied))], budget)
+        print(f"   median {statistics.median(applied):.1f} ms, max {applied[-1]:.1f} ms; "
+              f"write completion as measured live: median {stats['latency_median'] * 1000:.1f} ms, "
+              f"p95 {stats['latency_p95'] * 1000:.1f} ms")
+        print(f"   {stats['presses']} presses, {stats['renders']} frames, "
+              f"{stats['chunks_per_frame']:.1f} chunks per frame written")
+        check(not idle, f"{idle} wakeups while idle for 0.5 s")
+        check(dark, "keyboard back to the background colour")
+        ok &= not idle and dark
+    return 0 if ok else 1
+
+
+@benchmark("mapping")
+def bench_mapping(args):
+    """Recovers a hidden key-to-slot permutation through keyed answers and synthetic photos."""
+    import random
+
+    from gembird.controller import Controller
+    from gembird.emulator import EmulatorTransport
+    from gembird.mapping import FRAMES, CameraObserver, Discovery, EmulatorObserver, KeyedObserver
+    from gembird.protocol import SLOT_BLUE, SLOT_GREEN, SLOT_RED
+    from gembird.reactive import InjectedSource
+
+    rng = random.Random(41)
+    transport = EmulatorTransport()
+    keyboard = transport.keyboard
+    sink = Controller(transport)
+    slots = [slot for slot in range(128) if slot not in range(7, 112, 8)]
+    # Physical keys 1..N (input event codes) behind shuffled slots.
+    hidden = dict(zip(range(1, len(slots) + 1), rng.sample(slots, len(slots))))
+    ok = True
+
+    def verify(label, found, failed, expected):
+        correct = sum(found.get(key) == slot for key, slot in expected.items())
+        return check(correct == len(expected) and not failed,
+                     f"{label}: {correct} of {len(expected)} keys mapped "
+                     f"in {FRAMES} frames, {len(failed)} undecodable")
+
+    discovery = Discovery(sink, EmulatorObserver(keyboard, hidden))
+    layout = discovery.run()
+    ok &= verify("emulator", discovery.found, discovery.failed, hidden)
+    print(f"   layout: {len(layout)} LEDs, {layout.width}x{layout.height}")
+
+    # A simulated person pressing every red key, then the last one again.
+    source = InjectedSource()
+
+    def press_red(index):
+        shown = keyboard.frame
+        red = [key for key, slot in hidden.items() if shown[slot * 3 + SLOT_RED] > shown[slot * 3 + SLOT_BLUE]]
+        for code in red + red[-1:]:
+            source.press(code)
+            source.release(code)
+
+    discovery = Discovery(sink, KeyedObserver(source, prompt=press_red))
+    layout = discovery.run()
+    source.close()
+    ok &= verify("keyed answers", discovery.found, discovery.failed, hidden)
+    ok &= all(code == key for key, code in zip(sorted(hidden, key=hidden.get), layout.codes))
+
+    try:
+        import numpy
+    except ImportError:
+        print("   camera: skipped (numpy not installed)")
+        sink.close()
+        return 0 if ok else 1
+
+    # A 6-row keyboard photographed at 1280x480 with noise, glare and bleed.
+    keys = list(hidden)
+    stagger = (0, 16, 24, 40, 8, 0, 0)
+    places = {key: (60 + 64 * (n % 18) + stagger[n // 18], 60 + 64 * (n // 18)) for n, key in enumerate(keys)}
+    noise = numpy.random.default_rng(41)
+
+    def photograph(index):
+        image = noise.normal(30, 8, (480, 1280, 3))
+        shown = keyboard.frame
+        for key, (x, y) in places.items():
+            slot = hidden[key]
+            color = (shown[slot * 3 + SLOT_RED], shown[slot * 3 + SLOT_GREEN], shown[slot * 3 + SLOT_BLUE])
+            image[y - 12:y + 12, x - 14:x + 14] += numpy.array(color) * 0.8 + 40
+            # Light leaking onto the neighbouring keycaps.
+            image[y - 16:y + 16, x - 18:x + 18] += numpy.array(color) * 0.1
+        return numpy.clip(image, 0, 255).astype(numpy.uint8)
+
+    start = time.perf_counter()
+    discovery = Discovery(sink, CameraObserver(photograph))
+    layout = discovery.run()
+    elapsed = time.perf_counter() - start
+    sink.close()
+    # Spots are numbered in scan order; match them to keys by position.
+    by_position = {}
+    for spot, entry in discovery.info.items():
+        by_position[entry["position"]] = spot
+    expected = {}
+    for n, key in enumerate(keys):
+        # Staggered rows round to the nearest column, as on a real keyboard.
+        column, row = n % 18, n // 18
+        spot = by_position.get((round(column + stagger[row] / 64), row))
+        if spot is not None:
+            expected[spot] = hidden[key]
+    located = len(expected) == len(keys)
+    check(located, f"camera: {len(discovery.info)} spots found, "
+          f"{len(expected)} of {len(keys)} at their grid position")
+    ok &= located and verify("camera", discovery.found, discovery.failed, expected)
+    print(f"   {FRAMES} synthetic photos taken and decoded in {elapsed * 1000:.0f} ms")
+    return 0 if ok else 1
+
+
+@benchmark("profiles")
+def bench_profiles(args, count=500, applies=5000):
+    """Opening a store of hundreds of profiles, and applying them hot versus recompiling."""
+    import json
+    import random
+    import tempfile
+
+    from gembird.profiles import ProfileStore, apply, compile_spec, save_profiles
+
+    budget = args.budget_ms if args.budget_ms is not None else 5.0
+    rng = random.Random(42)
+
+    def color():
+        return [rng.randrange(256) for _ in range(3)]
+
+    specs = {}
+    for number in range(count):
+        kind = number % 3
+        if kind == 0:
+            specs[f"static-{number}"] = {"static": color()}
+        elif kind == 1:
+            specs[f"keys-{number}"] = {"keys": {str(slot): color() for slot in rng.sample(range(128), 20)},
+                                       "background": color()}
+        else:
+            specs[f"fade-{number}"] = {"effect": "fade", "from": color(), "to": color(), "ms": 500, "steps": 16}
+
+    class CountingSink:
+        def __init__(self):
+            self.reports = 0
+
+        def send(self, sequence, priority=0):
+            self.reports += len(sequence)
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "profiles.gbp")
+        start = time.perf_counter()
+        save_profiles(specs, path)
+        compile_ms = (time.perf_counter() - start) * 1000
+        print(f"   compiled {count} profiles into {os.path.getsize(path) / 1024:.0f} KiB in {compile_ms:.0f} ms")
+
+        opens = []
+        for _ in range(20):
+            start = time.perf_counter()
+            store = ProfileStore(path)
+            opens.append((time.perf_counter() - start) * 1000)
+            store.close()
+        ok = report(f"open a store of {count} profiles (median)", statistics.median(opens), budget)
+
+        names = list(specs)
+        # Most switches go between a handful of favourites.
+        picks = [rng.choice(names[:16]) if rng.random() < 0.9 else rng.choice(names) for _ in range(applies)]
+        sink = CountingSink()
+        with ProfileStore(path) as store:
+            start = time.perf_counter()
+            for name in picks:
+                apply(store.get(name), sink, loops=1, sleep=lambda seconds: None)
+            stored = (time.perf_counter() - start) / applies * 1e6
+            hits, misses = store.hits, store.misses
+        start = time.perf_counter()
+        for name in picks:
+            apply(compile_spec(name, json.loads(json.dumps(specs[name]))), sink, loops=1, sleep=lambda seconds: None)
+        compiled = (time.perf_counter() - start) / applies * 1e6
+        report("apply from the store", stored, None, "us")
+        report("apply by compiling the spec each time", compiled, None, "us")
+        print(f"   LRU: {hits} hits, {misses} misses")
+
+        environment = dict(os.environ, XDG_CONFIG_HOME=root)
+        os.makedirs(os.path.join(root, "gembird"), exist_ok=True)
+        os.replace(path, os.path.join(root, "gembird", "profiles.gbp"))
+
+        def wall(argv):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-m", "gembird", "--dump"] + argv,
+                           env=environment, stdout=subprocess.DEVNULL, check=True)
+            return (time.perf_counter() - start) * 1000
+
+        # Interleaved, so both commands see the same machine load.
+        walls, sets = [], []
+        for _ in range(10):
+            walls.append(wall(["profile", "apply", names[1]]))
+            sets.append(wall(["set", "255", "0", "0"]))
+        report("gembird set wall time (median)", statistics.median(sets), None)
+        ok &= report("gembird profile apply wall time (median)", statistics.median(walls),
+                     round(statistics.median(sets) + 5.0, 1))
+    return 0 if ok else 1
+
+
+@benchmark("notify")
+def bench_notify(args, burst=200):
+    """Notification latency, coalescing, preemption and restoring the base, on the emulator."""
+    from gembird.controller import Controller
+    from gembird.emulator import EmulatorTransport
+    from gembird.frames import FrameWriter
+    from gembird.notify import WIRED_SLOTS, Notifier
+    from gembird.pacing import Pacing
+    from gembird.protocol import fill_frame, new_frame
+
+    # A few keys span one or two chunks: 7.5 ms each at this pacing.
+    budget = args.budget_ms if args.budget_ms is not None else 25.0
+    emulator = EmulatorTransport()
+    writer = FrameWriter(Controller(emulator, gap_for=Pacing({"per-key": 0.0075})))
+    base = bytes(fill_frame(new_frame(), 0, 40, 80))
+    notifier = Notifier(writer, base)
+    keyboard = emulator.keyboard
+
+    def wait_for(condition, timeout=2.0):
+        deadline = time.perf_counter() + timeout
+        while not condition():
+            if time.perf_counter() > deadline:
+                return False
+            time.sleep(0.0005)
+        return True
+
+    ok = wait_for(lambda: bytes(keyboard.frame) == base)
+    written = emulator.written
+    time.sleep(0.5)
+    ok &= report("written while idle for 0.5 s", emulator.written - written, 0, "reports")
+
+    latencies = []
+    for number in range(20):
+        color = (255, number * 12, 0)
+        start = time.perf_counter()
+        notification = notifier.notify(color, priority=1, ttl=0.05, keys=WIRED_SLOTS[:4], tag="latency")
+        wait_for(lambda: bytes(keyboard.frame) == notification.frame)
+        latencies.append((time.perf_counter() - start) * 1000)
+        wait_for(lambda: bytes(keyboard.frame) == base)
+    ok &= report("notify to shown on the keyboard, four keys (median)", statistics.median(latencies), budget)
+
+    renders = notifier.renders
+    for _ in range(burst):
+        notifier.notify((255, 0, 0), priority=2, ttl=0.3)
+    wait_for(lambda: not notifier.active())
+    ok &= report(f"rendered for a burst of {burst} identical notifications", notifier.renders - renders, 1, "frames")
+    ok &= wait_for(lambda: bytes(keyboard.frame) == base)
+
+    renders = notifier.renders
+    low = notifier.notify((0, 255, 0), priority=1, ttl=0.6, tag="low")
+    ok &= wait_for(lambda: bytes(keyboard.frame) == low.frame)
+    high = notifier.notify((255, 0, 0), priority=5, ttl=0.2, keys=WIRED_SLOTS[40:48], tag="high")
+    ok &= wait_for(lambda: bytes(keyboard.frame) == high.frame)
+    for label, frame in (("preempted notification resumed after the higher one expired", low.frame),
+                         ("base restored byte for byte afterwards", base)):
+        passed = wait_for(lambda: bytes(keyboard.frame) == frame)
+        check(passed, label)
+        ok &= passed
+    ok &= report("rendered for a preemption and its resume", notifier.renders - renders, 2, "frames")
+
+    notifier.close()
+    writer.close()
+    print(f"   {notifier.sent} frames sent, {notifier.coalesced} notifications coalesced, "
+          f"{len(keyboard.commits)} commits on the emulator")
+    return 0 if ok else 1
+
+
+@benchmark("effects")
+def bench_effects(args, seconds=10, fps=30):
+    """Firmware effects: encoding, decoding in the emulator, and USB writes against host rendering."""
+    from gembird.effects import FirmwareEffect
+    from gembird.emulator import EmulatedKeyboard
+    from gembird.profiles import apply, compile_spec
+    from gembird.protocol import MAX_BRIGHTNESS, MAX_SPEED
+
+    effects = [FirmwareEffect(code, (code, 255 - code, code // 2), brightness, speed)
+               for code in range(256) for brightness in range(MAX_BRIGHTNESS + 1)
+               for speed in range(MAX_SPEED + 1)]
+    start = time.perf_counter()
+    sequences = [effect.sequence() for effect in effects]
+    encode = (time.perf_counter() - start) / len(effects) * 1e6
+
+    # No processing times: this checks the encoding, not the pacing.
+    keyboard = EmulatedKeyboard(processing={})
+    mismatches = 0
+    for effect, sequence in zip(effects, sequences):
+        for payload in sequence:
+            keyboard.feed(payload)
+        shown = (keyboard.effect, keyboard.color, keyboard.brightness, keyboard.speed)
+        mismatches += shown != (effect.effect, effect.color, effect.brightness, effect.speed)
+    report("encode one effect sequence", encode, None, "us")
+    passed = not mismatches and not keyboard.bad_checksum and not keyboard.protocol_errors
+    check(passed, f"emulator decoded {len(effects) - mismatches} of {len(effects)} "
+          f"effect/brightness/speed combinations, {keyboard.bad_checksum} bad checksums")
+
+    class CountingSink:
+        def __init__(self):
+            self.reports = 0
+
+        def send(self, sequence, priority=0):
+            self.reports += len(sequence)
+
+    firmware, host = CountingSink(), CountingSink()
+    firmware.send(FirmwareEffect(0x06, (0, 80, 255)).sequence())
+    # Host-side breathing: a fade out and back in, one normal-mode update per frame.
+    half = seconds * fps // 2
+    for start_color, end_color in (((0, 80, 255), (0, 0, 0)), ((0, 0, 0), (0, 80, 255))):
+        spec = {"effect": "fade", "from": start_color, "to": end_color, "ms": 500 * seconds, "steps": half}
+        apply(compile_spec("breathing", spec), host, loops=1, sleep=lambda seconds: None)
+    ok = report(f"reports for {seconds} s of a firmware effect", firmware.reports, 3, "reports")
+    report(f"reports for {seconds} s of host-rendered breathing at {fps} fps", host.reports, None, "reports")
+    return 0 if ok and passed else 1
+
+
+@benchmark("readback")
+def bench_readback(args):
+    """Reports a restart and a reconnect cost with and without reading the state back."""
+    import errno
+
+    from gembird.effects import FirmwareEffect
+    from gembird.emulator import EmulatedKeyboard, EmulatorTransport
+    from gembird.frames import FrameWriter
+    from gembird.protocol import fill_frame, new_frame, set_slot
+    from gembird.readback import Reconciler
+    from gembird.resilient import FlakyTransport, ResilientTransport
+
+    class UnpacedSink:
+        """Writes straight to a transport; pacing is not what is measured here."""
+
+        def __init__(self, transport):
+            self.transport = transport
+            self.reports = 0
+
+        def send(self, sequence, priority=0):
+            self.transport.send_sequence(sequence, 0.0)
+            self.reports += len(sequence)
+
+    keyboard = EmulatedKeyboard(processing={})
+    sink = UnpacedSink(EmulatorTransport(keyboard=keyboard))
+    before = fill_frame(new_frame(), 0, 40, 80)
+    FrameWriter(sink).show(before)
+    after = bytearray(before)
+    set_slot(after, 20, 255, 0, 0)
+
+    # A restarted daemon changing one key.
+    blind = UnpacedSink(sink.transport)
+    FrameWriter(blind).show(after)
+    keyboard.frame[:] = before
+    reconciled = UnpacedSink(sink.transport)
+    reconciler = Reconciler(sink.transport, reconciled)
+    reconciler.show_frame(after)
+    ok = keyboard.frame == after
+    report("restart, one key changed: reports without readback", blind.reports, None, "reports")
+    ok &= report("restart, one key changed: reports with readback", reconciled.reports, 2, "reports")
+    print(f"   {reconciler.reads} feature reads for the query")
+
+    effect = FirmwareEffect("static", (0, 80, 255), brightness=3)
+    sink.send(effect.sequence())
+    reconciled = UnpacedSink(sink.transport)
+    reconciler = Reconciler(sink.transport, reconciled)
+    reconciler.show_effect(effect)
+    ok &= report("restart, normal mode already showing the target: reports", reconciled.reports, 0, "reports")
+
+    # A replug mid-frame: the keyboard comes back power-cycled and the
+    # sequence resumes at the chunk that failed, so its start is lost.
+    def opener(rediscover):
+        if opener.opened:
+            keyboard.reset()
+            keyboard.processing.clear()
+        opener.opened += 1
+        # Writes 0-6 are the first frame; 8 is the commit chunk of the delta.
+        failures = {} if opener.opened > 1 else {8: OSError(errno.ENODEV, "unplugged")}
+        return FlakyTransport(EmulatorTransport(keyboard=keyboard), failures)
+
+    opener.opened = 0
+    resilient = ResilientTransport(opener, sleep=lambda seconds: None)
+    FrameWriter(UnpacedSink(resilient)).show(before)
+    reconciled = UnpacedSink(resilient)
+    reconciler = Reconciler(resilient, reconciled)
+    reconciler.show_frame(after)
+    torn = keyboard.frame != after
+    reconciler.show_frame(after)
+    passed = torn and keyboard.frame == after
+    check(passed, f"reconnect mid-frame: torn frame detected and repaired, "
+          f"{reconciler.queries} queries, {reconciled.reports} reports")
+    ok &= passed
+
+    keyboard = EmulatedKeyboard(processing={}, readback=False)
+    sink = UnpacedSink(EmulatorTransport(keyboard=keyboard))
+    reconciler = Reconciler(sink.transport, sink)
+    for _ in range(3):
+        reconciler.show_frame(after)
+    passed = reconciler.queries == 1 and keyboard.frame == after and sink.reports == 7
+    check(passed, f"firmware without readback: {reconciler.queries} query, then full frames "
+          f"as before ({sink.reports} reports)")
+    return 0 if ok and passed else 1
+
+
+def _proc_status(pid):
+    """Returns (RSS in KiB, threads, context switches summed over threads) from /proc."""
+    rss = threads = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+            elif line.startswith("Threads:"):
+                threads = int(line.split()[1])
+    switches = 0
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/status") as f:
+            for line in f:
+                if line.startswith(("voluntary_ctxt_switches:", "nonvoluntary_ctxt_switches:")):
+                    switches += int(line.split()[1])
+    return rss, threads, switches
+
+
+@benchmark("embedded")
+def bench_embedded(args, commands=5000, idle=2.0):
+    """Steady-state RSS and idle wakeups of the embedded daemon, driven over its socket."""
+    import random
+    import socket
+    import tempfile
+
+    if not os.path.isdir("/proc/self/task"):
+        print("   embedded: skipped (needs /proc)")
+        return 0
+    budget_mib = 16.0
+    rng = random.Random(46)
+    with tempfile.TemporaryDirectory() as root:
+        environment = dict(os.environ, XDG_RUNTIME_DIR=root)
+        daemon = subprocess.Popen([sys.executable, "-m", "gembird", "embedded", "--emulator"],
+                                  env=environment, stdout=subprocess.PIPE)
+        try:
+            daemon.stdout.readline()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(os.path.join(root, "gembird", "emulator.sock"))
+            stream = sock.makefile("rwb")
+            start = time.perf_counter()
+            for number in range(commands):
+                kind = number % 10
+                rgb = " ".join(str(rng.randrange(256)) for _ in range(3))
+                if kind == 0:
+                    line = f"set {rgb}"
+                elif kind == 1:
+                    line = f"fill {rgb}"
+                else:
+                    line = f"key {rng.choice([slot for slot in range(112) if slot % 8 != 7])} {rgb}"
+                stream.write(line.encode() + b"\n")
+                stream.flush()
+                if stream.readline() != b"ok\n":
+                    check(False, f"{line!r} was refused")
+                    return 1
+            elapsed = time.perf_counter() - start
+            # Another gembird command forwards to the daemon through the lease.
+            subprocess.run([sys.executable, "-m", "gembird", "--path", "emulator", "set", "0", "80", "255"],
+                           env=environment, check=True)
+            stream.write(b"stats\n")
+            stream.flush()
+            stats = stream.readline().decode().split()
+            time.sleep(0.2)
+            _, _, before = _proc_status(daemon.pid)
+            time.sleep(idle)
+            rss, threads, after = _proc_status(daemon.pid)
+            with open(f"/proc/{daemon.pid}/maps") as f:
+                numpy = "numpy" in f.read()
+            stream.close()
+            sock.close()
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+    print(f"   {commands} commands in {elapsed * 1000:.0f} ms ({elapsed / commands * 1e6:.0f} us round trip); "
+          f"daemon {' '.join(stats[1:])}")
+    ok = report("steady-state RSS", rss / 1024, budget_mib, "MiB")
+    ok &= report(f"wakeups per second while idle ({threads} thread{'s' if threads != 1 else ''})",
+                 (after - before) / idle, 0, "/s")
+    check(not numpy, f"NumPy {'is' if numpy else 'is not'} loaded")
+    return 0 if ok and not numpy and daemon.returncode == 0 else 1
+
+
+@benchmark("audio")
+def bench_audio(args, seconds=10.0, rate=48000):
+    """CPU cost of the audio visualiser on 48 kHz audio, and the chunks it sends."""
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print("   audio: skipped (numpy not installed)")
+        return 0
+    from gembird.audio import SyntheticAudio, Visualizer
+    from gembird.frames import FrameWriter
+    from gembird.layout import default_layout
+    from gembird.protocol import PER_KEY_CHUNKS
+
+    budget = args.budget_ms if args.budget_ms is not None else 10.0
+
+    class CountingSink:
+        def __init__(self):
+            self.reports = 0
+
+        def send(self, sequence, priority=0):
+            self.reports += len(sequence)
+
+    class InlineWriter(FrameWriter):
+        """Writes every submitted frame at once, so no frame is dropped for pacing."""
+
+        def submit(self, frame):
+            self.show(frame)
+
+    ok = True
+    for mode, fps in (("spectrum", 60), ("spectrum", 30), ("vu", 60)):
+        sink = CountingSink()
+        visualizer = Visualizer(InlineWriter(sink), default_layout(), rate=rate, fps=fps, mode=mode)
+        start = time.process_time()
+        visualizer.run(SyntheticAudio(rate, seconds, block=1024), paced=False)
+        share = (time.process_time() - start) / seconds * 100
+        ok &= report(f"{mode} at {fps} fps: CPU share of one core", share, budget, "%")
+        full = visualizer.frames * len(PER_KEY_CHUNKS)
+        print(f"   {visualizer.frames} frames, {visualizer.submitted} changed, "
+              f"{sink.reports} of {full} chunks sent ({sink.reports / max(1, full) * 100:.0f}%)")
+        ok &= sink.reports < full
+    return 0 if ok else 1
+
+
+@benchmark("fleet")
+def bench_fleet(args, hosts=16, parallel=4):
+    """Pushes to emulated agents on localhost: bounded parallelism, acknowledgements, reused connections."""
+    import asyncio
+    import math
+    import threading
+
+    from gembird.controller import Controller
+    from gembird.emulator import EmulatorTransport
+    from gembird.fleet import Agent, Fleet
+
+    class InFlight:
+        """Wraps an agent's controller to count how many keyboards are written at once."""
+
+        lock = threading.Lock()
+        active = 0
+        peak = 0
+
+        def __init__(self, controller):
+            self.controller = controller
+
+        def send(self, sequence, priority=0):
+            with InFlight.lock:
+                InFlight.active += 1
+                InFlight.peak = max(InFlight.peak, InFlight.active)
+            try:
+                self.controller.send(sequence, priority)
+            finally:
+                with InFlight.lock:
+                    InFlight.active -= 1
+
+    async def scenario():
+        controllers = [Controller(EmulatorTransport()) for _ in range(hosts)]
+        agents = [await Agent(InFlight(controller), port=0, token="bench", name=f"agent-{number}").start()
+                  for number, controller in enumerate(controllers)]
+        addresses = [f"127.0.0.1:{agent.port}" for agent in agents]
+        try:
+            single = Fleet(addresses[:1], token="bench")
+            await single.push([{"static": [1, 2, 3]}])
+            start = time.monotonic()
+            await single.push([{"static": [3, 2, 1]}])
+            one = time.monotonic() - start
+            await single.close()
+            before = sum(agent.connections for agent in agents)
+
+            fleet = Fleet(addresses + ["127.0.0.1:1"], parallelism=parallel, timeout=2.0, token="bench")
+            pings = await fleet.push([{"ping": True}])
+            InFlight.peak = 0
+            start = time.monotonic()
+            pushed = await fleet.push([{"static": [0, 80, 255]}])
+            wall = time.monotonic() - start
+            batch = await fleet.push([{"static": [255, 0, 0]}, {"keys": {"0": [0, 255, 0]}}])
+            shown = [controller.transport.keyboard for controller in controllers]
+            connects = fleet.connects, sum(agent.connections for agent in agents) - before
+            await fleet.close()
+            return one, pings, pushed, wall, batch, shown, connects
+        finally:
+            for agent in agents:
+                await agent.close()
+            for controller in controllers:
+                controller.close()
+
+    one, pings, pushed, wall, batch, shown, (connects, accepted) = asyncio.run(scenario())
+    live = [result for result in pings if result.ok]
+    print(f"   ping: {len(live)} of {len(pings)} hosts answered, median "
+          f"{statistics.median(result.latency for result in live) * 1000:.1f} ms; "
+          f"dead host: {pings[-1].error}")
+    acked = [result for result in pushed[:-1] if result.ok]
+    latencies = sorted(result.latency for result in acked)
+    print(f"   static colour: one host {one * 1000:.0f} ms; {len(acked)} hosts acknowledged, "
+          f"median {statistics.median(latencies) * 1000:.0f} ms, slowest {latencies[-1] * 1000:.0f} ms")
+    budget = args.budget_ms if args.budget_ms is not None else math.ceil(hosts / parallel) * one * 1000 * 1.5
+    ok = report(f"push to {hosts} hosts, {parallel} at a time", wall * 1000, budget)
+    checks = [
+        (len(acked) == hosts and not pushed[-1].ok, "every live host acknowledged, the dead one failed"),
+        (InFlight.peak <= parallel, f"at most {parallel} keyboards written at once (peak {InFlight.peak})"),
+        (all(result.ok for result in batch[:-1]) and all(keyboard.mode == "per-key" and keyboard.color == (255, 0, 0)
+                                                       for keyboard in shown),
+         "a two-command batch applied in order on every host"),
+        (connects == hosts and accepted == hosts, f"one connection per host across three pushes ({accepted} accepted)"),
+    ]
+    for passed, label in checks:
+        check(passed, label)
+        ok &= passed
+    return 0 if ok else 1
+
+
+@benchmark("idle")
+def bench_idle(args, timeout=0.3, typing=1.0):
+    """Idle dimming on the emulator: wakeups while typing and asleep, dimming on time, restoring at once."""
+    import threading
+
+    from gembird.controller import Controller
+    from gembird.emulator import EmulatorTransport
+    from gembird.idle import IdleManager, scale_table
+    from gembird.pacing import Pacing
+    from gembird.protocol import fill_frame, new_frame, set_slot
+    from gembird.reactive import InjectedSource
+    from gembird.readback import Reconciler
+
+    budget = args.budget_ms if args.budget_ms is not None else 80.0
+
+    def wait_for(condition, limit=3.0):
+        deadline = time.monotonic() + limit
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.0005)
+        return True
+
+    def scenario(frame, level):
+        emulator = EmulatorTransport()
+        controller = Controller(emulator, gap_for=Pacing({"per-key": 0.0075}))
+        reconciler = Reconciler(emulator, controller)
+        reconciler.show_frame(frame)
+        source = InjectedSource()
+        manager = IdleManager(reconciler, source, timeout=timeout, level=level)
+        thread = threading.Thread(target=manager.run, daemon=True)
+        thread.start()
+        return emulator.keyboard, controller, source, manager, thread
+
+    def finish(controller, source, manager, thread):
+        manager.stop()
+        thread.join()
+        manager.close()
+        source.close()
+        controller.close()
+
+    base = fill_frame(new_frame(), 0, 40, 80)
+    for slot in range(0, 24):
+        set_slot(base, slot, 255, 120, 0)
+    base = bytes(base)
+    keyboard, controller, source, manager, thread = scenario(base, 0.2)
+    presses = int(typing / 0.02)
+    wakeups = manager.wakeups
+    for number in range(presses):
+        last = time.monotonic()
+        source.press(30 + number % 10, last)
+        source.release(30 + number % 10)
+        time.sleep(0.02)
+    typed = manager.wakeups - wakeups
+    ok = wait_for(lambda: manager.idle)
+    dimmed_after = time.monotonic() - last
+    ok &= report(f"woken while typing {presses} keys over {typing:g} s", typed, int(typing / timeout) + 1, "times")
+    ok &= report(f"dimmed after the last key (timeout {timeout:g} s)", dimmed_after * 1000,
+                 (timeout + 0.05) * 1000)
+    dimmed = base.translate(scale_table(0.2))
+    ok &= wait_for(lambda: bytes(keyboard.frame) == dimmed)
+    wakeups = manager.wakeups
+    time.sleep(1.0)
+    ok &= report("woken while idle for 1 s", manager.wakeups - wakeups, 0, "times")
+
+    latencies = []
+    for _ in range(5):
+        wait_for(lambda: manager.idle and bytes(keyboard.frame) == dimmed)
+        start = time.monotonic()
+        source.press(57, start)
+        restored = wait_for(lambda: bytes(keyboard.frame) == base)
+        latencies.append((time.monotonic() - start) * 1000)
+        source.release(57)
+        if not restored:
+            ok = check(False, "the lighting was not restored byte for byte")
+    ok &= report("key press to lighting restored, 7 chunks (median)", statistics.median(latencies), budget)
+    finish(controller, source, manager, thread)
+    print(f"   {manager.sleeps} dims, {manager.reports} reports for dimming and restoring")
+
+    # Blanking a map with a single lit key: its chunk, not a black static colour and a full map.
+    single = new_frame()
+    set_slot(single, 3, 255, 255, 255)
+    keyboard, controller, source, manager, thread = scenario(bytes(single), 0.0)
+    ok &= wait_for(lambda: manager.idle and not any(keyboard.frame))
+    source.press(30)
+    ok &= wait_for(lambda: bytes(keyboard.frame) == bytes(single))
+    finish(controller, source, manager, thread)
+    ok &= report("to blank and restore a map with one lit key", manager.reports, 4, "reports")
+    return 0 if ok else 1
+
+
+@benchmark("profiling")
+def bench_profiling(args, frames=2000, rounds=9):
+    """Cost of the profiling hooks off and on, over a render/encode/write loop on the emulator."""
+    import signal
+    import tempfile
+
+    from gembird import profiling
+    from gembird.emulator import EmulatorTransport
+    from gembird.frames import FrameWriter
+    from gembird.protocol import SLOT_COUNT, UNUSED_SLOTS, new_frame, set_slot
+
+    slots = [slot for slot in range(SLOT_COUNT) if slot not in UNUSED_SLOTS]
+
+    class Sink:
+        def __init__(self):
+            self.transport = EmulatorTransport()
+
+        def send(self, sequence, priority=0):
+            self.transport.send_sequence(sequence)
+
+    def render(frame, number):
+        for slot in slots:
+            set_slot(frame, slot, (number + slot) & 0xFF, (number * 3) & 0xFF, slot)
+
+    writers = []
+
+    def pipeline():
+        writer = FrameWriter(Sink())
+        frame = new_frame()
+        start = time.perf_counter()
+        for number in range(frames):
+            render(frame, number)
+            writer.show(frame)
+        # Kept alive, so its encoded chunks are still allocated when a memory report is taken.
+        writers[:] = [writer]
+        return (time.perf_counter() - start) / frames * 1e6
+
+    profiling.register("render", render)
+    previous = signal.getsignal(signal.SIGUSR2)
+    times = {"baseline": [], "idle": [], "sampled": []}
+    stages = {}
+    with tempfile.TemporaryDirectory() as root:
+        profiler = profiling.install("bench")
+        profiler.directory = root
+        toggle = signal.getsignal(signal.SIGUSR2)
+        modes = list(times)
+        # Interleaved rounds in rotating order, so drift in the machine's
+        # speed and whatever the previous run left behind hit every mode alike.
+        for round_number in range(rounds):
+            for mode in modes[round_number % 3:] + modes[:round_number % 3]:
+                signal.signal(signal.SIGUSR2, previous if mode == "baseline" else toggle)
+                if mode == "sampled":
+                    os.kill(os.getpid(), signal.SIGUSR2)
+                times[mode].append(pipeline())
+                if mode != "sampled":
+                    continue
+                with open(profiler.stop()) as f:
+                    for line in f:
+                        fields = line.split()
+                        if line.startswith("  ") and len(fields) == 3 and fields[2].endswith("%"):
+                            stages[fields[0]] = stages.get(fields[0], 0) + int(fields[1])
+        signal.signal(signal.SIGUSR2, toggle)
+        profiler.memory = True
+        profiler.start()
+        traced = pipeline()
+        with open(profiler.stop()) as f:
+            memory = f.read()
+    signal.signal(signal.SIGUSR2, previous)
+
+    baseline = statistics.median(times["baseline"])
+    # Medians of the per-round ratios: signed, so a slower run can fail its budget.
+    idle = (statistics.median(i / b for i, b in zip(times["idle"], times["baseline"])) - 1) * 100
+    sampled = (statistics.median(s / b for s, b in zip(times["sampled"], times["baseline"])) - 1) * 100
+    print(f"   {baseline:.0f} us per frame without hooks (median of {rounds} interleaved rounds), "
+          f"{traced:.0f} us with tracemalloc")
+    budget = args.budget_ms if args.budget_ms is not None else 5.0
+    ok = report("overhead while installed but off", idle, budget, "%")
+    ok &= report("overhead while sampling every 2 ms", sampled, 25.0, "%")
+    total = sum(stages.values())
+    shares = {stage: f"{count / max(1, total) * 100:.1f}%" for stage, count in stages.items()}
+    print("   " + ", ".join(f"{stage} {shares.get(stage, '?')}" for stage in profiling.STAGES + (profiling.OTHER,)))
+    named = all(shares.get(stage, "0.0%") != "0.0%" for stage in profiling.STAGES)
+    check(named, "samples filed under render, composite, encode, checksum and write")
+    encoders = "protocol.py" in memory.split("Allocations by the packet encoders")[-1]
+    check(encoders, "tracemalloc report lists the packet encoders' allocations")
+    return 0 if ok and named and encoders else 1
@@ -0,0 +1,165 @@
+"""Measuring the smallest safe inter-packet gap for each packet kind.
+
+For one packet kind at a time, a binary search runs over candidate gaps
+between 0 and ``high`` in steps of ``resolution``; every other kind is held
+at ``high``, which is known to work. A candidate passes when several
+sequences with random colours are all applied exactly. The smallest
+passing gap, plus a safety margin, becomes that kind's entry in the pacing
+profile (see ``gembird.pacing``).
+
+Whether a sequence was applied is decided by a verifier:
+
+* ``EmulatorVerifier`` compares the emulator model's state with what was sent;
+* ``InteractiveVerifier`` asks the person at the keyboard.
+
+The firmware does not acknowledge lighting reports, so a real device cannot
+verify itself; the interactive verifier is what makes hardware calibration
+possible, and it uses fewer, larger trials to keep the questions few.
+"""
+
+import random
+import time
+
+from gembird.protocol import (
+    KIND_EXECUTE, KIND_PER_KEY, KIND_PREPARE, KIND_PROPERTIES, SLOT_COUNT,
+    UNUSED_SLOTS, create_true_static_color_sequence, new_frame, per_key_sequence, set_slot,
+)
+
+NORMAL_KINDS = (KIND_PREPARE, KIND_PROPERTIES, KIND_EXECUTE)
+KINDS = NORMAL_KINDS + (KIND_PER_KEY,)
+
+# Named colours for trials a person has to judge.
+PLAIN_COLORS = {
+    "red": (255, 0, 0),
+    "green": (0, 255, 0),
+    "blue": (0, 0, 255),
+    "white": (255, 255, 255),
+    "yellow": (255, 255, 0),
+    "cyan": (0, 255, 255),
+    "magenta": (255, 0, 255),
+}
+
+
+def normal_trial(rng):
+    rgb = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    return create_true_static_color_sequence(*rgb), ("color", rgb)
+
+
+def per_key_trial(rng):
+    frame = new_frame()
+    for slot in range(SLOT_COUNT):
+        if slot not in UNUSED_SLOTS:
+            set_slot(frame, slot, rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    return per_key_sequence(frame), ("frame", bytes(frame))
+
+
+class EmulatorVerifier:
+    """Checks trials against an EmulatedKeyboard's state."""
+
+    method = "emulator"
+
+    def __init__(self, keyboard):
+        self.keyboard = keyboard
+
+    def trial(self, kind, rng):
+        return (per_key_trial if kind == KIND_PER_KEY else normal_trial)(rng)
+
+    def verify(self, expected):
+        what, value = expected
+        if what == "color":
+            return self.keyboard.mode == "static" and self.keyboard.color == value
+        return self.keyboard.mode == "per-key" and bytes(self.keyboard.frame) == value
+
+
+class InteractiveVerifier:
+    """Asks whether the keyboard shows the expected colour."""
+
+    method = "interactive"
+
+    def __init__(self, ask=input):
+        self.ask = ask
+        self.last = None
+
+    def trial(self, kind, rng):
+        # Never repeat the previous colour, or a dropped update would look applied.
+        name = rng.choice(sorted(set(PLAIN_COLORS) - {self.last}))
+        self.last = name
+        rgb = PLAIN_COLORS[name]
+        if kind == KIND_PER_KEY:
+            frame = new_frame()
+            for slot in range(SLOT_COUNT):
+                if slot not in UNUSED_SLOTS:
+                    set_slot(frame, slot, *rgb)
+            return per_key_sequence(frame), name
+        return create_true_static_color_sequence(*rgb), name
+
+    def verify(self, expected):
+        while True:
+            answer = self.ask(f"Is every key {expected}? [y/n] ").strip().lower()
+            if answer in ("y", "yes", "n", "no"):
+                return answer.startswith("y")
+
+
+class Calibration:
+    """
+    Runs the per-kind binary search over ``transport``. ``sleep`` lets the
+    firmware settle before each candidate (a VirtualClock's for the emulator).
+    """
+
+    def __init__(self, transport, verifier, trials=5, high=0.05, resolution=0.0005,
+                 margin=0.25, sleep=time.sleep, seed=None):
+        self.transport = transport
+        self.verifier = verifier
+        self.trials = trials
+        self.high = high
+        self.resolution = resolution
+        self.margin = margin
+        self.sleep = sleep
+        self.rng = random.Random(seed)
+        self.sequences = 0
+        self.log = []
+
+    def _gaps(self, kind, gap):
+        gaps = {other: self.high for other in KINDS}
+        gaps[kind] = gap
+        return gaps
+
+    def passes(self, kind, gap):
+        """Returns whether every trial is applied with ``kind`` paced at ``gap``."""
+        from gembird.pacing import Pacing
+
+        pacing = Pacing(self._gaps(kind, gap))
+        # Start from a settled firmware, then send the trials back to back:
+        # the gap after a sequence's last packet is what the next one sees.
+        self.sleep(self.high)
+        for _ in range(self.trials):
+            sequence, expected = self.verifier.trial(kind, self.rng)
+            self.transport.send_sequence(sequence, pacing(sequence))
+            self.sequences += 1
+            if not self.verifier.verify(expected):
+                self.log.append((kind, gap, False))
+                return False
+        self.log.append((kind, gap, True))
+        return True
+
+    def search(self, kind):
+        """Returns the smallest passing gap for ``kind`` on the resolution grid."""
+        steps = round(self.high / self.resolution)
+        if not self.passes(kind, self.high):
+            raise OSError(f"{kind} packets are not applied even {self.high * 1000:g} ms apart")
+        failing, passing = -1, steps
+        while passing - failing > 1:
+            middle = (failing + passing) // 2
+            if self.passes(kind, middle * self.resolution):
+                passing = middle
+            else:
+                failing = middle
+        return passing * self.resolution
+
+    def run(self, kinds=KINDS):
+        """Returns {kind: safe gap} with the margin applied."""
+        gaps = {}
+        for kind in kinds:
+            found = self.search(kind)
+            gaps[kind] = round(min(self.high, found * (1 + self.margin) + self.resolution), 6)
+        return gaps
@@ -0,0 +1,1029 @@
+"""The ``gembird`` command.
+
+Usage::
+
+    python -m gembird set R G B       # static colour via the normal-mode path
+    python -m gembird fill R G B      # uniform colour via the per-key path
+    python -m gembird fade R G B      # eased transition via the normal-mode path
+    python -m gembird effect NAME R G B   # a firmware effect (3 packets, rendered on the keyboard)
+    python -m gembird find            # list the keyboard's HID interfaces
+    python -m gembird state           # read back what the keyboard shows
+    python -m gembird forget          # drop the cached interface path
+    python -m gembird calibrate       # measure this host's safe packet pacing
+    python -m gembird serve           # OpenRGB SDK server on localhost:6742
+    python -m gembird framebuffer     # push a shared-memory framebuffer to the keyboard
+    python -m gembird play clip.gif   # play an animation on the keys
+    python -m gembird ambient screen  # follow the screen's colours
+    python -m gembird audio -         # spectrum or VU meter from PCM on stdin, a FIFO or a WAV file
+    python -m gembird reactive        # light keys as they are pressed
+    python -m gembird idle --after 300   # dim the lighting while nobody types
+    python -m gembird map             # find which slot lights which key
+    python -m gembird profile apply NAME   # apply a saved, precompiled profile
+    python -m gembird notifyd         # serve notifications over the base lighting
+    python -m gembird notify R G B    # flash a notification through notifyd
+    python -m gembird embedded        # low-footprint daemon for single-board hosts
+    python -m gembird agent           # expose this keyboard to gembird fleet
+    python -m gembird fleet HOST...   # push a colour or profile to agents on many hosts
+    python -m gembird profiling PID   # start, then stop, profiling a running daemon
+    python -m gembird bench startup   # check the cold-start budget
+
+The command is meant to be run from shell hooks, so it prints nothing on
+success and keeps its imports to the bare minimum: each subcommand imports
+what it needs inside its handler.
+"""
+
+import argparse
+import sys
+
+
+def color_value(text):
+    """argparse type for a 0-255 colour component."""
+    value = int(text)
+    if not 0 <= value <= 255:
+        raise argparse.ArgumentTypeError("color values must be between 0 and 255")
+    return value
+
+
+def add_color_arguments(parser):
+    parser.add_argument("r", type=color_value)
+    parser.add_argument("g", type=color_value)
+    parser.add_argument("b", type=color_value)
+
+
+class DumpSession:
+    """Stands in for a device session and prints the packets instead (--dump)."""
+
+    def send(self, sequence, priority=0):
+        for payload in sequence:
+            print(payload.hex())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def open_session(args):
+    """Returns the session the subcommand should send through."""
+    if args.dump:
+        return DumpSession()
+
+    from gembird.arbitration import open_session
+
+    # If a long-running tool holds the keyboard, this forwards to it.
+    return open_session(args.path, backend=args.backend, serve=False)
+
+
+def write_sequence(args, sequence):
+    """Sends a sequence to the keyboard, or prints it with --dump."""
+    with open_session(args) as session:
+        session.send(sequence)
+    return 0
+
+
+def cmd_set(args):
+    from gembird import protocol
+
+    sequence = protocol.create_true_static_color_sequence(args.r, args.g, args.b)
+    return write_sequence(args, sequence)
+
+
+def cmd_fill(args):
+    from gembird import protocol
+
+    if args.all and not args.dump:
+        from gembird import device as gdevice
+        from gembird.sync import SyncGroup
+
+        paths = gdevice.find_control_interfaces()
+        if not paths:
+            raise OSError("Could not find the keyboard's lighting control interface.")
+        frame = protocol.fill_frame(protocol.new_frame(), args.r, args.g, args.b)
+        with SyncGroup.open(paths, backend=args.backend) as group:
+            group.show(frame)
+        return 0
+    sequence = protocol.create_uniform_color_sequence(args.r, args.g, args.b)
+    return write_sequence(args, sequence)
+
+
+def cmd_fade(args):
+    from gembird.transitions import TransitionEngine
+
+    with open_session(args) as session:
+        engine = TransitionEngine(session, current=args.start)
+        engine.fade_to((args.r, args.g, args.b), args.ms, easing=args.easing, space=args.space)
+    return 0
+
+
+def cmd_effect(args):
+    from gembird.effects import FirmwareEffect, effect_codes, effects_file
+
+    if args.list:
+        for name, code in sorted(effect_codes().items(), key=lambda item: item[1]):
+            print(f"0x{code:02x}  {name}")
+        print(f"(captured effect codes go in {effects_file()})")
+        return 0
+    if args.name is None or len(args.color) not in (0, 3):
+        print("❌ Error: give an effect name or code and optionally R G B, or --list", file=sys.stderr)
+        return 2
+    try:
+        effect = FirmwareEffect(args.name, args.color or (255, 255, 255), args.brightness, args.speed)
+    except ValueError as ex:
+        print(f"❌ Error: {ex}", file=sys.stderr)
+        return 2
+    return write_sequence(args, effect.sequence())
+
+
+def cmd_find(args):
+    import os
+
+    from gembird import PRODUCT_ID, VENDOR_ID
+
+    if os.path.isdir("/sys/class/hidraw"):
+        from gembird import discovery
+
+        found_devices = [{'path': node.path.encode(), 'interface_number': node.interface,
+                          'usage_page': node.usage_page, 'usage': node.usage}
+                         for node in discovery.scan(VENDOR_ID, PRODUCT_ID)]
+    else:
+        import hid
+
+        found_devices = hid.enumerate(VENDOR_ID, PRODUCT_ID)
+    if not found_devices:
+        print("❌ No Gembird devices found. Please check that it is plugged in.")
+        return 1
+    for i, device_dict in enumerate(found_devices):
+        marker = "*" if device_dict['usage_page'] >= 0xff00 else " "
+        print(f"{marker} #{i} {device_dict['path'].decode('utf-8')} "
+              f"interface={device_dict['interface_number']} "
+              f"usage_page=0x{device_dict['usage_page']:04x} usage=0x{device_dict['usage']:04x}")
+    return 0
+
+
+def cmd_state(args):
+    from gembird.readback import query_state, remember_support
+
+    if args.emulator:
+        from gembird.emulator import EmulatorTransport
+
+        transport = EmulatorTransport()
+    else:
+        from gembird.arbitration import LocalSession, open_session
+
+        session = open_session(args.path, backend=args.backend, serve=False)
+        if not isinstance(session, LocalSession):
+            session.close()
+            print("❌ Error: another gembird process holds the keyboard; it cannot be queried now",
+                  file=sys.stderr)
+            return 1
+        transport = session.transport
+    try:
+        state, reads = query_state(transport)
+        if not args.emulator:
+            remember_support(transport, state is not None)
+    finally:
+        (transport if args.emulator else session).close()
+    if state is None:
+        print(f"❌ The keyboard did not answer the state query ({reads} reads); "
+              "gembird keeps sending full sequences to it.")
+        return 1
+    if state.mode == "static":
+        effect = state.effect
+        print(f"normal mode: {effect.name()} {' '.join(map(str, effect.color))}, "
+              f"brightness {effect.brightness}, speed {effect.speed}")
+    else:
+        from gembird.protocol import UNUSED_SLOTS, get_slot
+
+        colors = {get_slot(state.frame, slot) for slot in range(len(state.frame) // 3) if slot not in UNUSED_SLOTS}
+        print(f"per-key mode: {len(colors)} distinct colour(s) ({reads} reads)")
+    return 0
+
+
+def cmd_forget(args):
+    from gembird import device as gdevice
+
+    gdevice.forget_cached_path()
+    return 0
+
+
+def cmd_calibrate(args):
+    from gembird import pacing
+    from gembird.calibration import Calibration, EmulatorVerifier, InteractiveVerifier
+
+    if args.emulator:
+        from gembird.emulator import virtual_keyboard
+
+        transport, keyboard, clock = virtual_keyboard()
+        calibration = Calibration(transport, EmulatorVerifier(keyboard), trials=args.trials, sleep=clock.sleep)
+        serial = "emulator"
+        session = None
+    else:
+        from gembird.arbitration import DeviceBusy, LocalSession, open_session
+
+        session = open_session(args.path, backend=args.backend, serve=False)
+        if not isinstance(session, LocalSession):
+            session.close()
+            raise DeviceBusy("another gembird process holds the keyboard; stop it before calibrating")
+        print("Answer each question by looking at the keyboard.")
+        calibration = Calibration(session.transport, InteractiveVerifier(), trials=1)
+        serial = pacing.device_serial(session.transport.path)
+    try:
+        gaps = calibration.run()
+    finally:
+        if session is not None:
+            session.close()
+
+    for kind, gap in gaps.items():
+        print(f"{kind:>10}: {gap * 1000:.1f} ms (default {pacing.DEFAULT_GAPS[kind] * 1000:g} ms)")
+    if args.dry_run:
+        return 0
+    key = pacing.store_pacing(serial, gaps, calibration.verifier.method)
+    print(f"✅ Saved as {key} in {pacing.profile_file()}")
+    return 0
+
+
+def cmd_serve(args):
+    import asyncio
+
+    from gembird.layout import load_layout
+    from gembird.openrgb import KeyboardController, OpenRGBServer
+
+    layout = load_layout(args.layout)
+    if args.emulator:
+        from gembird.controller import Controller
+        from gembird.emulator import EmulatorTransport
+
+        sink, serial, location = Controller(EmulatorTransport()), "emulator", "emulator"
+    else:
+        from gembird.arbitration import open_session
+        from gembird.pacing import device_serial
+
+        sink = open_session(args.path, backend=args.backend, owner="gembird serve")
+        path = getattr(getattr(sink, "transport", None), "path", None) or b""
+        if isinstance(path, bytes):
+            path = path.decode()
+        serial, location = device_serial(path), f"HID: {path}"
+    controller = KeyboardController(sink, layout, serial=serial, location=location)
+    server = OpenRGBServer(controller, args.host, args.port)
+
+    async def serve():
+        await server.start()
+        print(f"✅ OpenRGB SDK server on {server.host}:{server.port} ({len(layout)} LEDs)")
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        controller.close()
+        sink.close()
+    return 0
+
+
+def cmd_framebuffer(args):
+    import threading
+
+    from gembird.frames import FrameWriter
+    from gembird.readback import known_frame
+    from gembird.shm import FramebufferOwner
+
+    if args.emulator:
+        from gembird.controller import Controller
+        from gembird.emulator import EmulatorTransport
+
+        sink = Controller(EmulatorTransport())
+    else:
+        from gembird.arbitration import open_session
+
+        sink = open_session(args.path, backend=args.backend, owner="gembird framebuffer")
+    try:
+        owner = FramebufferOwner(FrameWriter(sink, shown=known_frame(sink)), args.name)
+        print(f"✅ Shared framebuffer at {owner.path}")
+        try:
+            owner.run(threading.Event())
+        finally:
+            owner.close()
+    finally:
+        sink.close()
+    return 0
+
+
+def cmd_play(args):
+    from gembird.animation import compile_file, play
+    from gembird.layout import load_layout
+
+    clip = compile_file(args.file, load_layout(args.layout), max_fps=args.max_fps,
+                        brightness=args.brightness, gamma=args.gamma, workers=args.workers)
+    if args.compile_only:
+        print(f"✅ {clip.frames} frames, {clip.reports} reports, {clip.duration():.2f} s: {clip.path}")
+        return 0
+    with open_session(args) as session:
+        play(clip, session, loops=args.loops)
+    return 0
+
+
+def cmd_ambient(args):
+    from gembird.ambient import Ambient, open_source
+    from gembird.frames import FrameWriter
+    from gembird.layout import load_layout
+
+    layout = load_layout(args.layout)
+    source = open_source(args.source, args.fps)
+    if args.emulator:
+        from gembird.controller import Controller
+        from gembird.emulator import EmulatorTransport
+
+        sink = Controller(EmulatorTransport())
+    elif args.dump:
+        sink = DumpSession()
+    else:
+        from gembird.arbitration import open_session
+
+        sink = open_session(args.path, backend=args.backend, owner="gembird ambient")
+    writer = FrameWriter(sink)
+    try:
+        Ambient(writer, layout, zones=args.zones, smoothing=args.smoothing,
+                threshold=args.threshold, brightness=args.brightness).run(source)
+    finally:
+        writer.close()
+        source.close()
+        if hasattr(sink, "close"):
+            sink.close()
+    return 0
+
+
+def cmd_audio(args):
+    from gembird.audio import Visualizer, open_audio
+    from gembird.frames import FrameWriter
+    from gembird.layout import load_layout
+
+    import wave
+
+    layout = load_layout(args.layout)
+    try:
+        source = open_audio(args.source, args.rate, args.channels, args.format,
+                            block=max(1, round(args.rate / args.fps)))
+    except (ValueError, EOFError, wave.Error) as ex:
+        print(f"❌ Error: {args.source}: not a usable audio source ({str(ex) or 'truncated file'})", file=sys.stderr)
+        return 2
+    if args.emulator:
+        from gembird.controller import Controller
+        from gembird.emulator import EmulatorTransport
+
+        sink = Controller(EmulatorTransport())
+    elif args.dump:
+        sink = DumpSession()
+    else:
+        from gembird.arbitration import open_session
+
+        sink = open_session(args.path, backend=args.backend, owner="gembird audio")
+    writer = FrameWriter(sink)
+    try:
+        Visualizer(writer, layout, rate=source.rate, fps=args.fps, mode=args.mode, range_db=args.range,
+                   gain_db=args.gain, brightness=args.brightness).run(source)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.flush()
+        writer.close()
+        source.close()
+        if hasattr(sink, "close"):
+            sink.close()
+    return 0
+
+
+def cmd_reactive(args):
+    import signal
+
+    from gembird.frames import FrameWriter
+    from gembird.layout import load_layout
+    from gembird.reactive import Reactive, open_key_source
+
+    layout = load_layout(args.layout)
+    if not layout.led_for_code():
+        print("The layout has no key codes yet; every press flashes the whole keyboard.", file=sys.stderr)
+    source = open_key_source(args.input)
+    if args.emulator:
+        from gembird.controller import Controller
+        from gembird.emulator import EmulatorTransport
+
+        sink = Controller(EmulatorTransport())
+    elif args.dump:
+        sink = DumpSession()
+    else:
+        from gembird.arbitration import open_session
+
+        sink = open_session(args.path, backend=args.backend, owner="gembird reactive")
+    writer = FrameWriter(sink)
+    reactive = Reactive(writer, layout, color=tuple(args.color), background=tuple(args.background),
+                        fade=args.fade, ripple=args.ripple, max_fps=args.max_fps)
+    signal.signal(signal.SIGTERM, lambda *_: reactive.stop())
+    try:
+        reactive.run(source)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        source.close()
+        reactive.close()
+        if hasattr(sink, "close"):
+            sink.close()
+    stats = reactive.stats()
+    if stats["presses"] and not args.dump:
+        print(f"✅ {stats['presses']} presses, keypress-to-light {stats['latency_median'] * 1000:.1f} ms "
+              f"median, {stats['latency_p95'] * 1000:.1f} ms p95", file=sys.stderr)
+    return 0
+
+
+def cmd_idle(args):
+    import signal
+
+    from gembird.idle import IdleManager
+    from gembird.readback import Reconciler, state_from_sequence
+    from gembird.reactive import open_key_source
+
+    if not 0.0 <= args.dim < 1.0:
+        print("❌ Error: --dim must be at least 0 and below 1", file=sys.stderr)
+        return 2
+    base = None
+    if args.base_profile:
+        from gembird.profiles import ProfileStore
+
+        with ProfileStore(capacity=1) as store:
+            if args.base_profile not in store:
+                raise OSError(f"No profile named {args.base_profile!r} in {store.path}")
+            base = state_from_sequence(store.get(args.base_profile).steps[-1][0])
+    elif args.base:
+        from gembird.protocol import create_true_static_color_sequence
+
+        base = state_from_sequence(create_true_static_color_sequence(*args.base))
+    source = open_key_source(args.input)
+    if args.emulator:
+        from gembird.controller import Controller
+        from gembird.emulator import EmulatorTransport
+
+        sink = Controller(EmulatorTransport())
+    else:
+        from gembird.arbitration import open_session
+
+        sink = open_session(args.path, backend=args.backend, owner="gembird idle")
+    reconciler = Reconciler(getattr(sink, "transport", None), sink)
+    try:
+        if base is None and reconciler.refresh() is None:
+            print("❌ Error: the keyboard's lighting cannot be read back; give --base or --base-profile "
+                  "to restore after idling", file=sys.stderr)
+            return 2
+        manager = IdleManager(reconciler, source, timeout=args.after, level=0.0 if args.blank else args.dim,
+                              base=base)
+        signal.signal(signal.SIGTERM, lambda *_: manager.stop())
+        try:
+            manager.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if manager.idle:
+                manager.wake()
+            manager.close()
+    finally:
+        source.close()
+        sink.close()
+    return 0
+
+
+def cmd_map(args):
+    from gembird.layout import save_layout
+    from gembird.mapping import FRAMES, CameraObserver, Discovery, EmulatorObserver, KeyedObserver
+
+    source = None
+    hidden = None
+    if args.emulator:
+        import random
+
+        from gembird.controller import Controller
+        from gembird.emulator import EmulatorTransport
+        from gembird.mapping import wired_slots
+
+        transport = EmulatorTransport()
+        sink = Controller(transport)
+        slots = wired_slots()
+        hidden = dict(zip(range(1, len(slots) + 1), random.sample(slots, len(slots))))
+        observer = EmulatorObserver(transport.keyboard, hidden)
+    else:
+        from gembird.arbitration import open_session
+
+        sink = open_session(args.path, backend=args.backend, owner="gembird map")
+        if args.camera:
+            def ask(index):
+                return input(f"Frame {index + 1} of {FRAMES}: photograph the keyboard, "
+                             "then enter the photo's path: ").strip()
+
+            observer = CameraObserver(ask)
+        else:
+            from gembird.reactive import EvdevSource, open_key_source
+
+            source = open_key_source(args.input)
+            if isinstance(source, EvdevSource):
+                source.grab()
+            print("For each frame, press every key lit red once, then press the last one again.")
+            observer = KeyedObserver(source, prompt=lambda index: print(f"Frame {index + 1} of {FRAMES}..."))
+    try:
+        discovery = Discovery(sink, observer)
+        layout = discovery.run()
+    finally:
+        if source is not None:
+            source.close()
+        sink.close()
+
+    for key, reason in sorted(discovery.failed.items()):
+        print(f"❌ {discovery.info.get(key, {}).get('name', key)}: {reason}")
+    print(f"✅ {len(layout)} keys mapped in {FRAMES} frames")
+    if hidden is not None:
+        wrong = sum(discovery.found.get(key) != slot for key, slot in hidden.items())
+        print(f"{'✅' if not wrong else '❌'} {len(hidden) - wrong} of {len(hidden)} match the hidden layout")
+        return 1 if wrong else 0
+    if args.dry_run:
+        return 0
+    print(f"✅ Saved to {save_layout(layout, args.output)}")
+    return 0
+
+
+def cmd_profile(args):
+    from gembird import profiles
+
+    if args.action == "apply":
+        with profiles.ProfileStore(capacity=1) as store:
+            if args.name not in store:
+                raise OSError(f"No profile named {args.name!r} in {store.path}")
+            profile = store.get(args.name)
+            with open_session(args) as session:
+                profiles.apply(profile, session, loops=args.loops)
+        return 0
+    if args.action == "list":
+        with profiles.ProfileStore() as store:
+            for name in store.names():
+                print(f"{name}: {store.spec(name)}")
+        return 0
+    if args.action == "remove":
+        with profiles.ProfileStore() as store:
+            if args.name not in store:
+                raise OSError(f"No profile named {args.name!r} in {store.path}")
+        profiles.save_profiles({}, remove={args.name})
+        return 0
+
+    import json
+
+    from gembird.layout import load_layout
+
+    try:
+        if args.action == "import":
+            with open(args.name) as f:
+                specs = json.load(f)
+        else:
+            specs = {args.name: json.loads(args.spec)}
+        path = profiles.save_profiles(specs, layout=load_layout())
+    except (ValueError, KeyError, TypeError) as ex:
+        print(f"❌ Error: not a valid profile ({ex})", file=sys.stderr)
+        return 1
+    print(f"✅ Saved {len(specs)} profile(s) in {path}")
+    return 0
+
+
+def cmd_notifyd(args):
+    import signal
+    import threading
+
+    from gembird.frames import FrameWriter
+    from gembird.layout import load_layout
+    from gembird.notify import Notifier, NotifyServer, base_from_reports
+    from gembird.profiles import ProfileStore
+    from gembird.readback import known_frame
+    from gembird.protocol import create_true_static_color_sequence
+
+    with ProfileStore() as store:
+        if args.base_profile:
+            if args.base_profile not in store:
+                raise OSError(f"No profile named {args.base_profile!r} in {store.path}")
+            base, sequence = base_from_reports(store.get(args.base_profile).steps[-1][0])
+        else:
+            base, sequence = base_from_reports(create_true_static_color_sequence(*args.base))
+        layout = load_layout(args.layout)
+        if args.emulator:
+            from gembird.controller import Controller
+            from gembird.emulator import EmulatorTransport
+
+            sink = Controller(EmulatorTransport())
+        else:
+            from gembird.arbitration import open_session
+
+            sink = open_session(args.path, backend=args.backend, owner="gembird notifyd")
+        writer = FrameWriter(sink, shown=known_frame(sink))
+        notifier = Notifier(writer, base, sequence)
+        server = NotifyServer(notifier, layout=layout, profiles=store)
+        print(f"✅ Listening for notifications on {server.path}")
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            stop.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            notifier.close()
+            writer.close()
+            if hasattr(sink, "close"):
+                sink.close()
+    return 0
+
+
+def cmd_notify(args):
+    from gembird.notify import send_notification
+
+    if args.cancel:
+        request = {"cancel": args.cancel}
+    elif args.base_profile:
+        request = {"base_profile": args.base_profile}
+    elif len(args.color) == 3:
+        request = {"color": args.color, "priority": args.priority, "ttl": args.ttl}
+        for field in ("keys", "blink", "tag"):
+            if getattr(args, field) is not None:
+                request[field] = getattr(args, field)
+    else:
+        print("❌ Error: give a colour, --cancel TAG or --base-profile NAME", file=sys.stderr)
+        return 2
+    send_notification(request)
+    return 0
+
+
+def cmd_embedded(args):
+    from gembird.arbitration import DeviceBusy, Lease
+    from gembird.embedded import EmbeddedDaemon, listen
+
+    if args.emulator:
+        from gembird.emulator import EmulatorTransport
+
+        path, transport, pacing = "emulator", EmulatorTransport(), None
+        lease = Lease(path, owner="gembird embedded")
+        if not lease.try_acquire():
+            raise DeviceBusy("another gembird process holds the emulator")
+    else:
+        from gembird import device as gdevice
+        from gembird.pacing import device_serial, load_pacing
+        from gembird.resilient import ResilientTransport
+
+        path = gdevice.resolve_path(args.path)
+        lease = Lease(path, owner="gembird embedded")
+        if not lease.try_acquire():
+            raise DeviceBusy(f"{path!r} is held by another gembird process")
+        try:
+            transport = ResilientTransport(
+                lambda rediscover: gdevice.open_device(None if rediscover else path,
+                                                       use_cache=not rediscover, backend=args.backend))
+        except BaseException:
+            lease.release()
+            raise
+        pacing = load_pacing(device_serial(path))
+    daemon = None
+    try:
+        daemon = EmbeddedDaemon(transport, listen(lease.socket_path), pacing)
+        lease.publish(ttl=None)
+        if not args.stdin:
+            print(f"✅ Listening on {lease.socket_path}", flush=True)
+        daemon.run(stdin=args.stdin)
+    finally:
+        if daemon is not None:
+            daemon.close()
+        transport.close()
+        lease.release()
+    return 0
+
+
+def fleet_token(args):
+    import os
+
+    return args.token or os.environ.get("GEMBIRD_FLEET_TOKEN") or None
+
+
+def cmd_agent(args):
+    import asyncio
+
+    from gembird.fleet import Agent
+    from gembird.layout import load_layout
+
+    if args.emulator:
+        from gembird.controller import Controller
+        from gembird.emulator import EmulatorTransport
+
+        sink = Controller(EmulatorTransport())
+    else:
+        from gembird.arbitration import open_session
+
+        sink = open_session(args.path, backend=args.backend, owner="gembird agent")
+    agent = Agent(sink, args.host, args.port, token=fleet_token(args), layout=load_layout(args.layout))
+
+    async def serve():
+        await agent.start()
+        print(f"✅ Fleet agent {agent.name} on {agent.host}:{agent.port}", flush=True)
+        await agent.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        agent.executor.shutdown(wait=True)
+        sink.close()
+    return 0
+
+
+def cmd_fleet(args):
+    import asyncio
+    import json
+    import statistics
+
+    from gembird.fleet import Fleet, read_hosts
+
+    hosts = list(args.hosts)
+    if args.hosts_file:
+        hosts += read_hosts(args.hosts_file)
+    commands = []
+    if args.ping:
+        commands.append({"ping": True})
+    if args.static:
+        commands.append({"static": args.static})
+    if args.profile:
+        from gembird.profiles import ProfileStore
+
+        with ProfileStore(capacity=0) as store:
+            if args.profile not in store:
+                raise OSError(f"No profile named {args.profile!r} in {store.path}")
+            commands.append(json.loads(store.spec(args.profile)))
+    if args.remote_profile:
+        commands.append({"profile": args.remote_profile})
+    if args.spec:
+        try:
+            commands.append(json.loads(args.spec))
+        except ValueError as ex:
+            print(f"❌ Error: not a valid profile ({ex})", file=sys.stderr)
+            return 2
+    if not hosts or not commands:
+        print("❌ Error: give hosts (or --hosts-file) and at least one of --static, --profile, "
+              "--remote-profile, --spec or --ping", file=sys.stderr)
+        return 2
+
+    async def push():
+        fleet = Fleet(hosts, parallelism=args.parallel, timeout=args.timeout, token=fleet_token(args))
+        try:
+            return await fleet.push(commands)
+        finally:
+            await fleet.close()
+
+    results = asyncio.run(push())
+    for result in results:
+        if result.ok:
+            print(f"✅ {result.host}: {result.reports} reports, {result.latency * 1000:.1f} ms")
+        else:
+            print(f"❌ {result.host}: {result.error} ({result.latency * 1000:.1f} ms)")
+    latencies = sorted(result.latency for result in results if result.ok)
+    if latencies:
+        print(f"   {len(latencies)} of {len(results)} hosts acknowledged; median "
+              f"{statistics.median(latencies) * 1000:.1f} ms, slowest {latencies[-1] * 1000:.1f} ms")
+    return 0 if len(latencies) == len(results) else 1
+
+
+def cmd_profiling(args):
+    import os
+    import signal
+
+    from gembird.profiling import profiling_dir
+
+    for pid in args.pids:
+        os.kill(pid, signal.SIGUSR2)
+    print(f"✅ Toggled profiling in {len(args.pids)} process(es); reports go to {profiling_dir()}")
+    return 0
+
+
+def cmd_bench(args):
+    from gembird import bench
+
+    return bench.run(args.name, args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="gembird", description="Gembird KB-G460 lighting control.")
+    parser.add_argument("--path", help="HID path of the control interface (skips discovery)")
+    parser.add_argument("--backend", choices=("auto", "hidraw", "hidapi", "libusb"), default="auto",
+                        help="transport used to reach the keyboard")
+    parser.add_argument("--dump", action="store_true", help="print the packets instead of sending them")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("set", help="set a static colour (normal mode)")
+    add_color_arguments(p)
+    p.set_defaults(func=cmd_set)
+
+    p = sub.add_parser("fill", help="paint every key one colour (per-key mode)")
+    add_color_arguments(p)
+    p.add_argument("--all", action="store_true", help="every connected keyboard, committed together")
+    p.set_defaults(func=cmd_fill)
+
+    p = sub.add_parser("fade", help="fade to a colour over time (normal mode)")
+    add_color_arguments(p)
+    p.add_argument("--ms", type=int, default=500, help="duration in milliseconds")
+    p.add_argument("--from", dest="start", type=color_value, nargs=3, default=(0, 0, 0),
+                   metavar=("R", "G", "B"), help="colour the keyboard currently shows")
+    p.add_argument("--easing", default="ease-in-out",
+                   choices=("linear", "ease-in", "ease-out", "ease-in-out", "sine"))
+    p.add_argument("--space", default="oklab", choices=("rgb", "linear", "oklab"))
+    p.set_defaults(func=cmd_fade)
+
+    p = sub.add_parser("effect", help="select a firmware effect, brightness and speed (normal mode)")
+    p.add_argument("name", nargs="?", help="effect name (static, or a captured one) or raw code such as 0x03")
+    p.add_argument("color", nargs="*", type=color_value, metavar="R G B")
+    p.add_argument("--brightness", type=int, default=4, help="0-4 (default 4)")
+    p.add_argument("--speed", type=int, default=4, help="0-4 (default 4)")
+    p.add_argument("--list", action="store_true", help="list the known effect codes")
+    p.set_defaults(func=cmd_effect)
+
+    p = sub.add_parser("find", help="list the keyboard's HID interfaces")
+    p.set_defaults(func=cmd_find)
+
+    p = sub.add_parser("state", help="read back the mode and colours the keyboard shows")
+    p.add_argument("--emulator", action="store_true", help="query the firmware model instead")
+    p.set_defaults(func=cmd_state)
+
+    p = sub.add_parser("forget", help="drop the cached interface path")
+    p.set_defaults(func=cmd_forget)
+
+    p = sub.add_parser("calibrate", help="measure and save the safe inter-packet gaps")
+    p.add_argument("--emulator", action="store_true", help="calibrate against the emulator model")
+    p.add_argument("--trials", type=int, default=5, help="sequences per candidate gap (emulator)")
+    p.add_argument("--dry-run", action="store_true", help="print the gaps without saving them")
+    p.set_defaults(func=cmd_calibrate)
+
+    p = sub.add_parser("serve", help="run an OpenRGB SDK server for the keyboard")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=6742)
+    p.add_argument("--layout", help="layout file (default: ~/.config/gembird/layout.json if present)")
+    p.add_argument("--emulator", action="store_true", help="drive the emulator model instead of the keyboard")
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("framebuffer", help="show a shared-memory framebuffer written by other programs")
+    p.add_argument("--name", default="default", help="framebuffer name producers open")
+    p.add_argument("--emulator", action="store_true", help="drive the emulator model instead of the keyboard")
+    p.set_defaults(func=cmd_framebuffer)
+
+    p = sub.add_parser("play", help="play an image or video clip on the keys (per-key mode)")
+    p.add_argument("file")
+    p.add_argument("--loops", type=int, default=1, help="times to play the clip (0: forever)")
+    p.add_argument("--max-fps", type=float, default=30, help="drop frames above this rate")
+    p.add_argument("--brightness", type=float, default=1.0)
+    p.add_argument("--gamma", type=float, default=1.0, help="LED gamma correction")
+    p.add_argument("--workers", type=int, default=None, help="render processes (default: one per core)")
+    p.add_argument("--layout", help="layout file (default: ~/.config/gembird/layout.json if present)")
+    p.add_argument("--compile-only", action="store_true", help="compile into the cache and exit")
+    p.set_defaults(func=cmd_play)
+
+    p = sub.add_parser("ambient", help="follow the colours of the screen or a video (per-key mode)")
+    p.add_argument("source", nargs="?", default="screen",
+                   help="screen[:N], raw:WIDTHxHEIGHT:FILE, synthetic, or a GIF/video file")
+    p.add_argument("--fps", type=float, default=30)
+    p.add_argument("--zones", type=int, default=None, help="sample this many vertical zones instead of every key")
+    p.add_argument("--smoothing", type=float, default=0.15, help="time constant in seconds")
+    p.add_argument("--threshold", type=int, default=4, help="smallest channel change that is sent")
+    p.add_argument("--brightness", type=float, default=1.0)
+    p.add_argument("--layout", help="layout file (default: ~/.config/gembird/layout.json if present)")
+    p.add_argument("--emulator", action="store_true", help="drive the emulator model instead of the keyboard")
+    p.set_defaults(func=cmd_ambient)
+
+    p = sub.add_parser("audio", help="audio spectrum or VU meter from a PCM stream (per-key mode)")
+    p.add_argument("source", nargs="?", default="-", help="- (stdin), a FIFO or raw PCM file, a .wav file, or synthetic")
+    p.add_argument("--mode", choices=("spectrum", "vu"), default="spectrum")
+    p.add_argument("--rate", type=int, default=48000, help="sample rate of raw PCM")
+    p.add_argument("--channels", type=int, default=2, help="interleaved channels of raw PCM")
+    p.add_argument("--format", choices=("s16le", "f32le"), default="s16le", help="sample format of raw PCM")
+    p.add_argument("--fps", type=float, default=60)
+    p.add_argument("--range", type=float, default=60.0, help="dB shown below full scale")
+    p.add_argument("--gain", type=float, default=0.0, help="dB added before display")
+    p.add_argument("--brightness", type=float, default=1.0)
+    p.add_argument("--layout", help="layout file (default: ~/.config/gembird/layout.json if present)")
+    p.add_argument("--emulator", action="store_true", help="drive the emulator model instead of the keyboard")
+    p.set_defaults(func=cmd_audio)
+
+    p = sub.add_parser("reactive", help="light keys as they are pressed (per-key mode)")
+    p.add_argument("--input", help="event node or hidraw keyboard interface to read keys from")
+    p.add_argument("--color", nargs=3, type=color_value, default=(255, 255, 255), metavar=("R", "G", "B"))
+    p.add_argument("--background", nargs=3, type=color_value, default=(0, 0, 0), metavar=("R", "G", "B"))
+    p.add_argument("--fade", type=float, default=0.4, help="seconds a key takes to fade after release")
+    p.add_argument("--ripple", action="store_true", help="send a ring outwards from each press")
+    p.add_argument("--max-fps", type=float, default=60, help="frame rate cap while animating")
+    p.add_argument("--layout", help="layout file (default: ~/.config/gembird/layout.json if present)")
+    p.add_argument("--emulator", action="store_true", help="drive the emulator model instead of the keyboard")
+    p.set_defaults(func=cmd_reactive)
+
+    p = sub.add_parser("idle", help="dim or blank the lighting while no key is pressed")
+    p.add_argument("--after", type=float, default=300.0, help="seconds without a key press before dimming")
+    p.add_argument("--dim", type=float, default=0.2, help="brightness while idle, as a share of normal")
+    p.add_argument("--blank", action="store_true", help="turn the lighting off while idle instead")
+    p.add_argument("--base", nargs=3, type=color_value, metavar=("R", "G", "B"),
+                   help="colour to restore if the keyboard cannot be read back")
+    p.add_argument("--base-profile", help="saved profile to restore if the keyboard cannot be read back")
+    p.add_argument("--input", help="event node or hidraw keyboard interface to read keys from")
+    p.add_argument("--emulator", action="store_true", help="drive the emulator model instead of the keyboard")
+    p.set_defaults(func=cmd_idle)
+
+    p = sub.add_parser("map", help="find which slot lights which key and write a layout file")
+    p.add_argument("--camera", action="store_true", help="answer with one photo per frame instead of key presses")
+    p.add_argument("--input", help="event node or hidraw keyboard interface to read keys from")
+    p.add_argument("--output", help="layout file to write (default: ~/.config/gembird/layout.json)")
+    p.add_argument("--dry-run", action="store_true", help="map the keys without saving the layout")
+    p.add_argument("--emulator", action="store_true", help="map a hidden random layout on the emulator model")
+    p.set_defaults(func=cmd_map)
+
+    p = sub.add_parser("profile", help="save and apply precompiled lighting profiles")
+    actions = p.add_subparsers(dest="action", required=True)
+    q = actions.add_parser("apply", help="write a saved profile to the keyboard")
+    q.add_argument("name")
+    q.add_argument("--loops", type=int, default=None, help="times to run an effect (0: forever)")
+    q = actions.add_parser("save", help="compile and save one profile")
+    q.add_argument("name")
+    q.add_argument("spec", help='JSON such as \'{"static": [255, 0, 0]}\' (see gembird/profiles.py)')
+    q = actions.add_parser("import", help="compile and save every profile in a JSON file of {name: spec}")
+    q.add_argument("name", metavar="file")
+    actions.add_parser("list", help="list the saved profiles")
+    q = actions.add_parser("remove", help="delete a saved profile")
+    q.add_argument("name")
+    p.set_defaults(func=cmd_profile)
+
+    p = sub.add_parser("notifyd", help="show notifications over the base lighting (per-key mode)")
+    p.add_argument("--base", nargs=3, type=color_value, default=(0, 0, 0), metavar=("R", "G", "B"),
+                   help="static base colour restored after notifications")
+    p.add_argument("--base-profile", help="saved profile to use as the base lighting instead")
+    p.add_argument("--layout", help="layout file for key names (default: ~/.config/gembird/layout.json if present)")
+    p.add_argument("--emulator", action="store_true", help="drive the emulator model instead of the keyboard")
+    p.set_defaults(func=cmd_notifyd)
+
+    p = sub.add_parser("notify", help="send a notification to gembird notifyd")
+    p.add_argument("color", nargs="*", type=color_value, metavar="R G B")
+    p.add_argument("--priority", type=int, default=0, help="higher preempts lower")
+    p.add_argument("--ttl", type=float, default=5.0, help="seconds to show it")
+    p.add_argument("--keys", nargs="+", help="key names or slot numbers to light (default: every key)")
+    p.add_argument("--blink", type=float, default=None, help="seconds per on/off phase")
+    p.add_argument("--tag", help="identifies the notification for coalescing and --cancel")
+    p.add_argument("--cancel", metavar="TAG", help="drop the notification with this tag")
+    p.add_argument("--base-profile", help="make a saved profile the new base lighting")
+    p.set_defaults(func=cmd_notify)
+
+    p = sub.add_parser("embedded", help="low-footprint daemon: one thread, no timers, preallocated packets")
+    p.add_argument("--stdin", action="store_true", help="also read commands from stdin, like the original scripts")
+    p.add_argument("--emulator", action="store_true", help="drive the emulator model instead of the keyboard")
+    p.set_defaults(func=cmd_embedded)
+
+    p = sub.add_parser("agent", help="expose this host's keyboard to gembird fleet over TCP")
+    p.add_argument("--host", default="127.0.0.1", help="address to listen on (0.0.0.0 for the whole network)")
+    p.add_argument("--port", type=int, default=6744)
+    p.add_argument("--token", default=None,
+                   help="shared secret coordinators must send (default: $GEMBIRD_FLEET_TOKEN)")
+    p.add_argument("--layout", help="layout file for key names (default: ~/.config/gembird/layout.json if present)")
+    p.add_argument("--emulator", action="store_true", help="drive the emulator model instead of the keyboard")
+    p.set_defaults(func=cmd_agent)
+
+    p = sub.add_parser("fleet", help="push lighting to gembird agents on many hosts at once")
+    p.add_argument("hosts", nargs="*", metavar="HOST[:PORT]")
+    p.add_argument("--hosts-file", help="file with one host per line")
+    p.add_argument("--static", nargs=3, type=color_value, metavar=("R", "G", "B"), help="static colour")
+    p.add_argument("--profile", help="a profile saved on this host, compiled on each agent")
+    p.add_argument("--remote-profile", help="a profile saved on each agent's host")
+    p.add_argument("--spec", help="a profile description in JSON (see gembird/profiles.py)")
+    p.add_argument("--ping", action="store_true", help="only check that every agent answers")
+    p.add_argument("--parallel", type=int, default=16, help="hosts pushed to at once")
+    p.add_argument("--timeout", type=float, default=5.0, help="seconds to wait for each host")
+    p.add_argument("--token", default=None,
+                   help="shared secret the agents expect (default: $GEMBIRD_FLEET_TOKEN)")
+    p.set_defaults(func=cmd_fleet)
+
+    p = sub.add_parser("profiling", help="start or stop profiling in running gembird processes")
+    p.add_argument("pids", nargs="+", type=int, metavar="PID")
+    p.set_defaults(func=cmd_profiling)
+
+    p = sub.add_parser("bench", help="run a built-in benchmark")
+    p.add_argument("name", help="benchmark to run, or all to run every one; non-zero exit if any check fails")
+    p.add_argument("--budget-ms", type=float, default=None, help="override the benchmark's budget")
+    p.set_defaults(func=cmd_bench)
+
+    return parser
+
+
+# Commands that run for a long time; SIGUSR2 toggles profiling in them.
+PROFILED = ("serve", "framebuffer", "play", "ambient", "audio", "reactive", "idle", "notifyd", "embedded", "agent")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command in PROFILED:
+        from gembird.profiling import install
+
+        install(f"gembird-{args.command}")
+    try:
+        return args.func(args)
+    except (IOError, OSError) as ex:
+        print(f"❌ Error: {ex}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
@@ -0,0 +1,175 @@
+"""Sequence-atomic access to one keyboard from many threads.
+
+A 3- or 7-packet sequence is only meaningful as a unit: a prepare packet
+from one command followed by a data packet from another corrupts the
+update. ``Controller`` owns the transport and is the only code that writes
+to it. Producers hand it whole sequences through ``submit``, which only
+appends to a ``queue.SimpleQueue`` (a C-level queue whose ``put`` never
+blocks or waits on another producer) and returns a future. A single writer
+thread drains the queue into a priority heap and writes one complete
+sequence at a time, so packets of different commands never interleave.
+
+Submission takes no lock, so a job can still be queued while ``close``
+runs. Whatever the writer did not take by the time it stops is failed
+with the same RuntimeError ``submit`` raises once closed, by ``close``
+or, for a job queued after that, by ``submit`` itself.
+"""
+
+import heapq
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+from gembird.protocol import sequence_gap
+
+# Conventional priorities; any integer works, higher goes first.
+PRIORITY_LOW = -10
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 10
+
+_STOP = object()
+
+
+class Job:
+    """One submitted sequence waiting for the writer."""
+
+    __slots__ = ("sequence", "priority", "gap", "name", "future")
+
+    def __init__(self, sequence, priority, gap, name, future):
+        self.sequence = sequence
+        self.priority = priority
+        self.gap = gap
+        self.name = name
+        self.future = future
+
+
+class Controller:
+    """
+    Serializes whole sequences onto one transport through a writer thread.
+    ``gap_for`` maps a sequence to its inter-packet gap (defaults to the
+    protocol's per-mode gaps).
+    """
+
+    def __init__(self, transport, gap_for=sequence_gap, name="gembird-writer"):
+        self.transport = transport
+        self.gap_for = gap_for
+        self.inbox = queue.SimpleQueue()
+        self.order = itertools.count()
+        self.heap = []
+        self.closed = False
+        # Set once the writer has exited: later jobs are failed, never written.
+        self.stopped = False
+        self.drain = True
+        self.sent = 0
+        self.failed = 0
+        self.writer = threading.Thread(target=self._run, name=name, daemon=True)
+        self.writer.start()
+
+    def submit(self, sequence, priority=PRIORITY_NORMAL, gap=None, name=None):
+        """
+        Queues a sequence for writing and returns a Future that resolves to
+        the sequence once it is on the wire (or to the transport's error).
+        """
+        if self.closed:
+            raise RuntimeError("controller is closed")
+        future = Future()
+        self.inbox.put(Job(list(sequence), priority, gap, name, future))
+        if self.stopped:
+            # Raced with close() past its last look at the inbox.
+            self._reject_late()
+        return future
+
+    def send(self, sequence, priority=PRIORITY_NORMAL, gap=None, name=None, timeout=None):
+        """Submits a sequence and waits until it has been written."""
+        if threading.current_thread() is self.writer:
+            raise RuntimeError("send() called from the writer thread would deadlock")
+        return self.submit(sequence, priority, gap, name).result(timeout)
+
+    def _push(self, job):
+        # Among equal priorities the heap keeps submission order.
+        heapq.heappush(self.heap, (-job.priority, next(self.order), job))
+
+    def _run(self):
+        inbox = self.inbox
+        stopping = False
+        while True:
+            if stopping and not self.drain:
+                for _, _, job in self.heap:
+                    job.future.cancel()
+                return
+            if not self.heap:
+                if stopping:
+                    return
+                item = inbox.get()
+                if item is _STOP:
+                    stopping = True
+                    continue
+                self._push(item)
+            # Pull in everything that arrived meanwhile so priorities apply.
+            while True:
+                try:
+                    item = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                else:
+                    self._push(item)
+            job = heapq.heappop(self.heap)[2]
+            self._write(job)
+
+    def _write(self, job):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        gap = self.gap_for(job.sequence) if job.gap is None else job.gap
+        try:
+            self.transport.send_sequence(job.sequence, gap)
+        except Exception as ex:
+            self.failed += 1
+            job.future.set_exception(ex)
+        else:
+            self.sent += 1
+            job.future.set_result(job.sequence)
+
+    def pending(self):
+        """Approximate number of sequences waiting to be written."""
+        return self.inbox.qsize() + len(self.heap)
+
+    def close(self, drain=True):
+        """
+        Stops the writer. With ``drain`` the queued sequences are written
+        first; otherwise they are cancelled.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.drain = drain
+        if not drain:
+            while True:
+                try:
+                    item = self.inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    item.future.cancel()
+        self.inbox.put(_STOP)
+        self.writer.join()
+        self.stopped = True
+        self._reject_late()
+
+    def _reject_late(self):
+        """Fails the jobs submitted too late for the writer to see."""
+        while True:
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and item.future.set_running_or_notify_cancel():
+                item.future.set_exception(RuntimeError("controller is closed"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,63 @@
+"""Minimal HID report descriptor parsing.
+
+Only what is needed to tell the keyboard's interfaces apart: the usage page
+and usage of each top-level collection.
+"""
+
+# Short-item tags (upper six bits of the prefix byte).
+TAG_USAGE_PAGE = 0x04
+TAG_USAGE = 0x08
+TAG_COLLECTION = 0xA0
+TAG_END_COLLECTION = 0xC0
+TAG_REPORT_ID = 0x84
+LONG_ITEM = 0xFE
+
+
+def iter_items(descriptor):
+    """Yields (tag, value) for every short item in a report descriptor."""
+    i = 0
+    end = len(descriptor)
+    while i < end:
+        prefix = descriptor[i]
+        if prefix == LONG_ITEM:
+            if i + 1 >= end:
+                return
+            i += 3 + descriptor[i + 1]
+            continue
+        size = (0, 1, 2, 4)[prefix & 0x03]
+        value = int.from_bytes(descriptor[i + 1:i + 1 + size], "little")
+        yield prefix & 0xFC, value
+        i += 1 + size
+
+
+def top_level_collections(descriptor):
+    """Returns [(usage_page, usage)] for each top-level collection."""
+    collections = []
+    usage_page = usage = 0
+    depth = 0
+    for tag, value in iter_items(descriptor):
+        if tag == TAG_USAGE_PAGE:
+            usage_page = value
+        elif tag == TAG_USAGE:
+            # A 4-byte usage carries its own page in the upper half.
+            if value > 0xFFFF:
+                usage_page, value = value >> 16, value & 0xFFFF
+            usage = value
+        elif tag == TAG_COLLECTION:
+            if depth == 0:
+                collections.append((usage_page, usage))
+            depth += 1
+        elif tag == TAG_END_COLLECTION:
+            depth = max(0, depth - 1)
+    return collections
+
+
+def report_ids(descriptor):
+    """Returns the set of report IDs declared by a descriptor."""
+    return {value for tag, value in iter_items(descriptor) if tag == TAG_REPORT_ID}
+
+
+def is_vendor_defined(descriptor):
+    """Whether the descriptor's first collection is on a vendor usage page."""
+    collections = top_level_collections(descriptor)
+    return bool(collections) and collections[0][0] >= 0xFF00
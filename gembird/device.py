@@ -0,0 +1,131 @@
+"""Locating and opening the keyboard's vendor-defined control interface.
+
+Enumerating HID devices is the slowest part of a one-shot command, so the
+path of the last interface that worked is cached on disk and tried first.
+The ``hid`` binding is only imported when enumerating or when the hidapi
+transport is chosen; a cached hidraw path is opened without it.
+"""
+
+import os
+
+from gembird import PRODUCT_ID, VENDOR_ID
+
+
+def cache_file():
+    """Returns the file that remembers the last working interface path."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "gembird", "device-path")
+
+
+def load_cached_path():
+    """Returns the cached interface path, or None if there is none."""
+    try:
+        with open(cache_file(), "rb") as f:
+            path = f.read().strip()
+    except OSError:
+        return None
+    return path or None
+
+
+def store_cached_path(path):
+    """Remembers an interface path for the next run (best effort)."""
+    target = cache_file()
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(path)
+    except OSError:
+        pass
+
+
+def forget_cached_path():
+    """Removes the cached interface path."""
+    try:
+        os.remove(cache_file())
+    except FileNotFoundError:
+        pass
+
+
+def path_matches(path, vid=VENDOR_ID, pid=PRODUCT_ID):
+    """
+    Cheaply checks that a cached hidraw path still belongs to the keyboard.
+    hidraw minors are reused after a replug, so a bare existence check is
+    not enough. Paths that are not hidraw nodes are trusted as-is.
+    """
+    from gembird.discovery import device_prefix
+
+    name = os.path.basename(path.decode() if isinstance(path, bytes) else path)
+    if not name.startswith("hidraw"):
+        return True
+    try:
+        target = os.readlink(f"/sys/class/hidraw/{name}/device")
+    except OSError:
+        return False
+    return os.path.basename(target).upper().startswith(device_prefix(vid, pid))
+
+
+def find_control_interface(vid=VENDOR_ID, pid=PRODUCT_ID):
+    """
+    Finds the specific vendor-defined interface for lighting control.
+    Uses the sysfs scan on Linux and hid.enumerate elsewhere.
+    """
+    if os.path.isdir("/sys/class/hidraw"):
+        from gembird import discovery
+
+        return discovery.find_control_interface(vid, pid)
+
+    import hid
+
+    for device in hid.enumerate(vid, pid):
+        if device['usage_page'] >= 0xff00:
+            return device['path']
+    return None
+
+
+def find_control_interfaces(vid=VENDOR_ID, pid=PRODUCT_ID):
+    """Like find_control_interface, but returns the paths of every connected keyboard."""
+    if os.path.isdir("/sys/class/hidraw"):
+        from gembird import discovery
+
+        return discovery.find_control_interfaces(vid, pid)
+
+    import hid
+
+    return [device['path'] for device in hid.enumerate(vid, pid) if device['usage_page'] >= 0xff00]
+
+
+def resolve_path(path=None, use_cache=True):
+    """
+    Returns the interface path to use without opening it: the explicit
+    path, else the cached path if it still matches, else the enumerated one.
+    Raises OSError if the keyboard cannot be found.
+    """
+    if path:
+        return path
+    if use_cache:
+        cached = load_cached_path()
+        if cached and path_matches(cached):
+            return cached
+    found = find_control_interface()
+    if not found:
+        raise OSError("Could not find the keyboard's lighting control interface.")
+    store_cached_path(found)
+    return found
+
+
+def open_device(path=None, use_cache=True, backend="auto"):
+    """
+    Opens the control interface and returns a ``Transport``.
+    Tries the explicit path, then the cached path, then enumerates.
+    Raises OSError if no interface can be opened.
+    """
+    from gembird.transport import open_transport
+
+    resolved = resolve_path(path, use_cache)
+    try:
+        return open_transport(resolved, backend)
+    except (IOError, OSError):
+        if path or not use_cache:
+            raise
+    # The cached path went stale between the check and the open.
+    return open_transport(resolve_path(use_cache=False), backend)
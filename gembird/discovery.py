@@ -0,0 +1,166 @@
+"""Finding the keyboard's interfaces through sysfs instead of hidapi.
+
+``hid.enumerate`` walks every HID node on the host before filtering by
+VID/PID. On Linux the same answer is available much more cheaply: each
+``/sys/class/hidraw/hidrawN/device`` link points at a directory named
+``BUS:VID:PID.INSTANCE``, so non-matching nodes cost one ``readlink``.
+Only the KB-G460's nodes have their ``uevent`` and ``report_descriptor``
+read. Parsed descriptors are cached by device serial and interface, in
+this process only, so later scans by a long-running tool skip the
+descriptor entirely. A one-shot command scans cold; that is cheap enough
+(``gembird bench discovery`` times it in a fresh process) that a cache
+file would cost more to open than the three small descriptors it saves.
+
+Every function takes a ``sysfs`` root so the scan can run against a
+fixture tree (see ``build_fixture``).
+"""
+
+import os
+
+from gembird import PRODUCT_ID, VENDOR_ID
+from gembird.descriptor import top_level_collections
+
+# (serial, interface) -> [(usage_page, usage), ...]; per process.
+_descriptor_cache = {}
+
+
+class HidrawNode:
+    """One hidraw interface of the keyboard."""
+
+    __slots__ = ("path", "name", "serial", "phys", "interface", "usage_page", "usage")
+
+    def __init__(self, path, name, serial, phys, interface, usage_page, usage):
+        self.path = path
+        self.name = name
+        self.serial = serial
+        self.phys = phys
+        self.interface = interface
+        self.usage_page = usage_page
+        self.usage = usage
+
+    @property
+    def vendor_defined(self):
+        return self.usage_page >= 0xFF00
+
+    def __repr__(self):
+        return (f"HidrawNode({self.path!r}, interface={self.interface}, "
+                f"usage_page=0x{self.usage_page:04x}, usage=0x{self.usage:04x})")
+
+
+def parse_uevent(text):
+    """Returns the KEY=VALUE pairs of a uevent file as a dict."""
+    return dict(line.split("=", 1) for line in text.splitlines() if "=" in line)
+
+
+def interface_number(phys):
+    """Extracts N from a HID_PHYS such as ``usb-0000:00:14.0-2/input1``."""
+    _, _, tail = phys.rpartition("/input")
+    return int(tail) if tail.isdigit() else -1
+
+
+def device_prefix(vid, pid):
+    """Name prefix of the sysfs HID device directory (bus 0003 is USB)."""
+    return f"0003:{vid:04X}:{pid:04X}."
+
+
+def scan(vid=VENDOR_ID, pid=PRODUCT_ID, sysfs="/sys", dev="/dev", use_cache=True):
+    """Returns a HidrawNode for every hidraw interface of the given device."""
+    class_dir = os.path.join(sysfs, "class", "hidraw")
+    try:
+        names = os.listdir(class_dir)
+    except FileNotFoundError:
+        return []
+
+    prefix = device_prefix(vid, pid)
+    nodes = []
+    for name in sorted(names):
+        device_dir = os.path.join(class_dir, name, "device")
+        try:
+            target = os.readlink(device_dir)
+        except OSError:
+            continue
+        if not os.path.basename(target).upper().startswith(prefix):
+            continue
+
+        try:
+            with open(os.path.join(device_dir, "uevent")) as f:
+                uevent = parse_uevent(f.read())
+        except OSError:
+            continue
+        serial = uevent.get("HID_UNIQ", "")
+        phys = uevent.get("HID_PHYS", "")
+        interface = interface_number(phys)
+
+        key = (serial or phys.rpartition("/")[0], interface)
+        collections = _descriptor_cache.get(key) if use_cache else None
+        if collections is None:
+            try:
+                with open(os.path.join(device_dir, "report_descriptor"), "rb") as f:
+                    collections = top_level_collections(f.read())
+            except OSError:
+                continue
+            _descriptor_cache[key] = collections
+        usage_page, usage = collections[0] if collections else (0, 0)
+        nodes.append(HidrawNode(os.path.join(dev, name), name, serial, phys,
+                                interface, usage_page, usage))
+    return nodes
+
+
+def find_control_interface(vid=VENDOR_ID, pid=PRODUCT_ID, sysfs="/sys", dev="/dev"):
+    """Returns the hidraw path of the vendor-defined interface as bytes, or None."""
+    for node in scan(vid, pid, sysfs, dev):
+        if node.vendor_defined:
+            return node.path.encode()
+    return None
+
+
+def find_control_interfaces(vid=VENDOR_ID, pid=PRODUCT_ID, sysfs="/sys", dev="/dev"):
+    """Returns the vendor-defined hidraw path of every connected keyboard, as bytes."""
+    return [node.path.encode() for node in scan(vid, pid, sysfs, dev) if node.vendor_defined]
+
+
+def clear_cache():
+    _descriptor_cache.clear()
+
+
+# --- Fixture trees ---
+
+# Descriptors resembling the KB-G460's interfaces.
+KEYBOARD_DESCRIPTOR = bytes.fromhex(
+    "05010906a101050719e029e715002501750195088102"
+    "95017508810105071900" "29ff150026ff0095067508" "8100c0"
+)
+CONSUMER_DESCRIPTOR = bytes.fromhex("050c0901a10185031500" "26ff0319002aff0375109501" "8100c0")
+VENDOR_DESCRIPTOR = bytes.fromhex("0600ff0901a10185041500" "26ff007508953f" "09029102" "09038102" "c0")
+
+
+def build_fixture(root, interfaces=None, others=0, serial="KBG460-FIXTURE"):
+    """
+    Creates a fake ``sys`` tree under ``root`` (and returns it) with the
+    keyboard's interfaces plus ``others`` unrelated HID nodes.
+    ``interfaces`` is a list of report descriptors, one per interface.
+    """
+    if interfaces is None:
+        interfaces = [KEYBOARD_DESCRIPTOR, CONSUMER_DESCRIPTOR, VENDOR_DESCRIPTOR]
+    class_dir = os.path.join(root, "class", "hidraw")
+    devices_dir = os.path.join(root, "devices", "usb")
+    os.makedirs(class_dir, exist_ok=True)
+
+    # (vid, pid, serial, usb port, interface, descriptor)
+    entries = [(VENDOR_ID, PRODUCT_ID, serial, 1, i, descriptor) for i, descriptor in enumerate(interfaces)]
+    entries += [(0x046D, 0xC000 + n, f"OTHER{n}", n + 2, 0, KEYBOARD_DESCRIPTOR) for n in range(others)]
+    for minor, (vid, pid, uniq, port, interface, descriptor) in enumerate(entries):
+        device_dir = os.path.join(devices_dir, f"0003:{vid:04X}:{pid:04X}.{minor + 1:04X}")
+        os.makedirs(device_dir, exist_ok=True)
+        with open(os.path.join(device_dir, "uevent"), "w") as f:
+            f.write(f"DRIVER=hid-generic\nHID_ID=0003:{vid:08X}:{pid:08X}\n"
+                    f"HID_NAME=Fixture {vid:04x}:{pid:04x}\nHID_PHYS=usb-0000:00:14.0-{port}/input{interface}\n"
+                    f"HID_UNIQ={uniq}\nMODALIAS=hid:b0003g0001v{vid:08X}p{pid:08X}\n")
+        with open(os.path.join(device_dir, "report_descriptor"), "wb") as f:
+            f.write(descriptor)
+        node_dir = os.path.join(class_dir, f"hidraw{minor}")
+        os.makedirs(node_dir, exist_ok=True)
+        link = os.path.join(node_dir, "device")
+        if not os.path.islink(link):
+            os.symlink(os.path.relpath(device_dir, node_dir), link)
+    return root
@@ -0,0 +1,139 @@
+"""Firmware effects selected through the normal-mode data packet.
+
+The 0x06 data packet carries more than the main colour. Bytes 9-11 are
+taken to select the effect, brightness and speed (see ``protocol``), so an
+effect the firmware renders itself costs the same three reports as a
+static colour, sent once, instead of a stream of host-rendered frames.
+
+Only the static effect's code is known from a capture. Codes for the
+others ("breathing", "rainbow", ...) are added to
+``$XDG_CONFIG_HOME/gembird/effects.json`` as they are captured::
+
+    {"breathing": 1, "rainbow": 3}
+
+Until then an effect can be given by its raw code, which is how the
+capture sessions probe for them.
+"""
+
+import os
+
+from gembird.protocol import (
+    BRIGHTNESS_OFFSET, CMD_SET_PROPERTIES, COMMAND_EXECUTE_UPDATE, COMMAND_PREPARE_STATIC, EFFECT_OFFSET,
+    EFFECT_STATIC, INDICATOR_COLOR_OFFSET, MAIN_COLOR_OFFSET, MAX_BRIGHTNESS, MAX_SPEED, SPEED_OFFSET,
+    TEMPLATE_SET_COLOR_PROPERTIES, seal,
+)
+
+BUILTIN_EFFECTS = {"static": EFFECT_STATIC}
+
+
+def effects_file():
+    base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "gembird", "effects.json")
+
+
+def effect_codes():
+    """Returns {name: code}: the built-in effects plus the captured ones."""
+    codes = dict(BUILTIN_EFFECTS)
+    try:
+        with open(effects_file()) as f:
+            text = f.read()
+    except OSError:
+        return codes
+    import json
+
+    try:
+        captured = json.loads(text)
+    except ValueError:
+        raise ValueError(f"{effects_file()}: not valid JSON") from None
+    for name, code in captured.items():
+        if not isinstance(code, int) or not 0 <= code <= 255:
+            raise ValueError(f"{effects_file()}: effect {name!r} needs a code from 0 to 255")
+        codes[name.lower()] = code
+    return codes
+
+
+def effect_code(effect, codes=None):
+    """Resolves an effect name or raw code (``"3"``, ``"0x03"``, 3) to its byte."""
+    if isinstance(effect, int):
+        code = effect
+    else:
+        codes = effect_codes() if codes is None else codes
+        name = effect.strip().lower()
+        if name in codes:
+            return codes[name]
+        try:
+            code = int(name, 0)
+        except ValueError:
+            raise ValueError(f"unknown effect {effect!r}; known: {', '.join(sorted(codes))} "
+                             f"(add captured codes to {effects_file()})") from None
+    if not 0 <= code <= 255:
+        raise ValueError(f"effect code {code} is outside 0-255")
+    return code
+
+
+class FirmwareEffect:
+    """The settings one normal-mode data packet carries."""
+
+    __slots__ = ("effect", "color", "brightness", "speed", "indicator")
+
+    def __init__(self, effect=EFFECT_STATIC, color=(255, 255, 255), brightness=MAX_BRIGHTNESS,
+                 speed=MAX_SPEED, indicator=(255, 0, 0)):
+        self.effect = effect_code(effect)
+        self.color = _rgb(color)
+        self.indicator = _rgb(indicator)
+        if not 0 <= brightness <= MAX_BRIGHTNESS:
+            raise ValueError(f"brightness must be 0-{MAX_BRIGHTNESS}, not {brightness}")
+        if not 0 <= speed <= MAX_SPEED:
+            raise ValueError(f"speed must be 0-{MAX_SPEED}, not {speed}")
+        self.brightness = brightness
+        self.speed = speed
+
+    def sequence(self):
+        """Returns the prepare/properties/execute reports, checksums included."""
+        data = bytearray(TEMPLATE_SET_COLOR_PROPERTIES)
+        data[EFFECT_OFFSET] = self.effect
+        data[BRIGHTNESS_OFFSET] = self.brightness
+        data[SPEED_OFFSET] = self.speed
+        data[MAIN_COLOR_OFFSET:MAIN_COLOR_OFFSET + 3] = bytes(self.color)
+        data[INDICATOR_COLOR_OFFSET:INDICATOR_COLOR_OFFSET + 3] = bytes(self.indicator)
+        return [COMMAND_PREPARE_STATIC, bytes(seal(data)), COMMAND_EXECUTE_UPDATE]
+
+    @classmethod
+    def from_report(cls, report):
+        """Decodes a normal-mode data packet; ValueError for anything else."""
+        if len(report) < INDICATOR_COLOR_OFFSET + 3 or report[3] != CMD_SET_PROPERTIES:
+            raise ValueError("not a normal-mode data packet")
+        effect = cls.__new__(cls)
+        effect.effect = report[EFFECT_OFFSET]
+        effect.brightness = report[BRIGHTNESS_OFFSET]
+        effect.speed = report[SPEED_OFFSET]
+        effect.color = tuple(report[MAIN_COLOR_OFFSET:MAIN_COLOR_OFFSET + 3])
+        effect.indicator = tuple(report[INDICATOR_COLOR_OFFSET:INDICATOR_COLOR_OFFSET + 3])
+        return effect
+
+    def name(self, codes=None):
+        codes = effect_codes() if codes is None else codes
+        for name, code in codes.items():
+            if code == self.effect:
+                return name
+        return f"0x{self.effect:02x}"
+
+    def __eq__(self, other):
+        return isinstance(other, FirmwareEffect) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _key(self):
+        return self.effect, self.color, self.brightness, self.speed, self.indicator
+
+    def __repr__(self):
+        return (f"FirmwareEffect(0x{self.effect:02x}, color={self.color}, brightness={self.brightness}, "
+                f"speed={self.speed})")
+
+
+def _rgb(value):
+    rgb = tuple(int(c) for c in value)
+    if len(rgb) != 3 or not all(0 <= c <= 255 for c in rgb):
+        raise ValueError(f"{value!r} is not an RGB colour")
+    return rgb
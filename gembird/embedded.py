@@ -0,0 +1,425 @@
+"""A low-footprint daemon for single-board hosts.
+
+``gembird embedded`` is the interactive loop of the original scripts'
+``main()`` turned into a daemon for small ARM boards next to KVM switches,
+where resident memory and idle wakeups matter more than features:
+
+* one thread and one ``selectors`` loop, blocking with no timeout: an idle
+  daemon is never scheduled (signals arrive through a wakeup pipe);
+* the lease is published without a heartbeat (see ``arbitration``), so
+  other gembird processes still forward to it without a timer running;
+* every report is written from preallocated buffers: three for normal mode
+  and seven for the per-key chunks, resealed in place;
+* state lives in ``__slots__`` objects and fixed 384-byte framebuffers;
+* nothing heavier than the standard library's basics is imported, NumPy
+  never (effects that need it run in the full tools instead).
+
+Budgets, checked by ``gembird bench embedded``: steady-state RSS at most
+16 MiB after thousands of commands, and no wakeups at all while idle.
+
+Clients send text lines on the lease's socket, as typed into ``main()``::
+
+    R G B  |  set R G B     static colour (normal mode)
+    fill R G B              every key (per-key mode, changed chunks only)
+    key SLOT R G B          one key (per-key mode, its chunk and the commit)
+    profile NAME            a stored, precompiled profile
+    profiling on [memory]   start the sampling profiler (see ``gembird.profiling``)
+    profiling off           stop it; the reply names the report file
+    stats                   counters
+
+and get ``ok`` or ``error: ...`` back. Replies the client does not read
+are queued, never waited on; a client with more than 64 KiB of them queued
+is dropped. Other gembird commands find the
+daemon through the lease and forward their sequences with the binary
+handoff protocol on the same socket.
+"""
+
+import os
+import selectors
+import socket
+
+from gembird.protocol import (
+    CMD_PER_KEY, COMMAND_EXECUTE_UPDATE, COMMAND_PREPARE_STATIC, COMMIT_CHUNK, FRAME_SIZE, HEADER_SIZE,
+    MAIN_COLOR_OFFSET, PER_KEY_CHUNKS, REPORT_ID, REPORT_SIZE, SLOT_BLUE, SLOT_COUNT, SLOT_GREEN, SLOT_RED,
+    TEMPLATE_SET_COLOR_PROPERTIES, UNUSED_SLOTS,
+)
+
+HANDOFF = ord("S")
+MAX_LINE = 256
+# Unsent replies a client may leave queued before it is dropped.
+MAX_BACKLOG = 64 * 1024
+
+
+def _seal(buffer):
+    value = sum(memoryview(buffer)[3:]) & 0xFFFF
+    buffer[1] = value & 0xFF
+    buffer[2] = value >> 8
+
+
+class PacketBuffers:
+    """The ten reports the daemon ever writes, allocated once and edited in place."""
+
+    __slots__ = ("normal", "chunks", "delta")
+
+    def __init__(self):
+        self.normal = [bytearray(COMMAND_PREPARE_STATIC), bytearray(TEMPLATE_SET_COLOR_PROPERTIES),
+                       bytearray(COMMAND_EXECUTE_UPDATE)]
+        self.chunks = []
+        for offset, length in PER_KEY_CHUNKS:
+            chunk = bytearray(REPORT_SIZE)
+            chunk[0] = REPORT_ID
+            chunk[3] = CMD_PER_KEY
+            chunk[4] = length
+            chunk[5] = offset & 0xFF
+            chunk[6] = offset >> 8
+            self.chunks.append(chunk)
+        # Reused for every per-key update: the chunks that changed.
+        self.delta = []
+
+    def static(self, r, g, b):
+        data = self.normal[1]
+        data[MAIN_COLOR_OFFSET] = r
+        data[MAIN_COLOR_OFFSET + 1] = g
+        data[MAIN_COLOR_OFFSET + 2] = b
+        _seal(data)
+        return self.normal
+
+    def per_key(self, frame, shown):
+        """Fills the chunks that differ between ``frame`` and ``shown`` (None: all); returns them."""
+        delta = self.delta
+        delta.clear()
+        view = memoryview(frame)
+        for index, (offset, length) in enumerate(PER_KEY_CHUNKS):
+            if shown is not None and index != COMMIT_CHUNK and \
+                    view[offset:offset + length] == memoryview(shown)[offset:offset + length]:
+                continue
+            chunk = self.chunks[index]
+            chunk[HEADER_SIZE:HEADER_SIZE + length] = view[offset:offset + length]
+            _seal(chunk)
+            delta.append(chunk)
+        if shown is not None and len(delta) == 1 and view == memoryview(shown):
+            delta.clear()
+        return delta
+
+
+class Connection:
+    """A client socket (None for stdin), its unparsed input and its unsent replies."""
+
+    __slots__ = ("sock", "buffer", "outgoing")
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.outgoing = bytearray()
+
+
+class EmbeddedDaemon:
+    """
+    Serves ``listener`` (a bound, listening Unix socket) and optionally
+    stdin, writing to ``transport`` with ``pacing`` (a Pacing or None).
+    """
+
+    __slots__ = ("transport", "pacing", "listener", "selector", "buffers", "frame", "shown", "shown_valid",
+                 "running", "wake", "commands", "reports", "errors", "profiler")
+
+    def __init__(self, transport, listener, pacing=None):
+        self.transport = transport
+        self.pacing = pacing
+        self.listener = listener
+        self.selector = selectors.DefaultSelector()
+        self.buffers = PacketBuffers()
+        self.frame = bytearray(FRAME_SIZE)
+        self.shown = bytearray(FRAME_SIZE)
+        # What per-key map the keyboard shows is unknown at start.
+        self.shown_valid = False
+        self.running = True
+        self.wake = None
+        self.commands = 0
+        self.reports = 0
+        self.errors = 0
+        self.profiler = None
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, None)
+
+    # --- Output ---
+
+    def _write(self, sequence):
+        if not sequence:
+            return
+        gaps = self.pacing.gaps_for(sequence) if self.pacing is not None else 0.0
+        self.transport.send_sequence(sequence, gaps)
+        self.reports += len(sequence)
+
+    def set_static(self, r, g, b):
+        self._write(self.buffers.static(r, g, b))
+        self.shown_valid = False
+
+    def show_frame(self):
+        try:
+            self._write(self.buffers.per_key(self.frame, self.shown if self.shown_valid else None))
+        except OSError:
+            self.shown_valid = False
+            raise
+        self.shown[:] = self.frame
+        self.shown_valid = True
+
+    def fill(self, r, g, b):
+        frame = self.frame
+        for slot in range(SLOT_COUNT):
+            if slot not in UNUSED_SLOTS:
+                base = slot * 3
+                frame[base + SLOT_RED] = r
+                frame[base + SLOT_BLUE] = b
+                frame[base + SLOT_GREEN] = g
+        self.show_frame()
+
+    def set_key(self, slot, r, g, b):
+        if not 0 <= slot < SLOT_COUNT or slot in UNUSED_SLOTS:
+            raise ValueError(f"slot {slot} has no LED")
+        base = slot * 3
+        self.frame[base + SLOT_RED] = r
+        self.frame[base + SLOT_BLUE] = b
+        self.frame[base + SLOT_GREEN] = g
+        self.show_frame()
+
+    def forward(self, sequence):
+        """Writes a sequence another gembird process handed over."""
+        self._write(sequence)
+        # It may be a normal-mode update or a partial per-key delta.
+        self.shown_valid = False
+
+    # --- Commands ---
+
+    def command(self, line):
+        """Runs one text command; returns the reply line."""
+        words = line.split()
+        if not words:
+            return b""
+        self.commands += 1
+        if words[0].isdigit():
+            words.insert(0, "set")
+        verb = words[0].lower()
+        try:
+            if verb == "stats":
+                return f"ok commands={self.commands} reports={self.reports} errors={self.errors}\n".encode()
+            if verb == "profile" and len(words) == 2:
+                self._profile(words[1])
+                return b"ok\n"
+            if verb == "profiling" and len(words) >= 2:
+                return self._profiling(words[1].lower(), words[2:])
+            numbers = [int(word) for word in words[1:]]
+            if verb == "key" and len(numbers) == 4:
+                _check(numbers[1:])
+                self.set_key(*numbers)
+            elif verb in ("set", "fill") and len(numbers) == 3:
+                _check(numbers)
+                (self.fill if verb == "fill" else self.set_static)(*numbers)
+            else:
+                raise ValueError(f"unknown command {line.strip()!r}")
+        except (ValueError, KeyError) as ex:
+            self.errors += 1
+            return f"error: {ex}\n".encode()
+        except OSError as ex:
+            self.errors += 1
+            return f"error: keyboard: {ex}\n".encode()
+        return b"ok\n"
+
+    def _profile(self, name):
+        from gembird.profiles import ProfileStore
+
+        with ProfileStore(capacity=0) as store:
+            if name not in store:
+                raise KeyError(f"no profile named {name!r}")
+            for reports, _ in store.get(name).steps:
+                self._write(reports)
+        self.shown_valid = False
+
+    def _profiling(self, action, options):
+        from gembird.profiling import Profiler, installed
+
+        if self.profiler is None:
+            self.profiler = installed() or Profiler(name="gembird-embedded")
+        if action == "on" and set(options) <= {"memory"}:
+            if not self.profiler.running:
+                self.profiler.memory = bool(options)
+                self.profiler.start()
+            return b"ok\n"
+        if action == "off" and not options:
+            return f"ok {self.profiler.stop()}\n".encode()
+        raise ValueError("use 'profiling on [memory]' or 'profiling off'")
+
+    # --- Loop ---
+
+    def _accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ, Connection(sock))
+
+    def _drop(self, connection):
+        self.selector.unregister(connection.sock)
+        connection.sock.close()
+
+    def _reply(self, connection, data):
+        """
+        Sends what the socket takes now and queues the rest, never blocking
+        the loop on a client that does not read; returns False if it was dropped.
+        """
+        if not data:
+            return True
+        if connection.outgoing:
+            connection.outgoing += data
+            if len(connection.outgoing) > MAX_BACKLOG:
+                self._drop(connection)
+                return False
+            return True
+        try:
+            sent = connection.sock.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._drop(connection)
+            return False
+        if sent < len(data):
+            connection.outgoing += data[sent:]
+            self.selector.modify(connection.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, connection)
+        return True
+
+    def _writable(self, connection):
+        """Sends queued replies; returns False if the client was dropped."""
+        try:
+            sent = connection.sock.send(connection.outgoing)
+        except BlockingIOError:
+            return True
+        except OSError:
+            self._drop(connection)
+            return False
+        del connection.outgoing[:sent]
+        if not connection.outgoing:
+            self.selector.modify(connection.sock, selectors.EVENT_READ, connection)
+        return True
+
+    def _readable(self, connection):
+        try:
+            data = connection.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(connection)
+            return
+        buffer = connection.buffer
+        buffer += data
+        while buffer:
+            if buffer[0] == HANDOFF:
+                if len(buffer) < 3:
+                    return
+                size = 3 + buffer[2] * REPORT_SIZE
+                if len(buffer) < size:
+                    return
+                sequence = [bytes(buffer[offset:offset + REPORT_SIZE]) for offset in range(3, size, REPORT_SIZE)]
+                del buffer[:size]
+                try:
+                    self.forward(sequence)
+                    reply = b"\x00"
+                except OSError as ex:
+                    message = str(ex).encode()[:0xFFFF]
+                    reply = b"\x01" + len(message).to_bytes(2, "little") + message
+            else:
+                end = buffer.find(b"\n")
+                if end < 0:
+                    if len(buffer) > MAX_LINE:
+                        self._drop(connection)
+                    return
+                line = bytes(buffer[:end]).decode("ascii", "replace")
+                del buffer[:end + 1]
+                reply = self.command(line)
+            if not self._reply(connection, reply):
+                return
+
+    def _stdin(self, connection):
+        data = os.read(0, 4096)
+        if not data:
+            self.selector.unregister(0)
+            return
+        connection.buffer += data
+        while b"\n" in connection.buffer:
+            line, _, rest = bytes(connection.buffer).partition(b"\n")
+            connection.buffer[:] = rest
+            if line.strip().lower() in (b"exit", b"quit"):
+                self.running = False
+                return
+            reply = self.command(line.decode("ascii", "replace"))
+            os.write(1, reply)
+
+    def run(self, stdin=False):
+        """Serves until ``stop()``, SIGTERM/SIGINT or "exit" on stdin."""
+        import signal
+
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(write_fd, False)
+        self.wake = write_fd
+        self.selector.register(read_fd, selectors.EVENT_READ, "wake")
+        if stdin:
+            self.selector.register(0, selectors.EVENT_READ, Connection(None))
+        previous = signal.set_wakeup_fd(write_fd, warn_on_full_buffer=False)
+        handlers = {signum: signal.signal(signum, self._signal) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            while self.running:
+                for key, events in self.selector.select():
+                    if key.data is None:
+                        self._accept()
+                    elif key.data == "wake":
+                        os.read(read_fd, 512)
+                    elif key.fd == 0:
+                        self._stdin(key.data)
+                    elif events & selectors.EVENT_WRITE and not self._writable(key.data):
+                        continue
+                    elif events & selectors.EVENT_READ:
+                        self._readable(key.data)
+        finally:
+            signal.set_wakeup_fd(previous)
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            self.selector.unregister(read_fd)
+            os.close(read_fd)
+            os.close(write_fd)
+            self.wake = None
+
+    def _signal(self, signum, frame):
+        self.running = False
+
+    def stop(self):
+        self.running = False
+        if self.wake is not None:
+            try:
+                os.write(self.wake, b"\x00")
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            if isinstance(key.data, Connection) and key.data.sock is not None:
+                key.data.sock.close()
+        self.selector.close()
+        self.listener.close()
+
+
+def _check(rgb):
+    if not all(0 <= c <= 255 for c in rgb):
+        raise ValueError("color values must be between 0 and 255")
+
+
+def listen(path):
+    """Binds a Unix stream socket at ``path``, replacing a stale one."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(8)
+    return listener
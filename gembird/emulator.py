@@ -0,0 +1,217 @@
+"""A software model of the KB-G460's lighting firmware.
+
+``EmulatedKeyboard`` decodes the reports the real firmware receives and
+keeps the state they would produce: the normal-mode colour and effect
+settings after a prepare/properties/execute sequence, and the per-key map
+after the commit chunk. It rejects reports with a bad checksum and, to
+model a firmware that cannot keep up, drops any packet that arrives sooner
+after its predecessor than the predecessor's processing time
+(``processing`` maps a packet kind to seconds). What it cannot know about
+the real device it does not invent: the processing times are parameters,
+not measurements, and effects are recorded, not rendered.
+
+Reading state back is modelled the way ``gembird.readback`` hypothesises
+it works: a feature report read returns the data packet that set the
+normal-mode state, or in per-key mode the next chunk of the applied map in
+turn. ``readback=False`` models a firmware that answers with zeros.
+
+``EmulatorTransport`` plugs the model in wherever a Transport is expected.
+``VirtualClock`` lets pacing-sensitive code run without real sleeps.
+"""
+
+import time
+
+from gembird.protocol import (
+    BRIGHTNESS_OFFSET, CMD_EXECUTE, CMD_PER_KEY, CMD_PREPARE, CMD_SET_PROPERTIES, COMMIT_CHUNK,
+    EFFECT_OFFSET, EFFECT_STATIC, HEADER_SIZE, INDICATOR_COLOR_OFFSET, KIND_EXECUTE, KIND_PER_KEY,
+    KIND_PREPARE, KIND_PROPERTIES, MAIN_COLOR_OFFSET, MAX_BRIGHTNESS, MAX_SPEED, PER_KEY_CHUNKS,
+    REPORT_ID, SPEED_OFFSET, checksum, encode_chunk, new_frame, packet_kind,
+)
+from gembird.transport import Transport
+
+# Processing times used when none are given: comfortably below the gaps the
+# original scripts used, so those scripts run cleanly against the model.
+DEFAULT_PROCESSING = {
+    KIND_PREPARE: 0.008,
+    KIND_PROPERTIES: 0.012,
+    KIND_EXECUTE: 0.010,
+    KIND_PER_KEY: 0.006,
+}
+
+
+class VirtualClock:
+    """A monotonic clock that only moves when slept on."""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+
+class EmulatedKeyboard:
+    """State machine fed with raw 64-byte reports."""
+
+    def __init__(self, processing=None, clock=time.monotonic, readback=True):
+        self.processing = dict(DEFAULT_PROCESSING if processing is None else processing)
+        self.clock = clock
+        self.readback = readback
+        self.busy_until = 0.0
+
+        # Visible state.
+        self.mode = "per-key"
+        self.color = (0, 0, 0)
+        self.indicator = (255, 0, 0)
+        # Normal-mode effect settings, as far as the hypothesised fields go.
+        self.effect = EFFECT_STATIC
+        self.brightness = MAX_BRIGHTNESS
+        self.speed = MAX_SPEED
+        self.properties = None
+        self.frame = new_frame()
+
+        # Firmware-internal staging.
+        self.prepared = False
+        self.staged_properties = None
+        self.staging = new_frame()
+        self.received_chunks = set()
+        self.feature_cursor = 0
+
+        # Counters.
+        self.accepted = 0
+        self.dropped = 0
+        self.bad_checksum = 0
+        self.protocol_errors = 0
+        self.applied = 0
+        self.feature_reads = 0
+        self.commits = []
+        self.log = []
+
+    def reset(self):
+        """Models a power cycle: visible and staged state are lost."""
+        self.__init__(self.processing, self.clock, self.readback)
+
+    def feed(self, report):
+        """Processes one report as the firmware would."""
+        report = bytes(report)
+        now = self.clock()
+        if len(report) < HEADER_SIZE or report[0] != REPORT_ID:
+            self.protocol_errors += 1
+            return False
+        if now < self.busy_until:
+            self.dropped += 1
+            self.log.append(("dropped", packet_kind(report)))
+            return False
+        if report[1] | report[2] << 8 != checksum(report.ljust(64, b"\x00")):
+            self.bad_checksum += 1
+            return False
+        kind = packet_kind(report)
+        self.busy_until = now + self.processing.get(kind, 0.0)
+        self.accepted += 1
+        self.log.append(("accepted", kind))
+        handler = {
+            CMD_PREPARE: self._prepare,
+            CMD_SET_PROPERTIES: self._properties,
+            CMD_EXECUTE: self._execute,
+            CMD_PER_KEY: self._per_key,
+        }.get(report[3])
+        if handler is None:
+            self.protocol_errors += 1
+            return False
+        handler(report)
+        return True
+
+    def _prepare(self, report):
+        self.prepared = True
+        self.staged_properties = None
+
+    def _properties(self, report):
+        if not self.prepared:
+            self.protocol_errors += 1
+            return
+        self.staged_properties = report.ljust(64, b"\x00")
+
+    def _execute(self, report):
+        if not self.prepared or self.staged_properties is None:
+            self.protocol_errors += 1
+            self.prepared = False
+            return
+        data = self.staged_properties
+        self.properties = data
+        self.mode = "static"
+        self.color = tuple(data[MAIN_COLOR_OFFSET:MAIN_COLOR_OFFSET + 3])
+        self.indicator = tuple(data[INDICATOR_COLOR_OFFSET:INDICATOR_COLOR_OFFSET + 3])
+        self.effect = data[EFFECT_OFFSET]
+        self.brightness = data[BRIGHTNESS_OFFSET]
+        self.speed = data[SPEED_OFFSET]
+        self.prepared = False
+        self.staged_properties = None
+        self.applied += 1
+
+    def _per_key(self, report):
+        length = report[4]
+        offset = report[5] | report[6] << 8
+        try:
+            index = PER_KEY_CHUNKS.index((offset, length))
+        except ValueError:
+            self.protocol_errors += 1
+            return
+        self.staging[offset:offset + length] = report[HEADER_SIZE:HEADER_SIZE + length]
+        self.received_chunks.add(index)
+        if index == COMMIT_CHUNK:
+            self.frame = bytearray(self.staging)
+            self.mode = "per-key"
+            self.received_chunks.clear()
+            self.applied += 1
+            self.commits.append(self.clock())
+
+    def feature_report(self, report_id):
+        """Answers a feature report read (see the module docstring)."""
+        self.feature_reads += 1
+        if not self.readback or report_id != REPORT_ID:
+            return bytes([report_id]) + bytes(63)
+        if self.mode == "static":
+            return bytes(self.properties)
+        index = self.feature_cursor
+        self.feature_cursor = (index + 1) % len(PER_KEY_CHUNKS)
+        return encode_chunk(self.frame, index)
+
+
+class EmulatorTransport(Transport):
+    """Transport that feeds an EmulatedKeyboard; sleeps go through ``sleep``."""
+
+    name = "emulator"
+
+    def __init__(self, path=None, keyboard=None, sleep=time.sleep):
+        self.path = path
+        self.keyboard = keyboard or EmulatedKeyboard()
+        self.sleep = sleep
+        self.written = 0
+
+    def write(self, report):
+        self.keyboard.feed(report)
+        self.written += 1
+        return len(report)
+
+    def read(self, size=64, timeout=None):
+        return None
+
+    def get_feature_report(self, report_id, size=64):
+        return self.keyboard.feature_report(report_id)[:size]
+
+    def send_sequence(self, sequence, gap=0.0):
+        gaps = [gap] * len(sequence) if isinstance(gap, (int, float)) else gap
+        for payload, pause in zip(sequence, gaps):
+            self.write(payload)
+            if pause:
+                self.sleep(pause)
+
+
+def virtual_keyboard(processing=None):
+    """Returns (transport, keyboard, clock) running on a VirtualClock."""
+    clock = VirtualClock()
+    keyboard = EmulatedKeyboard(processing, clock=clock)
+    return EmulatorTransport(keyboard=keyboard, sleep=clock.sleep), keyboard, clock
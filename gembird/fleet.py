@@ -0,0 +1,278 @@
+"""Pushing lighting to keyboards on many hosts.
+
+``gembird agent`` runs on each workstation and exposes its keyboard over
+TCP (port 6744 by default, on 127.0.0.1 unless ``--host`` says otherwise).
+``gembird fleet`` (``Fleet``) connects to every agent and pushes the same
+commands to all of them at once, at most ``parallelism`` hosts in flight,
+and reports each host's acknowledgement and round-trip latency.
+
+Requests and replies are JSON lines::
+
+    {"id": 7, "token": "...", "commands": [{"static": [0, 80, 255]}, ...]}
+    {"id": 7, "ok": true, "host": "lab-12", "reports": 3, "ms": 71.5}
+    {"id": 7, "ok": false, "host": "lab-12", "error": "..."}
+
+A command is any profile description (``{"static": ...}``, ``{"keys":
+...}``, ``{"firmware": ...}``, a fade or a cycle; see ``gembird.profiles``),
+compiled on the agent against its own layout, or ``{"profile": NAME}`` for
+a profile stored on the agent's host, or ``{"ping": true}``. The commands
+of one request are a batch: applied in order, looping profiles once, and
+acknowledged with one reply when the last report is on the wire. An agent
+applies one batch at a time, so batches from several coordinators never
+interleave.
+
+``Fleet`` keeps one connection per agent and reuses it for every push; a
+connection that broke is reopened once before the host is reported as
+failed. An agent started with a token refuses requests without it.
+"""
+
+import hmac
+import json
+import time
+
+DEFAULT_PORT = 6744
+MAX_LINE = 1 << 20
+
+
+def parse_host(text, port=DEFAULT_PORT):
+    """Splits ``host``, ``host:port`` or ``[v6]:port`` into (host, port)."""
+    if text.startswith("["):
+        host, _, rest = text[1:].partition("]")
+        return host, int(rest[1:]) if rest.startswith(":") else port
+    if text.count(":") == 1:
+        host, _, number = text.partition(":")
+        return host, int(number)
+    return text, port
+
+
+def read_hosts(path):
+    """Reads one host per line from ``path``; blank lines and ``#`` comments are skipped."""
+    with open(path) as f:
+        return [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+
+
+# --- Agent ---
+
+class Agent:
+    """Serves one sink (anything with ``send``) to fleet coordinators."""
+
+    def __init__(self, sink, host="127.0.0.1", port=DEFAULT_PORT, token=None, layout=None, name=None):
+        import socket
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.sink = sink
+        self.host = host
+        self.port = port
+        self.token = token
+        self.layout = layout
+        self.name = name or socket.gethostname()
+        # One writer: batches are applied whole and in arrival order.
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="gembird-agent")
+        self.server = None
+        self.connections = 0
+        self.batches = 0
+        self.reports = 0
+        self.errors = 0
+
+    async def start(self):
+        import asyncio
+
+        self.server = await asyncio.start_server(self._serve, self.host, self.port, limit=MAX_LINE)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    async def _serve(self, reader, writer):
+        import asyncio
+
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self._handle(line)
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, line):
+        import asyncio
+
+        reply = {"id": None, "host": self.name}
+        try:
+            request = json.loads(line)
+            reply["id"] = request.get("id")
+            if self.token is not None and not hmac.compare_digest(str(request.get("token", "")), self.token):
+                raise PermissionError("bad or missing token")
+            commands = request.get("commands")
+            if not isinstance(commands, list):
+                raise ValueError("'commands' must be a list")
+            profiles = [self._compile(command) for command in commands]
+            start = time.monotonic()
+            reports = await asyncio.get_running_loop().run_in_executor(self.executor, self._apply, profiles)
+        except KeyError as ex:
+            self.errors += 1
+            reply.update(ok=False, error=f"missing field {ex}")
+            return reply
+        except (ValueError, TypeError, PermissionError) as ex:
+            self.errors += 1
+            reply.update(ok=False, error=str(ex))
+            return reply
+        except OSError as ex:
+            self.errors += 1
+            reply.update(ok=False, error=f"keyboard: {ex}")
+            return reply
+        self.batches += 1
+        self.reports += reports
+        reply.update(ok=True, reports=reports, ms=round((time.monotonic() - start) * 1000, 2))
+        return reply
+
+    def _compile(self, command):
+        from gembird.profiles import ProfileStore, compile_spec
+
+        if not isinstance(command, dict):
+            raise ValueError(f"{command!r} is not a command")
+        if command.get("ping"):
+            return None
+        if "profile" in command:
+            with ProfileStore(capacity=0) as store:
+                if command["profile"] not in store:
+                    raise ValueError(f"no profile named {command['profile']!r} on this host")
+                return store.get(command["profile"])
+        return compile_spec("fleet", command, self.layout)
+
+    def _apply(self, profiles):
+        from gembird.profiles import apply
+
+        reports = 0
+        for profile in profiles:
+            if profile is not None:
+                apply(profile, self.sink, loops=1)
+                reports += profile.reports()
+        return reports
+
+
+# --- Coordinator ---
+
+class HostResult:
+    """One host's answer to a push: ``ok``, ``latency`` (seconds), ``reports`` or ``error``."""
+
+    __slots__ = ("host", "ok", "latency", "reports", "error")
+
+    def __init__(self, host, ok, latency, reports=0, error=None):
+        self.host = host
+        self.ok = ok
+        self.latency = latency
+        self.reports = reports
+        self.error = error
+
+    def __repr__(self):
+        state = f"{self.reports} reports" if self.ok else self.error
+        return f"HostResult({self.host!r}, {state}, {self.latency * 1000:.1f} ms)"
+
+
+class Fleet:
+    """
+    Pushes command batches to many agents concurrently, at most
+    ``parallelism`` at a time, each bounded by ``timeout`` seconds.
+    """
+
+    def __init__(self, hosts, parallelism=16, timeout=5.0, token=None, port=DEFAULT_PORT):
+        self.hosts = list(hosts)
+        self.parallelism = max(1, parallelism)
+        self.timeout = timeout
+        self.token = token
+        self.port = port
+        self.connections = {}
+        self.ids = 0
+        self.connects = 0
+        self.semaphore = None
+
+    async def _connection(self, host):
+        import asyncio
+
+        entry = self.connections.get(host)
+        if entry is None:
+            reader, writer = await asyncio.open_connection(*parse_host(host, self.port), limit=MAX_LINE)
+            entry = self.connections[host] = (reader, writer, asyncio.Lock())
+            self.connects += 1
+        return entry
+
+    def _drop(self, host):
+        entry = self.connections.pop(host, None)
+        if entry is not None:
+            entry[1].close()
+
+    async def _request(self, host, commands):
+        reader, writer, lock = await self._connection(host)
+        async with lock:
+            self.ids += 1
+            request = {"id": self.ids, "commands": commands}
+            if self.token is not None:
+                request["token"] = self.token
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+            line = await reader.readline()
+        if not line:
+            raise ConnectionResetError("agent closed the connection")
+        reply = json.loads(line)
+        if reply.get("id") != request["id"]:
+            raise ConnectionError(f"reply {reply.get('id')} does not answer request {request['id']}")
+        return reply
+
+    async def _push_one(self, host, commands):
+        import asyncio
+
+        async with self.semaphore:
+            start = time.monotonic()
+            for attempt in range(2):
+                reused = host in self.connections
+                try:
+                    reply = await asyncio.wait_for(self._request(host, commands), self.timeout)
+                    break
+                except asyncio.TimeoutError:
+                    error = "timed out"
+                except (OSError, ValueError) as ex:
+                    error = str(ex) or type(ex).__name__
+                    # A connection that broke since the last push is worth one reopen.
+                    if reused and not attempt:
+                        self._drop(host)
+                        continue
+                self._drop(host)
+                return HostResult(host, False, time.monotonic() - start, error=error)
+            latency = time.monotonic() - start
+        if not reply.get("ok"):
+            return HostResult(host, False, latency, error=reply.get("error", "refused"))
+        return HostResult(host, True, latency, reply.get("reports", 0))
+
+    async def push(self, commands):
+        """Sends one batch of commands to every host; returns a HostResult per host, in host order."""
+        import asyncio
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.parallelism)
+        return await asyncio.gather(*(self._push_one(host, list(commands)) for host in self.hosts))
+
+    async def close(self):
+        for host in list(self.connections):
+            writer = self.connections.pop(host)[1]
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
@@ -0,0 +1,126 @@
+"""Per-key frame output with delta chunking and latest-frame-wins pacing.
+
+The per-key colour map is sent as seven chunks, each with its own offset
+into the 384-byte framebuffer. When only a few keys change, only the chunks
+that contain them need to go out, followed by the commit chunk that makes
+the firmware apply the map.
+
+``FrameWriter`` remembers what the keyboard currently shows and turns each
+new frame into that minimal delta. Producers that render faster than the
+link can carry call ``submit``: frames that arrive while one is being
+written replace each other, so the keyboard always gets the newest frame
+and never a backlog.
+"""
+
+import threading
+import time
+
+from gembird.protocol import COMMIT_CHUNK, PER_KEY_CHUNKS, encode_chunk
+
+
+def changed_chunks(previous, current):
+    """
+    Returns the chunk indices whose bytes differ between two framebuffers,
+    plus the commit chunk whenever anything changed. ``previous`` may be
+    None, meaning the keyboard's state is unknown.
+    """
+    if previous is None:
+        return list(range(len(PER_KEY_CHUNKS)))
+    changed = [index for index, (offset, length) in enumerate(PER_KEY_CHUNKS)
+               if previous[offset:offset + length] != current[offset:offset + length]]
+    if changed and changed[-1] != COMMIT_CHUNK:
+        changed.append(COMMIT_CHUNK)
+    return changed
+
+
+def delta_sequence(previous, current):
+    """Encodes only the chunks needed to go from ``previous`` to ``current``."""
+    return [encode_chunk(current, index) for index in changed_chunks(previous, current)]
+
+
+class FrameWriter:
+    """
+    Sends per-key frames through a Controller as minimal deltas.
+    ``frame_seconds`` is a moving average of how long a frame update takes
+    on the wire, i.e. the measured device update rate. ``on_shown(taken,
+    done)`` is called from the background writer after each frame, with the
+    monotonic times it picked the frame up and finished writing it.
+    """
+
+    def __init__(self, controller, priority=0, shown=None, on_shown=None):
+        self.controller = controller
+        self.priority = priority
+        self.shown = None if shown is None else bytearray(shown)
+        self.frame_seconds = None
+        self.frames = 0
+        self.chunks = 0
+        self.dropped = 0
+        self.on_shown = on_shown
+        self.pending = None
+        self.busy = False
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def show(self, frame):
+        """Sends ``frame`` now (blocking) and returns the number of chunks written."""
+        sequence = delta_sequence(self.shown, frame)
+        if not sequence:
+            return 0
+        start = time.monotonic()
+        self.controller.send(sequence, priority=self.priority)
+        elapsed = time.monotonic() - start
+        # Normalise to a full frame so partial deltas do not skew the rate.
+        per_frame = elapsed * len(PER_KEY_CHUNKS) / len(sequence)
+        self.frame_seconds = per_frame if self.frame_seconds is None else 0.8 * self.frame_seconds + 0.2 * per_frame
+        self.shown = bytearray(frame)
+        self.frames += 1
+        self.chunks += len(sequence)
+        return len(sequence)
+
+    def submit(self, frame):
+        """Queues a frame for the background writer; a newer frame replaces it."""
+        with self.cond:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = bytes(frame)
+            if self.thread is None:
+                self.running = True
+                self.thread = threading.Thread(target=self._run, name="gembird-frames", daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.pending is None and self.running:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+                frame, self.pending = self.pending, None
+                self.busy = True
+            taken = time.monotonic()
+            try:
+                self.show(frame)
+                if self.on_shown is not None:
+                    self.on_shown(taken, time.monotonic())
+            except OSError:
+                # The keyboard's state is unknown now; resend in full next time.
+                self.shown = None
+            finally:
+                with self.cond:
+                    self.busy = False
+                    self.cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits until every submitted frame has been written."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.pending is None and not self.busy, timeout)
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,205 @@
+"""Dimming the lighting while nobody types.
+
+``IdleManager`` watches the keyboard's own key input (any source from
+``gembird.reactive``: the event node, the boot keyboard interface, or an
+``InjectedSource`` in tests) and, once no key has been pressed for
+``timeout`` seconds, dims the lighting to ``level`` (0 blanks it). The first
+key press brings the previous lighting back.
+
+Waiting costs nothing:
+
+* while the lighting is on, the manager sleeps in ``select`` until a
+  single deadline, the last key event plus ``timeout``, without watching
+  the input at all. At the deadline it drains the events that queued up
+  meanwhile. If there were any, the deadline moves to the newest one plus
+  ``timeout``, so typing costs one wakeup per ``timeout`` and not one per
+  key;
+* while dimmed, it sleeps on the input descriptor with no timeout at all:
+  a sleeping desk generates no wakeups, and the first press is answered
+  at once.
+
+Event node timestamps are taken by the kernel, so the deadline follows
+the real last press. The boot keyboard interface is stamped when it is
+read, so there the lighting can stay on for up to twice ``timeout``.
+
+The lighting to restore is read back from the keyboard when it goes idle
+(see ``gembird.readback``), or is the ``base`` given when it cannot be
+read. Both dimming and restoring go through a ``Reconciler``, so only the
+difference is sent. Among the ways to encode the dimmed state, the one
+with the fewest reports for dimming and restoring together is used:
+
+* a static colour is scaled (three reports each way); a firmware effect
+  gets a lower brightness;
+* a per-key map is scaled chunk by chunk. To blank it, turning the
+  chunks that are lit off is compared with a black static colour (three
+  reports, but then all seven chunks to restore).
+"""
+
+import os
+import selectors
+import time
+
+from gembird.readback import DeviceState
+
+
+def scale_table(level):
+    """A ``bytes.translate`` table scaling every byte by ``level``."""
+    return bytes(round(value * level) for value in range(256))
+
+
+def transition_cost(state, target):
+    """Reports needed to go from ``state`` (None: unknown) to ``target``."""
+    if target.mode == "static":
+        if state is not None and state.mode == "static" and state.effect == target.effect:
+            return 0
+        return len(target.effect.sequence())
+    from gembird.frames import changed_chunks
+
+    previous = state.frame if state is not None and state.mode == "per-key" else None
+    return len(changed_chunks(previous, target.frame))
+
+
+def idle_states(state, level):
+    """The encodings of ``state`` dimmed to ``level`` (0: blank), cheapest first."""
+    from gembird.effects import FirmwareEffect
+    from gembird.protocol import EFFECT_STATIC
+
+    table = scale_table(level)
+    black = DeviceState("static", effect=FirmwareEffect(EFFECT_STATIC, (0, 0, 0), indicator=(0, 0, 0)))
+    if state.mode == "static":
+        effect = state.effect
+        if not level:
+            return [black]
+        if effect.effect == EFFECT_STATIC:
+            dimmed = FirmwareEffect(effect.effect, bytes(effect.color).translate(table), effect.brightness,
+                                    effect.speed, bytes(effect.indicator).translate(table))
+        else:
+            dimmed = FirmwareEffect(effect.effect, effect.color, max(1, round(effect.brightness * level)),
+                                    effect.speed, bytes(effect.indicator).translate(table))
+        return [DeviceState("static", effect=dimmed)]
+    candidates = [DeviceState("per-key", frame=state.frame.translate(table))]
+    if not level:
+        candidates.append(black)
+    return sorted(candidates, key=lambda target: transition_cost(state, target) + transition_cost(target, state))
+
+
+class IdleManager:
+    """
+    Dims the lighting behind ``reconciler`` (a ``readback.Reconciler``)
+    after ``timeout`` seconds without key events from ``source``.
+    ``base`` (a DeviceState) is restored when the keyboard cannot be read.
+    """
+
+    def __init__(self, reconciler, source, timeout=300.0, level=0.2, base=None, clock=time.monotonic):
+        if not 0.0 <= level < 1.0:
+            raise ValueError(f"the idle level must be at least 0 and below 1, not {level}")
+        self.reconciler = reconciler
+        self.source = source
+        self.timeout = timeout
+        self.level = level
+        self.base = base
+        self.clock = clock
+        self.saved = None
+        self.deadline = None
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_write, False)
+        self.wakeups = 0
+        self.sleeps = 0
+        self.reports = 0
+        self.latencies = []
+
+    @property
+    def idle(self):
+        return self.saved is not None
+
+    def _show(self, target):
+        if target.mode == "static":
+            return self.reconciler.show_effect(target.effect)
+        return self.reconciler.show_frame(target.frame)
+
+    def sleep(self):
+        """Dims the lighting now; returns the number of reports sent."""
+        state = self.reconciler.refresh() if self.reconciler.supported is not False else None
+        state = state or self.base
+        if state is None:
+            # Nothing to come back to: leave the lighting alone.
+            return 0
+        target = idle_states(state, self.level)[0]
+        self.saved = state
+        self.sleeps += 1
+        sent = self._show(target)
+        self.reports += sent
+        return sent
+
+    def wake(self, when=None):
+        """Restores the lighting from before ``sleep``; ``when`` is the press that woke it."""
+        saved, self.saved = self.saved, None
+        sent = self._show(saved)
+        self.reports += sent
+        if when is not None:
+            self.latencies.append(self.clock() - when)
+        return sent
+
+    def _drain(self, selector):
+        """Reads every queued event; returns the newest one's time, None if there was none, or False at EOF."""
+        newest = None
+        while any(key.fileobj is self.source for key, _ in selector.select(0)):
+            events = self.source.read()
+            if events is None:
+                return False
+            # Input without key events (autorepeat, sync) is activity too.
+            latest = max(when for _, _, when in events) if events else self.clock()
+            newest = latest if newest is None else max(newest, latest)
+        return newest
+
+    def run(self):
+        """Dims and restores until the source ends or ``stop`` is called."""
+        awake = selectors.DefaultSelector()
+        awake.register(self.wake_read, selectors.EVENT_READ)
+        asleep = selectors.DefaultSelector()
+        asleep.register(self.wake_read, selectors.EVENT_READ)
+        asleep.register(self.source, selectors.EVENT_READ)
+        self.deadline = self.clock() + self.timeout
+        try:
+            while True:
+                if self.idle:
+                    ready = asleep.select()
+                else:
+                    ready = awake.select(max(0.0, self.deadline - self.clock()))
+                self.wakeups += 1
+                if any(key.fileobj == self.wake_read for key, _ in ready):
+                    os.read(self.wake_read, 64)
+                    return
+                if self.idle:
+                    events = self.source.read()
+                    if events is None:
+                        return
+                    if any(pressed for _, pressed, _ in events):
+                        self.wake(min(when for _, pressed, when in events if pressed))
+                        newest = self._drain(asleep)
+                        if newest is False:
+                            return
+                        self.deadline = max([when for _, _, when in events] + [newest or 0.0]) + self.timeout
+                    continue
+                newest = self._drain(asleep)
+                if newest is False:
+                    return
+                if newest is not None and newest + self.timeout > self.clock():
+                    self.deadline = newest + self.timeout
+                else:
+                    self.sleep()
+                    self.deadline = None if self.idle else self.clock() + self.timeout
+        finally:
+            awake.close()
+            asleep.close()
+
+    def stop(self):
+        """Makes ``run`` return; safe from other threads and signal handlers."""
+        try:
+            os.write(self.wake_write, b"x")
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.wake_read)
+        os.close(self.wake_write)
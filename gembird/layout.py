@@ -0,0 +1,140 @@
+"""Which framebuffer slot lights which key, and where that key sits.
+
+The per-key framebuffer has 128 slots, of which the ones in
+``protocol.UNUSED_SLOTS`` have no LED behind them. Which key each remaining
+slot belongs to has not been captured yet, so the default layout names the
+LEDs after their slots and places slot ``n`` at column ``n // 8``, row
+``n % 8`` (slots come in groups of eight, the eighth often unwired, which
+looks like the keyboard's column scan). A measured layout can replace it:
+``~/.config/gembird/layout.json`` is loaded when present::
+
+    {"name": "KB-G460 ISO",
+     "keys": [{"slot": 0, "name": "Key: Escape", "x": 0, "y": 0, "code": 1}, ...]}
+
+``x`` and ``y`` are optional and default to the slot geometry. ``code`` is
+the key's Linux input event code (as in ``linux/input-event-codes.h``),
+needed only by modes that react to key presses.
+"""
+
+import os
+
+from gembird.protocol import SLOT_COUNT, UNUSED_SLOTS
+
+
+def layout_file():
+    """Returns the file a measured layout is loaded from."""
+    base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "gembird", "layout.json")
+
+
+def slot_position(slot):
+    """Default (x, y) of a slot: column-major groups of eight."""
+    return slot // 8, slot % 8
+
+
+class Layout:
+    """
+    An ordered list of LEDs. LED ``i`` is framebuffer slot ``slots[i]``,
+    called ``names[i]``, at grid position ``positions[i]``, and lit by the
+    key with input event code ``codes[i]`` (None if unknown).
+    """
+
+    __slots__ = ("name", "slots", "names", "positions", "codes", "width", "height")
+
+    def __init__(self, name, slots, names, positions, codes=None):
+        if codes is None:
+            codes = [None] * len(slots)
+        if not len(slots) == len(names) == len(positions) == len(codes):
+            raise ValueError("slots, names, positions and codes must have the same length")
+        for slot in slots:
+            if not 0 <= slot < SLOT_COUNT:
+                raise ValueError(f"slot {slot} is outside the framebuffer")
+        if len(set(slots)) != len(slots):
+            raise ValueError("a slot appears more than once in the layout")
+        self.name = name
+        self.slots = tuple(slots)
+        self.names = tuple(names)
+        self.positions = tuple(positions)
+        self.codes = tuple(codes)
+        self.width = max((x for x, _ in positions), default=-1) + 1
+        self.height = max((y for _, y in positions), default=-1) + 1
+
+    def __len__(self):
+        return len(self.slots)
+
+    def matrix(self):
+        """Returns rows of LED indices (None where there is no key)."""
+        grid = [[None] * self.width for _ in range(self.height)]
+        for index, (x, y) in enumerate(self.positions):
+            grid[y][x] = index
+        return grid
+
+    def slot_for(self, key):
+        """Resolves a slot number, or a key name with or without its "Key: " prefix, to a slot."""
+        if isinstance(key, int) or key.isdigit():
+            return int(key)
+        for name in (key, f"Key: {key}"):
+            if name in self.names:
+                return self.slots[self.names.index(name)]
+        raise ValueError(f"unknown key {key!r}")
+
+    def led_for_code(self):
+        """Returns {input event code: LED index} for the keys whose code is known."""
+        return {code: index for index, code in enumerate(self.codes) if code is not None}
+
+    def to_dict(self):
+        keys = []
+        for slot, name, (x, y), code in zip(self.slots, self.names, self.positions, self.codes):
+            key = {"slot": slot, "name": name, "x": x, "y": y}
+            if code is not None:
+                key["code"] = code
+            keys.append(key)
+        return {"name": self.name, "keys": keys}
+
+    @classmethod
+    def from_dict(cls, data):
+        keys = data["keys"]
+        slots = [int(key["slot"]) for key in keys]
+        names = [key.get("name") or f"Key: Slot {slot}" for key, slot in zip(keys, slots)]
+        positions = []
+        for key, slot in zip(keys, slots):
+            x, y = slot_position(slot)
+            positions.append((int(key.get("x", x)), int(key.get("y", y))))
+        codes = [None if key.get("code") is None else int(key["code"]) for key in keys]
+        return cls(data.get("name", "KB-G460"), slots, names, positions, codes)
+
+
+def default_layout():
+    """One LED per wired slot, named and placed after the slot."""
+    slots = [slot for slot in range(SLOT_COUNT) if slot not in UNUSED_SLOTS]
+    return Layout("KB-G460", slots, [f"Key: Slot {slot}" for slot in slots],
+                  [slot_position(slot) for slot in slots])
+
+
+def load_layout(path=None):
+    """
+    Loads a layout file; without ``path``, the user's layout or the default.
+    Raises OSError if the file cannot be read or is not a valid layout.
+    """
+    import json
+
+    if path is None:
+        path = layout_file()
+        if not os.path.exists(path):
+            return default_layout()
+    with open(path) as f:
+        try:
+            return Layout.from_dict(json.load(f))
+        except (ValueError, KeyError, TypeError) as ex:
+            raise OSError(f"{path} is not a valid layout ({ex})") from None
+
+
+def save_layout(layout, path=None):
+    """Writes a layout file (to the user's layout by default) and returns its path."""
+    import json
+
+    path = path or layout_file()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(layout.to_dict(), f, indent=1)
+    return path
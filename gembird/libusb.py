@@ -0,0 +1,416 @@
+"""Asynchronous libusb transport (optional, needs ``pip install libusb1``).
+
+Instead of one blocking write per report, ``LibusbTransport`` submits
+interrupt-OUT transfers to the vendor interface's endpoint and keeps up to
+``depth`` of them in flight. Transfers on one endpoint are executed by the
+host controller in submission order, so the firmware still sees the packets
+of a sequence strictly in order; completions are collected on a dedicated
+event thread and reported per transfer. Pacing gaps are kept between
+submissions rather than after each completion, so a paced sequence still
+overlaps every transfer's latency with the gap that follows it.
+
+``FakeContext`` implements the small slice of the ``usb1`` API used here so
+the pipelining logic can be exercised without hardware.
+"""
+
+import queue
+import threading
+import time
+
+from gembird import PRODUCT_ID, VENDOR_ID
+from gembird.descriptor import is_vendor_defined
+from gembird.transport import Transport
+
+# libusb_transfer_status values (identical to the usb1 constants).
+TRANSFER_COMPLETED = 0
+TRANSFER_ERROR = 1
+TRANSFER_TIMED_OUT = 2
+TRANSFER_CANCELLED = 3
+TRANSFER_STALL = 4
+TRANSFER_NO_DEVICE = 5
+TRANSFER_OVERFLOW = 6
+
+STATUS_NAMES = {
+    TRANSFER_COMPLETED: "completed",
+    TRANSFER_ERROR: "error",
+    TRANSFER_TIMED_OUT: "timed out",
+    TRANSFER_CANCELLED: "cancelled",
+    TRANSFER_STALL: "stall",
+    TRANSFER_NO_DEVICE: "no device",
+    TRANSFER_OVERFLOW: "overflow",
+}
+
+HID_CLASS = 3
+ENDPOINT_IN = 0x80
+TRANSFER_TYPE_INTERRUPT = 0x03
+GET_DESCRIPTOR = 0x06
+HID_REPORT_DESCRIPTOR = 0x22
+SET_REPORT = 0x09
+HID_OUTPUT_REPORT = 0x02
+
+
+class TransferResult:
+    """Outcome of one submitted report."""
+
+    __slots__ = ("index", "status", "length")
+
+    def __init__(self, index, status, length):
+        self.index = index
+        self.status = status
+        self.length = length
+
+    @property
+    def ok(self):
+        return self.status == TRANSFER_COMPLETED
+
+    def __repr__(self):
+        return f"TransferResult(index={self.index}, status={STATUS_NAMES.get(self.status, self.status)}, length={self.length})"
+
+
+class TransferError(OSError):
+    """Raised when a transfer of a sequence does not complete."""
+
+    def __init__(self, result, results):
+        super().__init__(f"report {result.index} {STATUS_NAMES.get(result.status, result.status)}")
+        self.result = result
+        self.results = results
+
+
+def find_vendor_interface(handle):
+    """Returns (interface number, OUT endpoint or None) of the vendor-defined interface."""
+    for setting in handle.getDevice().iterSettings():
+        if setting.getClass() != HID_CLASS:
+            continue
+        number = setting.getNumber()
+        try:
+            descriptor = handle.controlRead(ENDPOINT_IN | 0x01, GET_DESCRIPTOR,
+                                            HID_REPORT_DESCRIPTOR << 8, number, 4096)
+        except Exception:
+            continue
+        if not is_vendor_defined(descriptor):
+            continue
+        out_endpoint = None
+        for endpoint in setting.iterEndpoints():
+            address = endpoint.getAddress()
+            if not address & ENDPOINT_IN and endpoint.getAttributes() & 0x03 == TRANSFER_TYPE_INTERRUPT:
+                out_endpoint = address
+        return number, out_endpoint
+    raise OSError("Could not find the keyboard's vendor-defined USB interface.")
+
+
+class LibusbTransport(Transport):
+    """
+    Pipelined transport: up to ``depth`` interrupt-OUT transfers in flight.
+    ``path`` is accepted for symmetry with the other backends; the device
+    is opened by VID/PID.
+    """
+
+    name = "libusb"
+    pipelined = True
+
+    def __init__(self, path=None, context=None, depth=4, timeout=1.0):
+        if context is None:
+            import usb1
+
+            context = usb1.USBContext()
+        self.path = path
+        self.context = context
+        self.timeout_ms = int(timeout * 1000)
+        self.handle = context.openByVendorIDAndProductID(VENDOR_ID, PRODUCT_ID, skip_on_error=True)
+        if self.handle is None:
+            raise OSError("Could not open the keyboard through libusb.")
+        self.interface, self.endpoint = find_vendor_interface(self.handle)
+        self.handle.setAutoDetachKernelDriver(True)
+        self.handle.claimInterface(self.interface)
+
+        self.depth = max(1, depth) if self.endpoint is not None else 1
+        self.transfers = [self.handle.getTransfer() for _ in range(self.depth)]
+        self.completions = queue.SimpleQueue()
+        # Earliest time the next report may be submitted (pacing gaps).
+        self.next_due = 0.0
+        self.running = True
+        self.event_thread = threading.Thread(target=self._handle_events, name="gembird-libusb", daemon=True)
+        self.event_thread.start()
+
+    def _handle_events(self):
+        while self.running:
+            self.context.handleEvents()
+
+    def _completed(self, transfer):
+        # Runs on the event thread.
+        self.completions.put(TransferResult(transfer.getUserData(), transfer.getStatus(),
+                                            transfer.getActualLength()))
+
+    def _submit(self, transfer, index, report):
+        transfer.setInterrupt(self.endpoint, report, callback=self._completed,
+                              user_data=index, timeout=self.timeout_ms)
+        transfer.submit()
+
+    def submit_sequence(self, sequence, gaps=None):
+        """
+        Streams a sequence with up to ``depth`` reports in flight. ``gaps``
+        (one per report, default none) are kept between submissions: a
+        report is submitted no sooner than its predecessor's submission
+        plus that report's gap, whether or not the predecessor has completed,
+        and the last gap carries over to the next call. The host controller
+        runs transfers in order, so the packets reach the firmware at least
+        that far apart, give or take the jitter of one transfer.
+        Returns the per-report results; raises TransferError on the first
+        failed report. The transfers queued behind it are cancelled, but one
+        the host controller has already started cannot be called back, so
+        after a failure the firmware may still have seen a later packet and
+        the sequence must be sent again from its start or from the failure.
+        """
+        gaps = list(gaps) if gaps is not None else [0.0] * len(sequence)
+        if self.endpoint is None:
+            return [self._control_write(index, report, gaps[index]) for index, report in enumerate(sequence)]
+
+        results = []
+        free = list(self.transfers)
+        in_flight = {}
+        failure = None
+        reports = iter(enumerate(sequence))
+        pending = True
+        while True:
+            while pending and free and failure is None and time.monotonic() >= self.next_due:
+                item = next(reports, None)
+                if item is None:
+                    pending = False
+                    break
+                transfer = free.pop()
+                in_flight[item[0]] = transfer
+                self._submit(transfer, *item)
+                self.next_due = time.monotonic() + gaps[item[0]]
+            waiting = pending and free and failure is None
+            if not in_flight and not waiting:
+                break
+            timeout = max(0.0, self.next_due - time.monotonic()) if waiting else None
+            if not in_flight:
+                time.sleep(timeout)
+                continue
+            try:
+                result = self.completions.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            free.append(in_flight.pop(result.index))
+            results.append(result)
+            if not result.ok and failure is None:
+                failure = result
+                pending = False
+                for transfer in in_flight.values():
+                    try:
+                        transfer.cancel()
+                    except Exception:
+                        pass
+        results.sort(key=lambda r: r.index)
+        if failure is not None:
+            raise TransferError(failure, results)
+        return results
+
+    def _control_write(self, index, report, gap=0.0):
+        """SET_REPORT fallback for interfaces without an interrupt-OUT endpoint."""
+        delay = self.next_due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        length = self.handle.controlWrite(0x21, SET_REPORT, (HID_OUTPUT_REPORT << 8) | report[0],
+                                          self.interface, report, self.timeout_ms)
+        self.next_due = time.monotonic() + gap
+        return TransferResult(index, TRANSFER_COMPLETED, length)
+
+    def write(self, report):
+        return self.submit_sequence([report])[0].length
+
+    def send_sequence(self, sequence, gap=0.0):
+        sequence = list(sequence)
+        gaps = [gap] * len(sequence) if isinstance(gap, (int, float)) else gap
+        return self.submit_sequence(sequence, gaps)
+
+    def close(self):
+        if self.handle is None:
+            return
+        self.running = False
+        self.context.interruptEventHandler()
+        self.event_thread.join()
+        for transfer in self.transfers:
+            transfer.close()
+        self.handle.releaseInterface(self.interface)
+        self.handle.close()
+        self.handle = None
+
+
+# --- Fake libusb context ---
+
+class FakeEndpoint:
+    def __init__(self, address):
+        self.address = address
+
+    def getAddress(self):
+        return self.address
+
+    def getAttributes(self):
+        return TRANSFER_TYPE_INTERRUPT
+
+
+class FakeSetting:
+    def __init__(self, number, descriptor, endpoints):
+        self.number = number
+        self.descriptor = descriptor
+        self.endpoints = [FakeEndpoint(address) for address in endpoints]
+
+    def getNumber(self):
+        return self.number
+
+    def getClass(self):
+        return HID_CLASS
+
+    def iterEndpoints(self):
+        return iter(self.endpoints)
+
+
+class FakeTransfer:
+    def __init__(self, context):
+        self.context = context
+        self.status = None
+        self.length = 0
+
+    def setInterrupt(self, endpoint, data, callback=None, user_data=None, timeout=0):
+        self.endpoint = endpoint
+        self.data = bytes(data)
+        self.callback = callback
+        self.user_data = user_data
+
+    def submit(self):
+        self.context._submit(self)
+
+    def cancel(self):
+        self.context._cancel(self)
+
+    def getStatus(self):
+        return self.status
+
+    def getActualLength(self):
+        return self.length
+
+    def getUserData(self):
+        return self.user_data
+
+    def close(self):
+        pass
+
+
+class FakeHandle:
+    def __init__(self, context):
+        self.context = context
+        self.claimed = set()
+
+    def getDevice(self):
+        return self
+
+    def iterSettings(self):
+        return iter(self.context.settings)
+
+    def controlRead(self, request_type, request, value, index, length, timeout=0):
+        for setting in self.context.settings:
+            if setting.number == index:
+                return setting.descriptor[:length]
+        raise OSError("no such interface")
+
+    def controlWrite(self, request_type, request, value, index, data, timeout=0):
+        self.context.written.append(bytes(data))
+        return len(data)
+
+    def setAutoDetachKernelDriver(self, enable):
+        pass
+
+    def claimInterface(self, number):
+        self.claimed.add(number)
+
+    def releaseInterface(self, number):
+        self.claimed.discard(number)
+
+    def getTransfer(self):
+        return FakeTransfer(self.context)
+
+    def close(self):
+        pass
+
+
+# A boot keyboard on interface 0 and a vendor page (0xFF00) on interface 1.
+FAKE_KEYBOARD_DESCRIPTOR = bytes.fromhex("05010906a101c0")
+FAKE_VENDOR_DESCRIPTOR = bytes.fromhex("0600ff0901a1018504c0")
+
+
+class FakeContext:
+    """
+    Stand-in for ``usb1.USBContext``. Submitted transfers complete in order,
+    each ``latency`` seconds after submission but no sooner than
+    ``interval`` after the previous one (the endpoint's polling interval).
+    ``fail_at`` maps a write index (counted across the context's lifetime)
+    to the status it should fail with; ``sink`` receives every completed
+    report.
+    """
+
+    def __init__(self, latency=0.0, interval=0.0, fail_at=None, sink=None):
+        self.settings = [
+            FakeSetting(0, FAKE_KEYBOARD_DESCRIPTOR, [0x81]),
+            FakeSetting(1, FAKE_VENDOR_DESCRIPTOR, [0x82, 0x03]),
+        ]
+        self.latency = latency
+        self.interval = interval
+        self.last_due = 0.0
+        self.fail_at = dict(fail_at or {})
+        self.sink = sink
+        self.written = []
+        self.max_in_flight = 0
+        self.submitted = 0
+        self.queue = []
+        self.cond = threading.Condition()
+        self.interrupted = False
+
+    def openByVendorIDAndProductID(self, vid, pid, skip_on_error=False):
+        return FakeHandle(self)
+
+    def _submit(self, transfer):
+        with self.cond:
+            transfer.sequence = self.submitted
+            transfer.due = max(time.monotonic() + self.latency, self.last_due + self.interval)
+            self.last_due = transfer.due
+            self.submitted += 1
+            self.queue.append(transfer)
+            self.max_in_flight = max(self.max_in_flight, len(self.queue))
+            self.cond.notify()
+
+    def _cancel(self, transfer):
+        with self.cond:
+            if transfer in self.queue:
+                transfer.cancelled = True
+
+    def handleEvents(self):
+        with self.cond:
+            while not self.queue and not self.interrupted:
+                self.cond.wait()
+            if self.interrupted:
+                self.interrupted = False
+                return
+            transfer = self.queue[0]
+        delay = transfer.due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        with self.cond:
+            self.queue.pop(0)
+        if getattr(transfer, "cancelled", False):
+            transfer.cancelled = False
+            transfer.status, transfer.length = TRANSFER_CANCELLED, 0
+        elif transfer.sequence in self.fail_at:
+            transfer.status, transfer.length = self.fail_at[transfer.sequence], 0
+        else:
+            transfer.status, transfer.length = TRANSFER_COMPLETED, len(transfer.data)
+            self.written.append(transfer.data)
+            if self.sink is not None:
+                self.sink(transfer.data)
+        transfer.callback(transfer)
+
+    def interruptEventHandler(self):
+        with self.cond:
+            self.interrupted = True
+            self.cond.notify()
@@ -0,0 +1,332 @@
+"""Finding which framebuffer slot lights which key.
+
+Probing the 128 slots one at a time takes 128 looks at the keyboard.
+Instead, every wired slot shows its index in a reflected Gray code, one
+bit per frame: red for 1, blue for 0. Seven frames cover 128 slots; an
+eighth frame adds a parity bit that gives every code word an odd number
+of ones. That way every wired key is red at least once, so no key can be
+mistaken for an unwired one, and one misread bit shows up as a parity
+error instead of a wrong slot. Gray code keeps neighbouring slots one bit
+apart, so a photo's colour bleed between adjacent LEDs costs at most a
+single bit.
+
+Whoever watches the frames is an observer:
+
+* ``KeyedObserver``: the person at the keyboard presses every key that is
+  lit red, reading presses through ``gembird.reactive``, so the layout also
+  learns each key's input event code;
+* ``CameraObserver``: one photo per frame, from a fixed camera; lit spots
+  are found in the photos, which also gives every key its position;
+* ``EmulatorObserver``: reads the emulator's framebuffer through a hidden
+  slot permutation, to check the decoding.
+
+The decoded keys become a ``gembird.layout.Layout``.
+"""
+
+import os
+import selectors
+
+from gembird.layout import Layout, slot_position
+from gembird.protocol import SLOT_BLUE, SLOT_COUNT, SLOT_RED, UNUSED_SLOTS, new_frame, set_slot
+
+BITS = (SLOT_COUNT - 1).bit_length()
+FRAMES = BITS + 1
+ONE = (255, 0, 0)
+ZERO = (0, 0, 255)
+
+# Input event code -> key name, for keys found by pressing them.
+KEY_NAMES = {
+    1: "Escape", 2: "1", 3: "2", 4: "3", 5: "4", 6: "5", 7: "6", 8: "7", 9: "8", 10: "9", 11: "0",
+    12: "Minus", 13: "Equals", 14: "Backspace", 15: "Tab", 16: "Q", 17: "W", 18: "E", 19: "R",
+    20: "T", 21: "Y", 22: "U", 23: "I", 24: "O", 25: "P", 26: "Left Bracket", 27: "Right Bracket",
+    28: "Enter", 29: "Left Control", 30: "A", 31: "S", 32: "D", 33: "F", 34: "G", 35: "H", 36: "J",
+    37: "K", 38: "L", 39: "Semicolon", 40: "Quote", 41: "Back Tick", 42: "Left Shift",
+    43: "Backslash", 44: "Z", 45: "X", 46: "C", 47: "V", 48: "B", 49: "N", 50: "M", 51: "Comma",
+    52: "Period", 53: "Forward Slash", 54: "Right Shift", 55: "Number Pad *", 56: "Left Alt",
+    57: "Space", 58: "Caps Lock", 59: "F1", 60: "F2", 61: "F3", 62: "F4", 63: "F5", 64: "F6",
+    65: "F7", 66: "F8", 67: "F9", 68: "F10", 69: "Num Lock", 70: "Scroll Lock",
+    71: "Number Pad 7", 72: "Number Pad 8", 73: "Number Pad 9", 74: "Number Pad -",
+    75: "Number Pad 4", 76: "Number Pad 5", 77: "Number Pad 6", 78: "Number Pad +",
+    79: "Number Pad 1", 80: "Number Pad 2", 81: "Number Pad 3", 82: "Number Pad 0",
+    83: "Number Pad .", 86: "ISO Backslash", 87: "F11", 88: "F12", 96: "Number Pad Enter",
+    97: "Right Control", 98: "Number Pad /", 99: "Print Screen", 100: "Right Alt", 102: "Home",
+    103: "Up Arrow", 104: "Page Up", 105: "Left Arrow", 106: "Right Arrow", 107: "End",
+    108: "Down Arrow", 109: "Page Down", 110: "Insert", 111: "Delete", 119: "Pause/Break",
+    125: "Left Windows", 126: "Right Windows", 127: "Menu",
+}
+
+
+# --- Codes ---
+
+def gray(number):
+    return number ^ number >> 1
+
+
+def gray_decode(code):
+    number = 0
+    while code:
+        number ^= code
+        code >>= 1
+    return number
+
+
+def codeword(slot):
+    """The bits a slot shows, one per frame: its Gray code, then odd parity."""
+    code = gray(slot)
+    bits = [code >> bit & 1 for bit in range(BITS)]
+    return bits + [1 - sum(bits) % 2]
+
+
+def wired_slots():
+    return [slot for slot in range(SLOT_COUNT) if slot not in UNUSED_SLOTS]
+
+
+def pattern_frames(slots=None):
+    """The ``FRAMES`` framebuffers to show, in order."""
+    slots = wired_slots() if slots is None else slots
+    frames = []
+    for index in range(FRAMES):
+        frame = new_frame()
+        for slot in slots:
+            set_slot(frame, slot, *(ONE if codeword(slot)[index] else ZERO))
+        frames.append(bytes(frame))
+    return frames
+
+
+def decode(bits):
+    """Returns the slot whose code word is ``bits``, or None if the parity is wrong."""
+    if len(bits) != FRAMES or sum(bits) % 2 == 0:
+        return None
+    return gray_decode(sum(bit << index for index, bit in enumerate(bits[:BITS])))
+
+
+def decode_observations(observations, slots=None):
+    """
+    Decodes {key: bits}. Returns ({key: slot}, {key: reason}) for the keys
+    that decoded and the ones that did not (a parity error, an unwired slot,
+    or a slot two keys decoded to).
+    """
+    wired = set(wired_slots() if slots is None else slots)
+    found, failed = {}, {}
+    for key, bits in observations.items():
+        slot = decode(bits)
+        if slot is None:
+            failed[key] = "parity error"
+        elif slot not in wired:
+            failed[key] = f"decoded to unwired slot {slot}"
+        else:
+            found[key] = slot
+    owners = {}
+    for key, slot in found.items():
+        owners.setdefault(slot, []).append(key)
+    for slot, keys in owners.items():
+        if len(keys) > 1:
+            for key in keys:
+                del found[key]
+                failed[key] = f"slot {slot} shared with {len(keys) - 1} other key(s)"
+    return found, failed
+
+
+# --- Observers ---
+
+class EmulatorObserver:
+    """Reads an EmulatedKeyboard through ``hidden``, a {key: slot} permutation."""
+
+    method = "emulator"
+
+    def __init__(self, keyboard, hidden):
+        self.keyboard = keyboard
+        self.hidden = hidden
+        self.observations = {key: [] for key in hidden}
+
+    def observe(self, index, frame):
+        shown = self.keyboard.frame
+        for key, slot in self.hidden.items():
+            self.observations[key].append(int(shown[slot * 3 + SLOT_RED] > shown[slot * 3 + SLOT_BLUE]))
+
+    def results(self):
+        return self.observations, {}
+
+
+class KeyedObserver:
+    """
+    The person at the keyboard presses every key lit red, then presses the
+    last of them again to finish the frame. ``source`` is a key source from
+    ``gembird.reactive``; ``prompt`` is called with each frame's number.
+    """
+
+    method = "keyed"
+
+    def __init__(self, source, prompt=print):
+        self.source = source
+        self.prompt = prompt
+        self.pressed = []
+
+    def _presses(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.source, selectors.EVENT_READ)
+        try:
+            while True:
+                selector.select()
+                events = self.source.read()
+                if events is None:
+                    raise EOFError("the key source closed")
+                for code, pressed, _ in events:
+                    if pressed:
+                        yield code
+        finally:
+            selector.close()
+
+    def observe(self, index, frame):
+        self.prompt(index)
+        keys, last = set(), None
+        for code in self._presses():
+            if code == last:
+                break
+            keys.add(code)
+            last = code
+        self.pressed.append(keys)
+
+    def results(self):
+        keys = set().union(*self.pressed)
+        observations = {code: [int(code in frame) for frame in self.pressed] for code in keys}
+        info = {code: {"name": f"Key: {KEY_NAMES.get(code, f'Code {code}')}", "code": code} for code in keys}
+        return observations, info
+
+
+def find_spots(images, threshold=0.35, min_area=4, scale=None):
+    """
+    Returns the lit spots of a series of photos as a list of pixel index
+    arrays, plus the (x, y) centroid of each. A spot is a connected region
+    that is bright in at least one photo.
+    """
+    import numpy
+
+    brightest = numpy.max([image[..., [0, 2]].max(axis=2) for image in images], axis=0)
+    height, width = brightest.shape
+    step = scale or max(1, width // 480)
+    mask = brightest[::step, ::step] > threshold * numpy.percentile(brightest, 99.5)
+    rows, columns = mask.shape
+
+    labels = numpy.zeros(mask.shape, dtype=numpy.int32)
+    count = 0
+    for start in zip(*numpy.nonzero(mask)):
+        if labels[start]:
+            continue
+        count += 1
+        labels[start] = count
+        stack = [start]
+        while stack:
+            y, x = stack.pop()
+            for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if 0 <= ny < rows and 0 <= nx < columns and mask[ny, nx] and not labels[ny, nx]:
+                    labels[ny, nx] = count
+                    stack.append((ny, nx))
+
+    spots, centres = [], []
+    flat = labels.ravel()
+    order = numpy.argsort(flat, kind="stable")
+    bounds = numpy.searchsorted(flat[order], numpy.arange(1, count + 2))
+    for label in range(count):
+        members = order[bounds[label]:bounds[label + 1]]
+        if len(members) < min_area:
+            continue
+        ys, xs = numpy.divmod(members, columns)
+        # Back to full-resolution pixel indices.
+        spots.append((ys * step, xs * step))
+        centres.append((float(xs.mean() * step), float(ys.mean() * step)))
+    return spots, centres
+
+
+def grid_positions(centres):
+    """
+    Quantises spot centroids into integer (x, y) key positions. The key
+    pitch is the median distance from a spot to its nearest neighbour; a
+    new row starts where the next spot down is more than half a pitch lower.
+    """
+    import math
+
+    if len(centres) < 2:
+        return [(0, 0)] * len(centres)
+    nearest = sorted(min(math.dist(a, b) for j, b in enumerate(centres) if j != i)
+                     for i, a in enumerate(centres))
+    pitch = nearest[len(nearest) // 2] or 1.0
+    order = sorted(range(len(centres)), key=lambda i: centres[i][1])
+    rows, row = [0] * len(centres), 0
+    for previous, current in zip(order, order[1:]):
+        if centres[current][1] - centres[previous][1] > pitch / 2:
+            row += 1
+        rows[current] = row
+    left = min(x for x, _ in centres)
+    return [(round((x - left) / pitch), rows[i]) for i, (x, _) in enumerate(centres)]
+
+
+class CameraObserver:
+    """
+    One photo per frame from a camera that does not move. ``ask`` is called
+    with each frame's number and returns the photo (a path or an RGB array).
+    Needs NumPy, and Pillow for image files.
+    """
+
+    method = "camera"
+
+    def __init__(self, ask):
+        self.ask = ask
+        self.images = []
+
+    def observe(self, index, frame):
+        import numpy
+
+        image = self.ask(index)
+        if isinstance(image, (str, os.PathLike)):
+            from PIL import Image
+
+            with Image.open(image) as photo:
+                image = numpy.asarray(photo.convert("RGB"))
+        self.images.append(numpy.asarray(image, dtype=numpy.float32))
+
+    def results(self):
+        spots, centres = find_spots(self.images)
+        observations, info = {}, {}
+        for number, ((ys, xs), position) in enumerate(zip(spots, grid_positions(centres))):
+            bits = []
+            for image in self.images:
+                pixels = image[ys, xs]
+                bits.append(int(pixels[:, 0].sum() > pixels[:, 2].sum()))
+            observations[number] = bits
+            info[number] = {"name": f"Key: LED {number}", "position": position}
+        return observations, info
+
+
+# --- Discovery ---
+
+class Discovery:
+    """Shows the pattern frames through ``sink`` and decodes what ``observer`` saw."""
+
+    def __init__(self, sink, observer, slots=None):
+        self.sink = sink
+        self.observer = observer
+        self.slots = wired_slots() if slots is None else slots
+        self.found = {}
+        self.failed = {}
+        self.info = {}
+
+    def run(self):
+        """Returns the decoded Layout; ``failed`` lists the keys that did not decode."""
+        from gembird.protocol import per_key_sequence
+
+        for index, frame in enumerate(pattern_frames(self.slots)):
+            self.sink.send(per_key_sequence(frame))
+            self.observer.observe(index, frame)
+        observations, self.info = self.observer.results()
+        self.found, self.failed = decode_observations(observations, self.slots)
+        return self.layout()
+
+    def layout(self, name="KB-G460"):
+        keys = sorted(self.found, key=self.found.get)
+        slots = [self.found[key] for key in keys]
+        info = [self.info.get(key, {}) for key in keys]
+        return Layout(name, slots,
+                      [entry.get("name") or f"Key: Slot {slot}" for entry, slot in zip(info, slots)],
+                      [entry.get("position") or slot_position(slot) for entry, slot in zip(info, slots)],
+                      [entry.get("code") for entry in info])
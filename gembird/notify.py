@@ -0,0 +1,359 @@
+"""Notifications flashed over the user's lighting.
+
+A ``Notifier`` owns the keyboard's per-key output and keeps the user's
+base lighting cached: as a framebuffer, and optionally as the exact
+normal-mode reports that set it (a stored profile, say). A notification
+is a colour with a priority, a time to live, an optional key mask and an
+optional blink period. It is painted over the base on the keys in its
+mask only.
+
+Active notifications sit in a heap ordered by priority; the one at the
+front is shown, and a higher-priority arrival preempts it. A preempted
+notification keeps counting down its time to live and comes back if it
+outlives the one in front. Expired entries are dropped lazily when they
+reach the front. When nothing is left the cached base goes back out
+unchanged: per-key frames as a delta through the ``FrameWriter``, a
+normal-mode base as its stored reports. Frames are built once per
+notification and kept, so preemption and restores never re-render.
+
+Notifications with the same tag (by default: the same colour, priority,
+keys and blink) coalesce: a burst of identical CI failures is one
+notification, its time to live extended and ``count`` raised.
+
+The notifier thread sleeps until the next expiry or blink edge, and
+without a timeout when nothing is active, so an idle keyboard sees no
+traffic at all.
+
+``gembird notifyd`` runs a notifier behind a Unix socket in the runtime
+directory; ``send_notification`` (``gembird notify``) talks to it with one
+JSON object per line.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from gembird.protocol import (
+    CMD_PER_KEY, CMD_SET_PROPERTIES, MAIN_COLOR_OFFSET, SLOT_COUNT, UNUSED_SLOTS, fill_frame, new_frame, set_slot,
+)
+
+WIRED_SLOTS = tuple(slot for slot in range(SLOT_COUNT) if slot not in UNUSED_SLOTS)
+
+
+class Notification:
+    """One queued notification; ``count`` is how many notify calls it absorbed."""
+
+    __slots__ = ("tag", "color", "priority", "keys", "blink", "start", "deadline", "count",
+                 "cancelled", "frame", "base")
+
+    def __init__(self, tag, color, priority, keys, blink, start, deadline):
+        self.tag = tag
+        self.color = color
+        self.priority = priority
+        self.keys = keys
+        self.blink = blink
+        self.start = start
+        self.deadline = deadline
+        self.count = 1
+        self.cancelled = False
+        self.frame = None
+        self.base = None
+
+    def __repr__(self):
+        return f"Notification({self.tag!r}, priority={self.priority}, count={self.count})"
+
+
+def base_from_reports(reports):
+    """
+    Returns (framebuffer, normal-mode reports or None) for a sequence such as
+    a stored profile's: per-key chunks are reassembled into their frame, a
+    static colour becomes a frame of that colour plus its own reports.
+    """
+    from gembird.protocol import HEADER_SIZE
+
+    frame = new_frame()
+    for report in reports:
+        if report[3] == CMD_PER_KEY:
+            length, offset = report[4], report[5] | report[6] << 8
+            frame[offset:offset + length] = report[HEADER_SIZE:HEADER_SIZE + length]
+        elif report[3] == CMD_SET_PROPERTIES:
+            fill_frame(frame, *report[MAIN_COLOR_OFFSET:MAIN_COLOR_OFFSET + 3])
+            return bytes(frame), list(reports)
+    return bytes(frame), None
+
+
+class Notifier:
+    """
+    Shows notifications through ``writer`` (a FrameWriter) over a cached
+    base. ``base`` is the base framebuffer (default: what the writer last
+    showed, else black); ``base_sequence`` optional normal-mode reports that
+    restore it, sent through the writer's controller.
+    """
+
+    def __init__(self, writer, base=None, base_sequence=None, clock=time.monotonic):
+        self.writer = writer
+        self.clock = clock
+        self.heap = []
+        self.tags = {}
+        self.order = itertools.count()
+        self.cond = threading.Condition()
+        self.changed = False
+        self.running = True
+        self.base = None
+        self.base_sequence = None
+        self.base_version = 0
+        self.showing = None
+        self.renders = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.set_base(base if base is not None else writer.shown or new_frame(), base_sequence)
+        self.thread = threading.Thread(target=self._run, name="gembird-notify", daemon=True)
+        self.thread.start()
+
+    def set_base(self, frame, sequence=None):
+        """Replaces the cached base lighting; shown at once if nothing is active."""
+        with self.cond:
+            self.base = bytes(frame)
+            self.base_sequence = list(sequence) if sequence else None
+            self.base_version += 1
+            self.showing = None
+            self.changed = True
+            self.cond.notify_all()
+
+    def notify(self, color, priority=0, ttl=5.0, keys=None, blink=None, tag=None):
+        """
+        Queues a notification: ``color`` over the slots in ``keys`` (None: all
+        keys) for ``ttl`` seconds, blinking with ``blink`` seconds per phase.
+        Returns the Notification, which may be an existing one it coalesced into.
+        """
+        color = tuple(color)
+        keys = None if keys is None else tuple(sorted(set(keys)))
+        if tag is None:
+            tag = (color, priority, keys, blink)
+        now = self.clock()
+        with self.cond:
+            existing = self.tags.get(tag)
+            if existing is not None and not existing.cancelled and existing.deadline > now:
+                existing.deadline = max(existing.deadline, now + ttl)
+                existing.count += 1
+                self.coalesced += 1
+                return existing
+            notification = Notification(tag, color, priority, keys, blink, now, now + ttl)
+            self.tags[tag] = notification
+            heapq.heappush(self.heap, (-priority, next(self.order), notification))
+            self.changed = True
+            self.cond.notify_all()
+            return notification
+
+    def cancel(self, tag):
+        """Drops the notification with ``tag``; returns whether there was one."""
+        with self.cond:
+            notification = self.tags.pop(tag, None)
+            if notification is None:
+                return False
+            notification.cancelled = True
+            self.changed = True
+            self.cond.notify_all()
+            return True
+
+    def active(self):
+        """The live notifications, front first."""
+        now = self.clock()
+        with self.cond:
+            return [entry[2] for entry in sorted(self.heap)
+                    if not entry[2].cancelled and entry[2].deadline > now]
+
+    def _front(self, now):
+        """Drops expired and cancelled entries off the top; returns the front or None."""
+        heap = self.heap
+        while heap:
+            notification = heap[0][2]
+            if not notification.cancelled and notification.deadline > now:
+                return notification
+            heapq.heappop(heap)
+            if self.tags.get(notification.tag) is notification:
+                del self.tags[notification.tag]
+        return None
+
+    def _frame(self, notification):
+        """The notification painted over the base, built once per base."""
+        if notification.frame is None or notification.base != self.base_version:
+            frame = bytearray(self.base)
+            for slot in WIRED_SLOTS if notification.keys is None else notification.keys:
+                set_slot(frame, slot, *notification.color)
+            notification.frame = bytes(frame)
+            notification.base = self.base_version
+            self.renders += 1
+        return notification.frame
+
+    def _plan(self, now):
+        """Returns (what to show, when to look again)."""
+        front = self._front(now)
+        if front is None:
+            return ("base", self.base_version), None
+        wake = front.deadline
+        if front.blink:
+            phase, into = divmod(now - front.start, front.blink)
+            wake = min(wake, now + front.blink - into)
+            if int(phase) % 2:
+                return ("base", self.base_version), wake
+        return front, wake
+
+    def _show(self, what):
+        if isinstance(what, Notification):
+            self.writer.show(self._frame(what))
+        elif self.base_sequence is not None:
+            self.writer.controller.send(self.base_sequence)
+            # Normal mode took over; the per-key state is no longer known.
+            self.writer.shown = None
+        else:
+            self.writer.show(self.base)
+        self.sent += 1
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                self.changed = False
+                what, wake = self._plan(self.clock())
+                showing, version = self.showing, self.base_version
+            if what != showing:
+                try:
+                    self._show(what)
+                except OSError:
+                    what = None  # Unknown state: show it again on the next pass.
+                with self.cond:
+                    # A new base arriving meanwhile must still go out.
+                    if self.base_version == version:
+                        self.showing = what
+            with self.cond:
+                if self.changed or not self.running:
+                    continue
+                if wake is None:
+                    self.cond.wait()
+                else:
+                    self.cond.wait(max(0.0, wake - self.clock()))
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+
+
+# --- Daemon ---
+
+def socket_path():
+    from gembird.arbitration import runtime_dir
+
+    return os.path.join(runtime_dir(), "notify.sock")
+
+
+def handle_request(notifier, request, layout=None, profiles=None):
+    """Applies one decoded request to ``notifier``; returns a reply dict."""
+    if "cancel" in request:
+        return {"ok": notifier.cancel(request["cancel"])}
+    if "base_profile" in request:
+        if profiles is None or request["base_profile"] not in profiles:
+            raise ValueError(f"no profile named {request['base_profile']!r}")
+        steps = profiles.get(request["base_profile"]).steps
+        notifier.set_base(*base_from_reports(steps[-1][0]))
+        return {"ok": True}
+    keys = request.get("keys")
+    if keys is not None:
+        if layout is None:
+            from gembird.layout import default_layout
+
+            layout = default_layout()
+        keys = [layout.slot_for(key) for key in keys]
+    color = tuple(int(c) for c in request["color"])
+    if len(color) != 3 or not all(0 <= c <= 255 for c in color):
+        raise ValueError(f"{request['color']!r} is not an RGB colour")
+    notification = notifier.notify(color, priority=int(request.get("priority", 0)),
+                                   ttl=float(request.get("ttl", 5.0)), keys=keys,
+                                   blink=request.get("blink"), tag=request.get("tag"))
+    return {"ok": True, "count": notification.count}
+
+
+class NotifyServer:
+    """Accepts JSON-line requests on a Unix socket and hands them to a Notifier."""
+
+    def __init__(self, notifier, path=None, layout=None, profiles=None):
+        import socket
+
+        self.notifier = notifier
+        self.layout = layout
+        self.profiles = profiles
+        self.path = path or socket_path()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(16)
+        self.thread = threading.Thread(target=self._accept, name="gembird-notifyd", daemon=True)
+        self.thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        import json
+
+        with conn, conn.makefile("rwb") as stream:
+            for line in stream:
+                try:
+                    reply = handle_request(self.notifier, json.loads(line), self.layout, self.profiles)
+                except (ValueError, KeyError, TypeError) as ex:
+                    reply = {"ok": False, "error": str(ex)}
+                try:
+                    stream.write(json.dumps(reply).encode() + b"\n")
+                    stream.flush()
+                except OSError:
+                    return
+
+    def close(self):
+        import socket
+
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.listener.close()
+        self.thread.join()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def send_notification(request, path=None):
+    """Sends one request to a running ``gembird notifyd`` and returns its reply."""
+    import json
+    import socket
+
+    path = path or socket_path()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise OSError("gembird notifyd is not running") from None
+        with sock.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            line = stream.readline()
+    if not line:
+        raise OSError("gembird notifyd closed the connection")
+    reply = json.loads(line)
+    if not reply.get("ok", False) and "error" in reply:
+        raise OSError(f"gembird notifyd: {reply['error']}")
+    return reply
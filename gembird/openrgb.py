@@ -0,0 +1,452 @@
+"""A local server speaking the OpenRGB SDK protocol.
+
+OpenRGB-aware tools connect over TCP (port 6742 by default), list the
+controllers, read the KB-G460's LED list and push colours. The keyboard is
+exposed as one controller with a single matrix zone and these modes:
+
+* "Direct": per-LED colours, sent through the per-key 0x0b path;
+* "Static": one colour, sent through the normal-mode 3-packet path;
+* one mode per captured firmware effect (see ``gembird.effects``), with
+  colour, speed and brightness, sent through the same 3-packet path.
+
+LED updates only touch an in-memory framebuffer and hand it to a
+``FrameWriter``, whose own thread turns it into a minimal delta and drops
+frames superseded before they were written. The event loop therefore never
+waits on USB, however many clients are connected, and the keyboard is never
+more than one frame behind the newest update.
+
+Every packet starts with a 16-byte header::
+
+    b"ORGB" | device index (uint32) | packet id (uint32) | data size (uint32)
+
+All integers are little-endian. Protocol versions 0 to 3 are understood;
+profiles (version 2) are reported as an empty list.
+"""
+
+import struct
+
+from gembird.frames import FrameWriter
+from gembird.protocol import EFFECT_STATIC, MAX_BRIGHTNESS, MAX_SPEED, get_slot, new_frame, set_slot
+
+DEFAULT_PORT = 6742
+MAGIC = b"ORGB"
+HEADER = struct.Struct("<4sIII")
+PROTOCOL_VERSION = 3
+
+# Packet ids.
+REQUEST_CONTROLLER_COUNT = 0
+REQUEST_CONTROLLER_DATA = 1
+REQUEST_PROTOCOL_VERSION = 40
+SET_CLIENT_NAME = 50
+DEVICE_LIST_UPDATED = 100
+REQUEST_PROFILE_LIST = 150
+REQUEST_SAVE_PROFILE = 151
+REQUEST_LOAD_PROFILE = 152
+REQUEST_DELETE_PROFILE = 153
+RESIZE_ZONE = 1000
+UPDATE_LEDS = 1050
+UPDATE_ZONE_LEDS = 1051
+UPDATE_SINGLE_LED = 1052
+SET_CUSTOM_MODE = 1100
+UPDATE_MODE = 1101
+SAVE_MODE = 1102
+
+DEVICE_TYPE_KEYBOARD = 5
+ZONE_TYPE_MATRIX = 2
+NO_LED = 0xFFFFFFFF
+
+# Mode flags and colour modes.
+MODE_FLAG_HAS_SPEED = 1 << 0
+MODE_FLAG_HAS_BRIGHTNESS = 1 << 4
+MODE_FLAG_HAS_PER_LED_COLOR = 1 << 5
+MODE_FLAG_HAS_MODE_SPECIFIC_COLOR = 1 << 6
+COLOR_MODE_NONE = 0
+COLOR_MODE_PER_LED = 1
+COLOR_MODE_MODE_SPECIFIC = 2
+
+
+# --- Encoding ---
+
+def pack_string(text):
+    data = text.encode() + b"\x00"
+    return struct.pack("<H", len(data)) + data
+
+
+def pack_colors(colors):
+    return struct.pack("<H", len(colors)) + b"".join(bytes((r, g, b, 0)) for r, g, b in colors)
+
+
+def packet(packet_id, data=b"", device=0):
+    return HEADER.pack(MAGIC, device, packet_id, len(data)) + data
+
+
+class Mode:
+    """One entry of the controller's mode list."""
+
+    __slots__ = ("name", "value", "flags", "speed_min", "speed_max", "brightness_min",
+                 "brightness_max", "colors_min", "colors_max", "speed", "brightness",
+                 "direction", "color_mode", "colors")
+
+    def __init__(self, name, value, flags, color_mode, colors=(), colors_min=0, colors_max=0,
+                 speed_min=0, speed_max=0, speed=0, brightness_min=0, brightness_max=0,
+                 brightness=0, direction=0):
+        self.name = name
+        self.value = value
+        self.flags = flags
+        self.speed_min = speed_min
+        self.speed_max = speed_max
+        self.brightness_min = brightness_min
+        self.brightness_max = brightness_max
+        self.colors_min = colors_min
+        self.colors_max = colors_max
+        self.speed = speed
+        self.brightness = brightness
+        self.direction = direction
+        self.color_mode = color_mode
+        self.colors = list(colors)
+
+    def pack(self, version):
+        data = pack_string(self.name)
+        data += struct.pack("<iIII", self.value, self.flags, self.speed_min, self.speed_max)
+        if version >= 3:
+            data += struct.pack("<II", self.brightness_min, self.brightness_max)
+        data += struct.pack("<III", self.colors_min, self.colors_max, self.speed)
+        if version >= 3:
+            data += struct.pack("<I", self.brightness)
+        data += struct.pack("<II", self.direction, self.color_mode)
+        return data + pack_colors(self.colors)
+
+    @classmethod
+    def unpack(cls, reader, version):
+        name = reader.string()
+        value, flags, speed_min, speed_max = reader.unpack("<iIII")
+        brightness_min, brightness_max = reader.unpack("<II") if version >= 3 else (0, 0)
+        colors_min, colors_max, speed = reader.unpack("<III")
+        brightness, = reader.unpack("<I") if version >= 3 else (0,)
+        direction, color_mode = reader.unpack("<II")
+        return cls(name, value, flags, color_mode, reader.colors(), colors_min, colors_max,
+                   speed_min, speed_max, speed, brightness_min, brightness_max, brightness, direction)
+
+
+class Reader:
+    """Sequential little-endian reads from a packet body."""
+
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def string(self):
+        length, = self.unpack("<H")
+        text = bytes(self.data[self.offset:self.offset + length]).rstrip(b"\x00").decode(errors="replace")
+        self.offset += length
+        return text
+
+    def colors(self):
+        count, = self.unpack("<H")
+        start = self.offset
+        self.offset += 4 * count
+        raw = self.data[start:self.offset]
+        return [tuple(raw[i:i + 3]) for i in range(0, len(raw), 4)]
+
+
+def default_modes(codes=None):
+    """
+    Direct, Static and a mode per firmware effect in ``codes`` ({name: code}).
+    Normal-mode modes carry their effect code as their value.
+    """
+    from gembird.effects import effect_codes
+
+    codes = effect_codes() if codes is None else codes
+    modes = [
+        Mode("Direct", 0, MODE_FLAG_HAS_PER_LED_COLOR, COLOR_MODE_PER_LED),
+        Mode("Static", EFFECT_STATIC, MODE_FLAG_HAS_MODE_SPECIFIC_COLOR | MODE_FLAG_HAS_BRIGHTNESS, COLOR_MODE_MODE_SPECIFIC,
+             colors=[(255, 255, 255)], colors_min=1, colors_max=1,
+             brightness_max=MAX_BRIGHTNESS, brightness=MAX_BRIGHTNESS),
+    ]
+    for name in sorted(codes):
+        if name != "static":
+            modes.append(Mode(name.title(), codes[name],
+                              MODE_FLAG_HAS_MODE_SPECIFIC_COLOR | MODE_FLAG_HAS_SPEED | MODE_FLAG_HAS_BRIGHTNESS,
+                              COLOR_MODE_MODE_SPECIFIC, colors=[(255, 255, 255)], colors_min=1, colors_max=1,
+                              speed_max=MAX_SPEED, speed=MAX_SPEED // 2,
+                              brightness_max=MAX_BRIGHTNESS, brightness=MAX_BRIGHTNESS))
+    return modes
+
+
+# --- Device model ---
+
+class KeyboardController:
+    """
+    The keyboard as an OpenRGB controller: its description, current mode
+    and LED colours, and the writer that pushes them to the device.
+    """
+
+    def __init__(self, sink, layout, name="Gembird KB-G460", serial="", location="", modes=None):
+        self.sink = sink
+        self.layout = layout
+        self.name = name
+        self.serial = serial
+        self.location = location
+        self.modes = modes or default_modes()
+        self.active_mode = 0
+        self.colors = [(0, 0, 0)] * len(layout)
+        self.frame = new_frame()
+        # Start from what the keyboard shows when it can be read back, so a
+        # restart only sends what clients change; otherwise it is unknown
+        # until the first frame goes out.
+        from gembird.readback import known_frame
+
+        shown = known_frame(sink)
+        if shown is not None:
+            self.frame[:] = shown
+            self.colors = [get_slot(shown, slot) for slot in layout.slots]
+        self.writer = FrameWriter(sink, shown=shown)
+        self.updates = 0
+
+    def describe(self, version):
+        """Encodes the REQUEST_CONTROLLER_DATA reply body."""
+        layout = self.layout
+        data = struct.pack("<i", DEVICE_TYPE_KEYBOARD) + pack_string(self.name)
+        if version >= 1:
+            data += pack_string("Gembird")
+        data += (pack_string("Per-key RGB keyboard") + pack_string("gembird")
+                 + pack_string(self.serial) + pack_string(self.location))
+        data += struct.pack("<Hi", len(self.modes), self.active_mode)
+        data += b"".join(mode.pack(version) for mode in self.modes)
+
+        grid = layout.matrix()
+        cells = [NO_LED if index is None else index for row in grid for index in row]
+        matrix = struct.pack(f"<II{len(cells)}I", layout.height, layout.width, *cells)
+        data += struct.pack("<H", 1) + pack_string("Keyboard")
+        data += struct.pack("<iIIIH", ZONE_TYPE_MATRIX, len(layout), len(layout), len(layout), len(matrix)) + matrix
+
+        data += struct.pack("<H", len(layout))
+        data += b"".join(pack_string(name) + struct.pack("<I", slot)
+                         for name, slot in zip(layout.names, layout.slots))
+        data += pack_colors(self.colors)
+        return struct.pack("<I", len(data) + 4) + data
+
+    def set_colors(self, colors, start=0):
+        """Applies LED colours from index ``start`` and queues the frame."""
+        slots = self.layout.slots
+        end = min(len(slots), start + len(colors))
+        frame = self.frame
+        for index in range(start, end):
+            rgb = colors[index - start]
+            self.colors[index] = rgb
+            set_slot(frame, slots[index], *rgb)
+        self.updates += 1
+        if self.modes[self.active_mode].color_mode == COLOR_MODE_PER_LED:
+            self.writer.submit(frame)
+
+    def set_mode(self, index, mode=None):
+        """
+        Switches modes; ``mode`` carries the client's settings. Returns the
+        normal-mode sequence to send, if the mode needs one.
+        """
+        if not 0 <= index < len(self.modes):
+            return None
+        current = self.modes[index]
+        if mode is not None and current.color_mode == COLOR_MODE_MODE_SPECIFIC:
+            if mode.colors:
+                current.colors = mode.colors[:max(1, current.colors_max)]
+            if current.flags & MODE_FLAG_HAS_SPEED:
+                current.speed = min(max(mode.speed, current.speed_min), current.speed_max)
+            # Clients below protocol version 3 send no brightness at all.
+            if current.flags & MODE_FLAG_HAS_BRIGHTNESS and mode.brightness_max:
+                current.brightness = min(max(mode.brightness, current.brightness_min), current.brightness_max)
+        self.active_mode = index
+        if current.color_mode == COLOR_MODE_PER_LED:
+            # The firmware left per-key mode; resend the whole map.
+            self.writer.shown = None
+            self.writer.submit(self.frame)
+            return None
+        from gembird.effects import FirmwareEffect
+
+        speed = current.speed if current.flags & MODE_FLAG_HAS_SPEED else MAX_SPEED
+        brightness = current.brightness if current.flags & MODE_FLAG_HAS_BRIGHTNESS else MAX_BRIGHTNESS
+        return FirmwareEffect(current.value, current.colors[0], brightness, speed).sequence()
+
+    def close(self):
+        self.writer.flush()
+        self.writer.close()
+
+
+# --- Server ---
+
+class OpenRGBServer:
+    """Serves one KeyboardController to any number of SDK clients."""
+
+    def __init__(self, controller, host="127.0.0.1", port=DEFAULT_PORT, name="gembird"):
+        self.controller = controller
+        self.host = host
+        self.port = port
+        self.name = name
+        self.server = None
+        self.clients = {}
+        self.requests = 0
+
+    async def start(self):
+        import asyncio
+
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        import asyncio
+
+        client = {"name": "", "version": 0}
+        self.clients[writer] = client
+        try:
+            while True:
+                magic, device, packet_id, size = HEADER.unpack(await reader.readexactly(HEADER.size))
+                if magic != MAGIC:
+                    break
+                data = await reader.readexactly(size) if size else b""
+                self.requests += 1
+                reply = await self._handle(client, device, packet_id, data)
+                if reply is not None:
+                    writer.write(reply)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, struct.error):
+            pass
+        finally:
+            del self.clients[writer]
+            writer.close()
+
+    async def _handle(self, client, device, packet_id, data):
+        controller = self.controller
+        if packet_id == REQUEST_CONTROLLER_COUNT:
+            return packet(packet_id, struct.pack("<I", 1))
+        if packet_id == REQUEST_PROTOCOL_VERSION:
+            requested, = struct.unpack_from("<I", data) if len(data) >= 4 else (0,)
+            client["version"] = min(requested, PROTOCOL_VERSION)
+            return packet(packet_id, struct.pack("<I", PROTOCOL_VERSION))
+        if packet_id == SET_CLIENT_NAME:
+            client["name"] = bytes(data).rstrip(b"\x00").decode(errors="replace")
+            return None
+        if packet_id == REQUEST_PROFILE_LIST:
+            body = struct.pack("<H", 0)
+            return packet(packet_id, struct.pack("<I", len(body) + 4) + body)
+        if device != 0:
+            return None
+        if packet_id == REQUEST_CONTROLLER_DATA:
+            return packet(packet_id, controller.describe(client["version"]))
+        if packet_id == UPDATE_LEDS:
+            controller.set_colors(Reader(data, 4).colors())
+        elif packet_id == UPDATE_ZONE_LEDS:
+            reader = Reader(data, 4)
+            zone, = reader.unpack("<I")
+            if zone == 0:
+                controller.set_colors(reader.colors())
+        elif packet_id == UPDATE_SINGLE_LED:
+            index, = struct.unpack_from("<i", data)
+            if 0 <= index < len(controller.layout):
+                controller.set_colors([tuple(data[4:7])], start=index)
+        elif packet_id == SET_CUSTOM_MODE:
+            await self._set_mode(0)
+        elif packet_id in (UPDATE_MODE, SAVE_MODE):
+            reader = Reader(data, 4)
+            index, = reader.unpack("<i")
+            await self._set_mode(index, Mode.unpack(reader, client["version"]))
+        # Profile storage and zone resizing do not apply to this keyboard.
+        return None
+
+    async def _set_mode(self, index, mode=None):
+        import asyncio
+
+        sequence = self.controller.set_mode(index, mode)
+        if sequence is not None:
+            # Mode changes are rare; send them off the loop, behind any queued frame.
+            writer = self.controller.writer
+            await asyncio.get_running_loop().run_in_executor(None, self._send_after_frames, writer, sequence)
+
+    def _send_after_frames(self, writer, sequence):
+        writer.flush()
+        self.controller.sink.send(sequence)
+
+
+# --- Client ---
+
+class OpenRGBClient:
+    """A minimal asyncio SDK client, enough to drive and check the server."""
+
+    def __init__(self, reader, writer, version):
+        self.reader = reader
+        self.writer = writer
+        self.version = version
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=DEFAULT_PORT, name="gembird-client", version=PROTOCOL_VERSION):
+        import asyncio
+
+        reader, writer = await asyncio.open_connection(host, port)
+        client = cls(reader, writer, 0)
+        writer.write(packet(REQUEST_PROTOCOL_VERSION, struct.pack("<I", version)))
+        _, body = await client._reply()
+        client.version = min(version, struct.unpack("<I", body)[0])
+        writer.write(packet(SET_CLIENT_NAME, name.encode() + b"\x00"))
+        return client
+
+    async def _reply(self):
+        _, _, packet_id, size = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+        return packet_id, await self.reader.readexactly(size)
+
+    async def controller_count(self):
+        self.writer.write(packet(REQUEST_CONTROLLER_COUNT))
+        _, body = await self._reply()
+        return struct.unpack("<I", body)[0]
+
+    async def controller_data(self, device=0):
+        """Returns (name, modes, led names, colours) of a controller."""
+        self.writer.write(packet(REQUEST_CONTROLLER_DATA, struct.pack("<I", self.version), device))
+        _, body = await self._reply()
+        reader = Reader(body, 4)
+        reader.unpack("<i")
+        name = reader.string()
+        for _ in range(5 if self.version >= 1 else 4):
+            reader.string()
+        count, _ = reader.unpack("<Hi")
+        modes = [Mode.unpack(reader, self.version) for _ in range(count)]
+        zones, = reader.unpack("<H")
+        for _ in range(zones):
+            reader.string()
+            *_, matrix = reader.unpack("<iIIIH")
+            reader.offset += matrix
+        leds, = reader.unpack("<H")
+        names = []
+        for _ in range(leds):
+            names.append(reader.string())
+            reader.unpack("<I")
+        return name, modes, names, reader.colors()
+
+    async def update_leds(self, colors, device=0):
+        body = pack_colors(colors)
+        self.writer.write(packet(UPDATE_LEDS, struct.pack("<I", len(body) + 4) + body, device))
+        await self.writer.drain()
+
+    async def update_mode(self, index, mode, device=0):
+        body = struct.pack("<i", index) + mode.pack(self.version)
+        self.writer.write(packet(UPDATE_MODE, struct.pack("<I", len(body) + 4) + body, device))
+        await self.writer.drain()
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
@@ -0,0 +1,125 @@
+"""Per-device, per-host inter-packet gaps.
+
+The original scripts slept 0.03 s after every normal-mode packet and 0.02 s
+after every per-key chunk. Those numbers were picked by hand; how long the
+firmware really needs depends on the packet and, through the USB stack, on
+the host. ``gembird calibrate`` measures the smallest safe gap for each
+packet kind and stores it here, keyed by keyboard serial and host name, so
+each machine runs at its own safe rate. Without a profile the original
+gaps are used.
+
+The profile lives in ``$XDG_CONFIG_HOME/gembird/pacing.json``::
+
+    {"KBG460-0001@desk": {"gaps": {"prepare": 0.004, ...},
+                          "calibrated": 1760000000, "method": "emulator"}}
+"""
+
+import os
+
+from gembird.protocol import (
+    KIND_EXECUTE, KIND_OTHER, KIND_PER_KEY, KIND_PREPARE, KIND_PROPERTIES, NORMAL_MODE_GAP,
+    PER_KEY_GAP, packet_kind,
+)
+
+DEFAULT_GAPS = {
+    KIND_PREPARE: NORMAL_MODE_GAP,
+    KIND_PROPERTIES: NORMAL_MODE_GAP,
+    KIND_EXECUTE: NORMAL_MODE_GAP,
+    KIND_PER_KEY: PER_KEY_GAP,
+    KIND_OTHER: NORMAL_MODE_GAP,
+}
+
+
+def profile_file():
+    """Returns the file holding the calibrated gaps."""
+    base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "gembird", "pacing.json")
+
+
+def host_name():
+    return os.uname().nodename
+
+
+def profile_key(serial, host=None):
+    return f"{serial or 'unknown'}@{host or host_name()}"
+
+
+def device_serial(path):
+    """Returns the HID_UNIQ of a hidraw path from sysfs, or "" if unknown."""
+    if path is None:
+        return ""
+    name = os.path.basename(path.decode() if isinstance(path, bytes) else path)
+    if not name.startswith("hidraw"):
+        return ""
+    from gembird.discovery import parse_uevent
+
+    try:
+        with open(f"/sys/class/hidraw/{name}/device/uevent") as f:
+            return parse_uevent(f.read()).get("HID_UNIQ", "")
+    except OSError:
+        return ""
+
+
+class Pacing:
+    """
+    Maps each packet of a sequence to the gap that follows it. Instances
+    are callable, so one can be passed as a Controller's ``gap_for``.
+    """
+
+    __slots__ = ("gaps", "source")
+
+    def __init__(self, gaps=None, source="default"):
+        self.gaps = dict(DEFAULT_GAPS)
+        if gaps:
+            self.gaps.update(gaps)
+        self.source = source
+
+    def gaps_for(self, sequence):
+        gaps = self.gaps
+        return [gaps.get(packet_kind(payload), gaps[KIND_OTHER]) for payload in sequence]
+
+    __call__ = gaps_for
+
+    def __repr__(self):
+        gaps = ", ".join(f"{kind}={gap * 1000:g}ms" for kind, gap in self.gaps.items())
+        return f"Pacing({gaps}; {self.source})"
+
+
+def read_profiles():
+    try:
+        with open(profile_file()) as f:
+            text = f.read()
+    except OSError:
+        return {}
+    # Imported only when a profile exists, to keep one-shot commands lean.
+    import json
+
+    try:
+        return json.loads(text)
+    except ValueError:
+        return {}
+
+
+def load_pacing(serial, host=None):
+    """Returns the calibrated Pacing for a keyboard on this host, or the defaults."""
+    entry = read_profiles().get(profile_key(serial, host))
+    if not entry:
+        return Pacing()
+    return Pacing(entry.get("gaps"), source=entry.get("method", "calibrated"))
+
+
+def store_pacing(serial, gaps, method, host=None):
+    """Saves calibrated gaps for a keyboard on this host and returns the key used."""
+    import json
+    import time
+
+    profiles = read_profiles()
+    key = profile_key(serial, host)
+    profiles[key] = {"gaps": gaps, "calibrated": int(time.time()), "method": method}
+    target = profile_file()
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = f"{target}.{os.getpid()}"
+    with open(temporary, "w") as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+    os.replace(temporary, target)
+    return key
@@ -0,0 +1,288 @@
+"""Named lighting profiles, compiled once into their wire reports.
+
+A profile is described once, as a small dict:
+
+* ``{"static": [r, g, b]}``: a normal-mode colour;
+* ``{"keys": {"Key: Escape": [r, g, b], "12": [...]}, "background": [r, g, b]}``:
+  a per-key map, keys named as in the layout or given by slot number;
+* ``{"effect": "fade", "from": [...], "to": [...], "ms": 800, "steps": 24}``
+  or ``{"effect": "cycle", "colors": [[...], ...], "ms": 500}``: a series of
+  normal-mode colours, each held for its share of ``ms``; ``"loop": true``
+  repeats it until interrupted;
+* ``{"firmware": "breathing", "color": [r, g, b], "brightness": 4, "speed": 2}``:
+  an effect the firmware renders itself (see ``gembird.effects``).
+
+Compiling turns the description into steps: the exact 64-byte reports,
+checksums included, and how long to hold each step. All profiles live in
+one store file, ``~/.config/gembird/profiles.gbp`` (little-endian)::
+
+    header   b"GBPR" | version | profiles | steps | reports (uint32 each)
+    index    profiles * (name offset uint32 | name length uint16 | flags uint16 |
+                         first step uint32 | step count uint32 |
+                         spec offset uint32 | spec length uint32)
+    steps    steps * (first report uint32 | report count uint16 | hold ms uint16)
+    reports  reports * 64 bytes
+    strings  UTF-8 names and JSON specs
+
+The store is memory-mapped; opening it reads only the index, with
+``struct``, so applying a profile imports nothing beyond the standard
+library's basics and writes reports straight out of the mapping. Profiles
+that were used recently are kept decoded in a small LRU.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+from gembird.protocol import REPORT_SIZE
+
+MAGIC = b"GBPR"
+VERSION = 1
+HEADER = struct.Struct("<4sIIII")
+ENTRY = struct.Struct("<IHHIIII")
+STEP = struct.Struct("<IHH")
+
+FLAG_LOOP = 1
+# Holds are stored in whole milliseconds in a uint16.
+MAX_HOLD = 0xFFFF / 1000.0
+
+
+def store_file():
+    """Returns the profile store's path."""
+    base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "gembird", "profiles.gbp")
+
+
+class Profile:
+    """A compiled profile: ``steps`` is a tuple of (reports, hold seconds)."""
+
+    __slots__ = ("name", "steps", "loop")
+
+    def __init__(self, name, steps, loop=False):
+        self.name = name
+        self.steps = tuple(steps)
+        self.loop = loop
+
+    def reports(self):
+        return sum(len(reports) for reports, _ in self.steps)
+
+    def __repr__(self):
+        return f"Profile({self.name!r}, {len(self.steps)} steps, {self.reports()} reports)"
+
+
+# --- Compiling ---
+
+def _rgb(value):
+    rgb = tuple(int(c) for c in value)
+    if len(rgb) != 3 or not all(0 <= c <= 255 for c in rgb):
+        raise ValueError(f"{value!r} is not an RGB colour")
+    return rgb
+
+
+def compile_spec(name, spec, layout=None):
+    """Compiles a profile description into a Profile."""
+    from gembird import protocol
+
+    if "static" in spec:
+        return Profile(name, [(protocol.create_true_static_color_sequence(*_rgb(spec["static"])), 0.0)])
+    if "keys" in spec:
+        frame = protocol.fill_frame(protocol.new_frame(), *_rgb(spec.get("background", (0, 0, 0))))
+        for key, rgb in spec["keys"].items():
+            if layout is None:
+                from gembird.layout import default_layout
+
+                layout = default_layout()
+            slot = layout.slot_for(key)
+            if not 0 <= slot < protocol.SLOT_COUNT:
+                raise ValueError(f"slot {slot} is outside the framebuffer")
+            protocol.set_slot(frame, slot, *_rgb(rgb))
+        return Profile(name, [(protocol.per_key_sequence(frame), 0.0)])
+    if "firmware" in spec:
+        from gembird.effects import FirmwareEffect
+
+        effect = FirmwareEffect(spec["firmware"], spec.get("color", (255, 255, 255)),
+                                int(spec.get("brightness", protocol.MAX_BRIGHTNESS)),
+                                int(spec.get("speed", protocol.MAX_SPEED)))
+        return Profile(name, [(effect.sequence(), 0.0)])
+    effect = spec.get("effect")
+    if effect == "fade":
+        from gembird.transitions import EASINGS, SPACES, ease, mix
+
+        table = EASINGS[spec.get("easing", "ease-in-out")]
+        encode, decode = SPACES[spec.get("space", "oklab")]
+        a, b = encode(_rgb(spec["from"])), encode(_rgb(spec["to"]))
+        count = max(1, int(spec.get("steps", 24)))
+        colors = [decode(mix(a, b, ease(table, i / count))) for i in range(count + 1)]
+    elif effect == "cycle":
+        colors = [_rgb(rgb) for rgb in spec["colors"]]
+        if not colors:
+            raise ValueError("a cycle needs at least one colour")
+    else:
+        raise ValueError(f"profile {name!r}: expected 'static', 'keys', 'firmware' or a known 'effect'")
+    hold = float(spec.get("ms", 1000)) / 1000.0 / len(colors)
+    if not 0.0 <= hold <= MAX_HOLD:
+        raise ValueError(f"profile {name!r}: each step is held {hold:g} s; "
+                         f"steps must be held between 0 and {MAX_HOLD:g} s")
+    steps = [(protocol.create_true_static_color_sequence(*(round(c) for c in rgb)), hold) for rgb in colors]
+    return Profile(name, steps, loop=bool(spec.get("loop", False)))
+
+
+# --- Store file ---
+
+def write_store(path, profiles, specs):
+    """Writes Profiles (with their JSON spec texts, by name) as a store file, atomically."""
+    index, steps, reports, strings = [], [], [], bytearray()
+    for profile in sorted(profiles, key=lambda profile: profile.name):
+        name = profile.name.encode()
+        spec = specs.get(profile.name, "").encode()
+        name_offset = len(strings)
+        strings += name
+        spec_offset = len(strings)
+        strings += spec
+        index.append(ENTRY.pack(name_offset, len(name), FLAG_LOOP if profile.loop else 0,
+                                len(steps), len(profile.steps), spec_offset, len(spec)))
+        for sequence, hold in profile.steps:
+            steps.append(STEP.pack(len(reports), len(sequence), round(hold * 1000)))
+            reports.extend(sequence)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(index), len(steps), len(reports)))
+        f.write(b"".join(index))
+        f.write(b"".join(steps))
+        f.write(b"".join(reports))
+        f.write(strings)
+    os.replace(temporary, path)
+    return path
+
+
+class ProfileStore:
+    """
+    A memory-mapped store file. ``get`` returns a Profile, decoding it from
+    the mapping unless it is among the ``capacity`` most recently used.
+    Not thread-safe; use one store per thread.
+    """
+
+    def __init__(self, path=None, capacity=32):
+        self.path = path or store_file()
+        self.capacity = capacity
+        # Insertion-ordered: the least recently used profile comes first.
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.map = None
+        self.index = {}
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise OSError(f"{self.path} is not a gembird profile store")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, step_count, report_count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise OSError(f"{self.path} is not a gembird profile store")
+        self.steps_offset = HEADER.size + count * ENTRY.size
+        self.reports_offset = self.steps_offset + step_count * STEP.size
+        self.strings_offset = self.reports_offset + report_count * REPORT_SIZE
+        if len(self.map) < self.strings_offset:
+            self.close()
+            raise OSError(f"{self.path} is not a gembird profile store")
+        strings = self.strings_offset
+        data = self.map
+        for entry in ENTRY.iter_unpack(data[HEADER.size:self.steps_offset]):
+            name_offset, name_length = entry[0], entry[1]
+            name = data[strings + name_offset:strings + name_offset + name_length].decode()
+            self.index[name] = entry
+
+    def names(self):
+        return sorted(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, name):
+        """Returns the named Profile; KeyError if there is none."""
+        profile = self.cache.pop(name, None)
+        if profile is not None:
+            self.cache[name] = profile
+            self.hits += 1
+            return profile
+        _, _, flags, first, count, _, _ = self.index[name]
+        data, reports_offset = self.map, self.reports_offset
+        steps = []
+        for start, length, hold in STEP.iter_unpack(
+                data[self.steps_offset + first * STEP.size:self.steps_offset + (first + count) * STEP.size]):
+            base = reports_offset + start * REPORT_SIZE
+            steps.append(([data[base + i * REPORT_SIZE:base + (i + 1) * REPORT_SIZE] for i in range(length)],
+                          hold / 1000.0))
+        profile = Profile(name, steps, loop=bool(flags & FLAG_LOOP))
+        self.misses += 1
+        self.cache[name] = profile
+        if len(self.cache) > self.capacity:
+            del self.cache[next(iter(self.cache))]
+        return profile
+
+    def spec(self, name):
+        """Returns the JSON text the profile was compiled from."""
+        _, _, _, _, _, offset, length = self.index[name]
+        start = self.strings_offset + offset
+        return self.map[start:start + length].decode()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_profiles(specs, path=None, layout=None, remove=()):
+    """
+    Compiles ``specs`` ({name: description}) and writes them into the store
+    together with the profiles already in it, minus ``remove``. Returns the
+    store's path.
+    """
+    import json
+
+    path = path or store_file()
+    profiles, texts = {}, {}
+    with ProfileStore(path, capacity=0) as store:
+        for name in store.names():
+            if name not in remove and name not in specs:
+                profiles[name] = store.get(name)
+                texts[name] = store.spec(name)
+    for name, spec in specs.items():
+        profiles[name] = compile_spec(name, spec, layout)
+        texts[name] = json.dumps(spec, separators=(",", ":"))
+    return write_store(path, profiles.values(), texts)
+
+
+# --- Applying ---
+
+def apply(profile, sink, loops=None, sleep=time.sleep):
+    """
+    Writes a profile through ``sink`` (anything with ``send``). Looping
+    profiles repeat until interrupted unless ``loops`` says otherwise.
+    """
+    import itertools
+
+    if loops is None:
+        loops = 0 if profile.loop else 1
+    for _ in (itertools.count() if loops == 0 else range(loops)):
+        for reports, hold in profile.steps:
+            sink.send(reports)
+            if hold:
+                sleep(hold)
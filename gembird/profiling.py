@@ -0,0 +1,286 @@
+"""On-demand profiling of a running gembird process.
+
+Long-running commands (``serve``, ``framebuffer``, ``notifyd``, ``play``,
+``ambient``, ``audio``, ``reactive``, ``idle``, ``agent``, ``embedded``)
+call ``install()``, which only sets a SIGUSR2 handler. ``gembird profiling
+PID`` (or ``kill -USR2 PID``) starts a ``Profiler``, the same signal stops
+it and the report is written to
+``$XDG_CACHE_HOME/gembird/profiling/NAME-PID-TIME.txt``, next to a
+``.folded`` file of collapsed stacks for flame graph tools. The embedded
+daemon also takes ``profiling on|off [memory]`` on its control socket.
+
+While it runs, a sampler thread looks at every other thread's stack each
+``interval`` (``sys._current_frames``) and files the sample under the
+innermost pipeline stage on it:
+
+* ``render``: turning a source (audio, video, key presses) into colours;
+* ``composite``: painting colours into a framebuffer, over a base;
+* ``encode``: framebuffer to reports, and finding the changed chunks;
+* ``checksum``: sealing reports;
+* ``write``: transports, pacing gaps included;
+
+or ``other`` (waiting, parsing, the event loop). Stages are recognised by
+their functions' code objects (see ``STAGE_FUNCTIONS``; ``register`` adds
+more), so nothing in the pipeline is instrumented and profiling costs
+nothing at all until it is started.
+
+With ``memory``, tracemalloc runs too, and the report lists what the
+packet encoders (``protocol``, ``frames``, ``effects``, ``embedded``)
+allocated while profiling was on. ``GEMBIRD_PROFILING=memory,interval=0.001``
+sets the defaults for signal-started profiles.
+"""
+
+import os
+import sys
+import time
+
+STAGES = ("render", "composite", "encode", "checksum", "write")
+OTHER = "other"
+
+# Stage -> {module: function names}. The innermost stage on a stack wins.
+STAGE_FUNCTIONS = {
+    "render": {
+        "audio": ("render", "analyse"),
+        "ambient": ("update", "sample"),
+        "animation": ("render", "_render_batch"),
+        "reactive": ("render", "levels_at"),
+        "transitions": ("render",),
+    },
+    "composite": {
+        "notify": ("_frame",),
+        "reactive": ("_paint",),
+        "transitions": ("mix",),
+        "protocol": ("set_slot", "fill_frame"),
+        "shm": ("set_slot",),
+    },
+    "encode": {
+        "protocol": ("encode_chunk", "per_key_sequence", "create_true_static_color_sequence", "build_report"),
+        "frames": ("changed_chunks", "delta_sequence"),
+        "effects": ("sequence",),
+        "embedded": ("static", "per_key"),
+    },
+    "checksum": {
+        "protocol": ("checksum", "seal"),
+        "embedded": ("_seal",),
+    },
+    "write": {
+        "transport": ("write", "send_sequence"),
+        "libusb": ("write", "send_sequence"),
+        "resilient": ("write", "send_sequence", "_deliver"),
+        "emulator": ("write", "send_sequence"),
+        "embedded": ("_write",),
+    },
+}
+ENCODER_MODULES = ("protocol", "frames", "effects", "embedded")
+MAX_DEPTH = 64
+
+_extra = {}
+_installed = None
+
+
+def register(stage, *functions):
+    """Files samples inside ``functions`` (e.g. a custom renderer) under ``stage``."""
+    if stage not in STAGES:
+        raise ValueError(f"unknown stage {stage!r}; use one of {', '.join(STAGES)}")
+    for function in functions:
+        _extra[function.__code__] = stage
+
+
+def _stage_of(code):
+    stage = _extra.get(code)
+    if stage is not None:
+        return stage
+    directory, filename = os.path.split(code.co_filename)
+    if os.path.basename(directory) != "gembird":
+        return None
+    module = filename[:-3]
+    for stage in ("checksum", "encode", "write", "composite", "render"):
+        if code.co_name in STAGE_FUNCTIONS[stage].get(module, ()):
+            return stage
+    return None
+
+
+def profiling_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "gembird", "profiling")
+
+
+class Profiler:
+    """
+    A sampling profiler over every thread but its own, with optional
+    tracemalloc. ``start`` and ``stop`` may be called from a signal handler.
+    """
+
+    def __init__(self, interval=0.002, memory=False, directory=None, name="gembird"):
+        self.interval = interval
+        self.memory = memory
+        self.directory = directory or profiling_dir()
+        self.name = name
+        self.thread = None
+        self.stopping = None
+        self.started_tracing = False
+        self.report_path = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        import threading
+
+        if self.thread is not None:
+            return
+        self.stopping = threading.Event()
+        self.report_path = None
+        baseline = None
+        if self.memory:
+            import tracemalloc
+
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing:
+                tracemalloc.start(1)
+            baseline = tracemalloc.take_snapshot()
+        # The thread gets its own event: a quick stop and start must not revive it.
+        self.thread = threading.Thread(target=self._sample, args=(self.stopping, baseline),
+                                       name="gembird-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self, wait=True):
+        """Stops sampling; with ``wait``, returns the report's path once it is written."""
+        thread = self.thread
+        if thread is None:
+            return self.report_path
+        self.thread = None
+        self.stopping.set()
+        if wait:
+            thread.join()
+            return self.report_path
+        return None
+
+    def toggle(self, wait=True):
+        """Starts, or stops and returns the report's path."""
+        if self.thread is None:
+            self.start()
+            return None
+        return self.stop(wait)
+
+    def _sample(self, stopping, baseline):
+        import threading
+        from collections import Counter
+
+        own = threading.get_ident()
+        stages = Counter()
+        lines = {stage: Counter() for stage in STAGES + (OTHER,)}
+        stacks = Counter()
+        codes = {}
+        samples = 0
+        started = time.monotonic()
+        while not stopping.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stage = None
+                names = []
+                leaf = frame
+                while frame is not None and len(names) < MAX_DEPTH:
+                    code = frame.f_code
+                    if stage is None:
+                        if code not in codes:
+                            codes[code] = _stage_of(code)
+                        stage = codes[code]
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stage = stage or OTHER
+                stages[stage] += 1
+                lines[stage][f"{leaf.f_code.co_filename}:{leaf.f_lineno} {leaf.f_code.co_name}"] += 1
+                stacks[";".join(reversed(names))] += 1
+                samples += 1
+        elapsed = time.monotonic() - started
+        memory = self._memory(baseline) if baseline is not None else None
+        try:
+            self.report_path = self._write(stages, lines, stacks, samples, elapsed, memory)
+        except OSError as ex:
+            print(f"gembird: could not write the profile: {ex}", file=sys.stderr)
+
+    def _memory(self, baseline):
+        import tracemalloc
+
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if self.started_tracing:
+            tracemalloc.stop()
+        filters = [tracemalloc.Filter(True, os.path.join("*", "gembird", f"{module}.py"))
+                   for module in ENCODER_MODULES]
+        differences = snapshot.filter_traces(filters).compare_to(baseline.filter_traces(filters), "lineno")
+        return current, peak, [difference for difference in differences if difference.count_diff][:20]
+
+    def _write(self, stages, lines, stacks, samples, elapsed, memory):
+        os.makedirs(self.directory, exist_ok=True)
+        stem = os.path.join(self.directory, f"{self.name}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}")
+        out = [f"gembird profile: {self.name}, pid {os.getpid()}, {elapsed:.1f} s, "
+               f"{samples} samples every {self.interval * 1000:g} ms", "", "Stages (share of all thread samples):"]
+        for stage in STAGES + (OTHER,):
+            out.append(f"  {stage:<10} {stages[stage]:>8}  {stages[stage] / max(1, samples) * 100:5.1f}%")
+        for stage in STAGES + (OTHER,):
+            if lines[stage]:
+                out += ["", f"Hottest lines in {stage}:"]
+                out += [f"  {count:>8}  {line}" for line, count in lines[stage].most_common(10)]
+        if memory is not None:
+            current, peak, differences = memory
+            out += ["", f"Traced memory: {current / 1024:.0f} KiB now, {peak / 1024:.0f} KiB peak",
+                    "Allocations by the packet encoders while profiling (size, blocks, line):"]
+            out += [f"  {difference.size_diff / 1024:+9.1f} KiB  {difference.count_diff:+7}  "
+                    f"{difference.traceback[0]}" for difference in differences] or ["  none"]
+        with open(stem + ".txt", "w") as f:
+            f.write("\n".join(out) + "\n")
+        with open(stem + ".folded", "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        return stem + ".txt"
+
+
+def _defaults():
+    """Profiler options from GEMBIRD_PROFILING; unusable values are reported and ignored."""
+    options = {}
+    for item in os.environ.get("GEMBIRD_PROFILING", "").split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "memory":
+            options["memory"] = True
+        elif key == "interval" and value:
+            try:
+                interval = float(value)
+            except ValueError:
+                interval = 0.0
+            if 0 < interval < float("inf"):
+                options["interval"] = interval
+            else:
+                print(f"gembird: ignoring GEMBIRD_PROFILING interval {value!r}", file=sys.stderr)
+    return options
+
+
+def install(name="gembird", signum=None):
+    """
+    Makes ``signum`` (default SIGUSR2) toggle a Profiler in this process;
+    returns the Profiler. Nothing else happens until the signal arrives.
+    """
+    import signal
+
+    global _installed
+    profiler = Profiler(name=name, **_defaults())
+
+    def toggle(*_):
+        # os.write, not print: the signal may have interrupted a print.
+        if profiler.running:
+            profiler.stop(wait=False)
+            os.write(2, f"gembird: profiling stopped; report in {profiler.directory}\n".encode())
+        else:
+            profiler.start()
+            os.write(2, b"gembird: profiling started\n")
+
+    signal.signal(signal.SIGUSR2 if signum is None else signum, toggle)
+    _installed = profiler
+    return profiler
+
+
+def installed():
+    """The Profiler ``install`` set up in this process, or None."""
+    return _installed
@@ -0,0 +1,206 @@
+"""Wire format of the KB-G460 lighting protocol.
+
+Every report is 64 bytes long and shares one header::
+
+    byte 0      report ID (always 0x04)
+    bytes 1-2   checksum: 16-bit little-endian sum of bytes 3..63
+    byte 3      command
+    byte 4      payload length
+    bytes 5-6   payload offset (little-endian)
+    byte 7      reserved (0x00)
+    bytes 8..   payload
+
+The constant packets below are stored pre-encoded as bytes literals so that
+importing this module does no work beyond loading the constants.
+"""
+
+REPORT_ID = 0x04
+REPORT_SIZE = 64
+HEADER_SIZE = 8
+
+# --- Commands ---
+CMD_PREPARE = 0x01
+CMD_EXECUTE = 0x02
+CMD_SET_PROPERTIES = 0x06
+CMD_PER_KEY = 0x0B
+
+# --- Pacing ---
+# Inter-packet gaps used by the original normal-mode and per-key scripts.
+NORMAL_MODE_GAP = 0.03
+PER_KEY_GAP = 0.02
+
+# --- Normal Mode (3-packet) ---
+# Packet 1: Prepare for Static Color update.
+COMMAND_PREPARE_STATIC = b"\x04\x01\x00\x01" + b"\x00" * 60
+
+# Packet 2: Color Data Template from the "Perfect Green" capture.
+# Main Color (bytes 14-16) is green, Win Lock Indicator (bytes 28-30) is red.
+TEMPLATE_SET_COLOR_PROPERTIES = (
+    b"\x04\x35\x03\x06\x21\x00\x00\x00\x00\x06\x04\x04\xff\x00"
+    b"\x00\xff\x00"  # Main Color (Bytes 14, 15, 16)
+    b"\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+    b"\xff\x00\x00"  # Win Lock Indicator Color (Bytes 28, 29, 30)
+    + b"\x00" * 33
+)
+
+# Packet 3: Execute the update.
+COMMAND_EXECUTE_UPDATE = b"\x04\x02\x00\x02" + b"\x00" * 60
+
+MAIN_COLOR_OFFSET = 14
+INDICATOR_COLOR_OFFSET = 28
+
+# The bytes before the main colour are not decoded yet. The capture holds
+# 0x06, 0x04, 0x04 there; reading them as effect, brightness and speed (the
+# sliders the official software shows next to the effect list, with 0x04 as
+# their top setting) is a working hypothesis until they are captured.
+EFFECT_OFFSET = 9
+BRIGHTNESS_OFFSET = 10
+SPEED_OFFSET = 11
+EFFECT_STATIC = 0x06
+MAX_BRIGHTNESS = 4
+MAX_SPEED = 4
+
+# --- Per-Key Mode (7-packet) ---
+# The per-key colour map is a 384-byte framebuffer of 128 three-byte slots,
+# streamed in seven chunks. The last chunk is the one the scripts call
+# "Commit": the firmware applies the map once it arrives.
+FRAME_SIZE = 384
+SLOT_COUNT = FRAME_SIZE // 3
+PER_KEY_CHUNKS = (
+    (0x0000, 0x38),
+    (0x0038, 0x38),
+    (0x0070, 0x38),
+    (0x00A8, 0x38),
+    (0x00E0, 0x38),
+    (0x0118, 0x38),
+    (0x0150, 0x30),
+)
+COMMIT_CHUNK = len(PER_KEY_CHUNKS) - 1
+
+# Slot byte order taken from the official software's captures: red lands on
+# the first byte of a slot and green on the third, which leaves the middle
+# byte for blue. (The GRB/GBR orders in the test_keyboard scripts came from
+# filling each packet with triplets independently, which misaligns every
+# chunk whose offset is not a multiple of three.)
+SLOT_RED = 0
+SLOT_BLUE = 1
+SLOT_GREEN = 2
+
+# Slots that are zero in every capture and have no LED behind them.
+UNUSED_SLOTS = frozenset(range(7, 112, 8))
+
+
+def checksum(report):
+    """Returns the 16-bit checksum of a report (sum of bytes 3..63)."""
+    return sum(report[3:REPORT_SIZE]) & 0xFFFF
+
+
+def seal(report):
+    """Writes the checksum of a bytearray report into bytes 1-2 in place."""
+    value = sum(report[3:REPORT_SIZE]) & 0xFFFF
+    report[1] = value & 0xFF
+    report[2] = value >> 8
+    return report
+
+
+def build_report(command, payload=b"", offset=0):
+    """Builds a sealed 64-byte report for an arbitrary command."""
+    report = bytearray(REPORT_SIZE)
+    report[0] = REPORT_ID
+    report[3] = command
+    report[4] = len(payload)
+    report[5] = offset & 0xFF
+    report[6] = offset >> 8
+    report[HEADER_SIZE:HEADER_SIZE + len(payload)] = payload
+    return bytes(seal(report))
+
+
+def create_true_static_color_sequence(r, g, b):
+    """
+    Builds the 3-packet normal-mode sequence for a static colour.
+    Only the Main Color bytes change; the checksum is recomputed.
+    """
+    data = bytearray(TEMPLATE_SET_COLOR_PROPERTIES)
+    data[MAIN_COLOR_OFFSET] = r
+    data[MAIN_COLOR_OFFSET + 1] = g
+    data[MAIN_COLOR_OFFSET + 2] = b
+    return [COMMAND_PREPARE_STATIC, bytes(seal(data)), COMMAND_EXECUTE_UPDATE]
+
+
+def new_frame():
+    """Returns an all-black per-key framebuffer."""
+    return bytearray(FRAME_SIZE)
+
+
+def set_slot(frame, slot, r, g, b):
+    """Writes an RGB colour into one slot of a per-key framebuffer."""
+    base = slot * 3
+    frame[base + SLOT_RED] = r
+    frame[base + SLOT_BLUE] = b
+    frame[base + SLOT_GREEN] = g
+
+
+def get_slot(frame, slot):
+    """Reads the RGB colour of one slot of a per-key framebuffer."""
+    base = slot * 3
+    return frame[base + SLOT_RED], frame[base + SLOT_GREEN], frame[base + SLOT_BLUE]
+
+
+def fill_frame(frame, r, g, b):
+    """Sets every wired slot of a framebuffer to one colour."""
+    triplet = bytearray(3)
+    triplet[SLOT_RED] = r
+    triplet[SLOT_BLUE] = b
+    triplet[SLOT_GREEN] = g
+    frame[:] = bytes(triplet) * SLOT_COUNT
+    for slot in UNUSED_SLOTS:
+        frame[slot * 3:slot * 3 + 3] = b"\x00\x00\x00"
+    return frame
+
+
+def encode_chunk(frame, index):
+    """Encodes one chunk of a per-key framebuffer as a sealed report."""
+    offset, length = PER_KEY_CHUNKS[index]
+    report = bytearray(REPORT_SIZE)
+    report[0] = REPORT_ID
+    report[3] = CMD_PER_KEY
+    report[4] = length
+    report[5] = offset & 0xFF
+    report[6] = offset >> 8
+    report[HEADER_SIZE:HEADER_SIZE + length] = frame[offset:offset + length]
+    return bytes(seal(report))
+
+
+def per_key_sequence(frame):
+    """Encodes a whole per-key framebuffer as its 7-packet sequence."""
+    return [encode_chunk(frame, index) for index in range(len(PER_KEY_CHUNKS))]
+
+
+# Packet kinds, as used for per-kind pacing.
+KIND_PREPARE = "prepare"
+KIND_PROPERTIES = "properties"
+KIND_EXECUTE = "execute"
+KIND_PER_KEY = "per-key"
+KIND_OTHER = "other"
+
+_KINDS = {
+    CMD_PREPARE: KIND_PREPARE,
+    CMD_SET_PROPERTIES: KIND_PROPERTIES,
+    CMD_EXECUTE: KIND_EXECUTE,
+    CMD_PER_KEY: KIND_PER_KEY,
+}
+
+
+def packet_kind(report):
+    """Classifies a report by its command byte."""
+    return _KINDS.get(report[3], KIND_OTHER)
+
+
+def sequence_gap(sequence):
+    """Returns the inter-packet gap the original scripts used for this kind of sequence."""
+    return PER_KEY_GAP if sequence and sequence[0][3] == CMD_PER_KEY else NORMAL_MODE_GAP
+
+
+def create_uniform_color_sequence(r, g, b):
+    """Builds the 7-packet per-key sequence that paints every key one colour."""
+    return per_key_sequence(fill_frame(new_frame(), r, g, b))
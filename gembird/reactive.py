@@ -0,0 +1,439 @@
+"""Lighting keys as they are pressed.
+
+Key presses come from the keyboard's own input interfaces, not from the
+vendor interface the lighting goes out on:
+
+* ``EvdevSource`` reads the kernel's input events (``/dev/input/eventN``,
+  readable by the ``input`` group). Event timestamps are switched to the
+  monotonic clock, so latency is measured from the moment the kernel saw
+  the key.
+* ``HidrawKeyboardSource`` reads 8-byte boot keyboard reports from the
+  keyboard's interface 0 and diffs them into presses and releases, for
+  hosts where the event node is not readable. Its timestamps are taken on
+  read.
+* ``InjectedSource`` is an evdev source fed through a pipe, for tests and
+  benchmarks.
+
+Every source has a file descriptor, and ``Reactive.run`` sleeps in
+``select`` on it: nothing wakes up between key presses. While a fade or a
+ripple is running, frames are rendered at up to ``max_fps``, only while
+the link is idle and never so often that it is busy more than half the
+time; a press is painted and sent at once, on its own. Frames go through
+a ``FrameWriter``, so a press sends only the chunk holding the key (plus
+the commit chunk), and the writer's
+``on_shown`` hook closes the loop: the latency of a press is the time from
+its event to the end of the first write that contains it.
+
+Keys are matched to LEDs through the layout's ``code`` fields. A press of
+a key with no known LED flashes the whole keyboard instead.
+"""
+
+import math
+import os
+import selectors
+import struct
+import threading
+import time
+from collections import deque
+
+from gembird import PRODUCT_ID, VENDOR_ID
+from gembird.frames import changed_chunks
+from gembird.protocol import FRAME_SIZE, PER_KEY_CHUNKS, SLOT_BLUE, SLOT_GREEN, SLOT_RED
+
+# struct input_event: struct timeval, __u16 type, __u16 code, __s32 value.
+INPUT_EVENT = struct.Struct("llHHi")
+EV_KEY = 0x01
+EV_REP = 0x14
+CLOCK_MONOTONIC = 1
+EVIOCSCLOCKID = 0x400445A0  # _IOW('E', 0xa0, int)
+EVIOCGRAB = 0x40044590  # _IOW('E', 0x90, int)
+
+# HID keyboard usage -> input event code (the kernel's hid_keyboard table).
+USAGE_CODES = (
+    0, 0, 0, 0, 30, 48, 46, 32, 18, 33, 34, 35, 23, 36, 37, 38,
+    50, 49, 24, 25, 16, 19, 31, 20, 22, 47, 17, 45, 21, 44, 2, 3,
+    4, 5, 6, 7, 8, 9, 10, 11, 28, 1, 14, 15, 57, 12, 13, 26,
+    27, 43, 43, 39, 40, 41, 51, 52, 53, 58, 59, 60, 61, 62, 63, 64,
+    65, 66, 67, 68, 87, 88, 99, 70, 119, 110, 102, 104, 111, 107, 109, 106,
+    105, 108, 103, 69, 98, 55, 74, 78, 96, 79, 80, 81, 75, 76, 77, 71,
+    72, 73, 82, 83, 86, 127,
+)
+# Modifier bits of a boot report, usages 0xE0-0xE7.
+MODIFIER_CODES = (29, 42, 56, 125, 97, 54, 100, 126)
+
+
+# --- Sources ---
+
+class EvdevSource:
+    """
+    Key presses and releases from an input event node, or from any
+    descriptor carrying ``struct input_event`` records (``fd``).
+    ``read`` returns ``(code, pressed, time)`` tuples; autorepeat is ignored.
+    """
+
+    def __init__(self, path=None, fd=None, monotonic=None):
+        if fd is None:
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+        self.path = path
+        self.fd = fd
+        self.buffer = b""
+        if monotonic is None:
+            import fcntl
+
+            try:
+                fcntl.ioctl(fd, EVIOCSCLOCKID, struct.pack("i", CLOCK_MONOTONIC))
+                monotonic = True
+            except OSError:
+                monotonic = False
+        self.monotonic = monotonic
+
+    def fileno(self):
+        return self.fd
+
+    def grab(self, exclusive=True):
+        """Keeps the key presses from reaching other programs (or lets them through again)."""
+        import fcntl
+
+        fcntl.ioctl(self.fd, EVIOCGRAB, int(exclusive))
+
+    def read(self):
+        """Returns the key events that are waiting, or None at end of file."""
+        try:
+            data = os.read(self.fd, INPUT_EVENT.size * 64)
+        except BlockingIOError:
+            return []
+        if not data:
+            return None
+        now = time.monotonic()
+        data = self.buffer + data
+        usable = len(data) - len(data) % INPUT_EVENT.size
+        self.buffer = data[usable:]
+        events = []
+        for seconds, micros, kind, code, value in INPUT_EVENT.iter_unpack(data[:usable]):
+            if kind == EV_KEY and value in (0, 1):
+                events.append((code, value == 1, seconds + micros / 1e6 if self.monotonic else now))
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class InjectedSource(EvdevSource):
+    """An evdev source fed through a pipe; ``press`` and ``release`` inject keys."""
+
+    def __init__(self):
+        read_fd, self.write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        super().__init__(fd=read_fd, monotonic=True)
+
+    def send(self, code, value, when=None):
+        when = time.monotonic() if when is None else when
+        seconds = int(when)
+        os.write(self.write_fd, INPUT_EVENT.pack(seconds, int((when - seconds) * 1e6), EV_KEY, code, value))
+
+    def press(self, code, when=None):
+        self.send(code, 1, when)
+
+    def release(self, code, when=None):
+        self.send(code, 0, when)
+
+    def end(self):
+        """Closes the writing end: ``Reactive.run`` returns once it is drained."""
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    def close(self):
+        self.end()
+        super().close()
+
+
+class HidrawKeyboardSource:
+    """Key presses diffed from the 8-byte boot reports of a hidraw keyboard interface."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+        self.held = set()
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        try:
+            report = os.read(self.fd, 64)
+        except BlockingIOError:
+            return []
+        if not report:
+            return None
+        now = time.monotonic()
+        if len(report) < 8:
+            return []
+        held = {code for bit, code in enumerate(MODIFIER_CODES) if report[0] >> bit & 1}
+        for usage in report[2:8]:
+            if usage == 1:
+                return []  # Rollover error: the report says nothing about the keys.
+            if usage < len(USAGE_CODES) and USAGE_CODES[usage]:
+                held.add(USAGE_CODES[usage])
+        events = [(code, True, now) for code in sorted(held - self.held)]
+        events += [(code, False, now) for code in sorted(self.held - held)]
+        self.held = held
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def find_event_nodes(vid=VENDOR_ID, pid=PRODUCT_ID, sysfs="/sys", dev="/dev"):
+    """Event node paths of the keyboard's key interfaces (those with key autorepeat)."""
+    class_dir = os.path.join(sysfs, "class", "input")
+    try:
+        names = sorted(os.listdir(class_dir))
+    except FileNotFoundError:
+        return []
+    paths = []
+    for name in names:
+        if not name.startswith("event"):
+            continue
+        device_dir = os.path.join(class_dir, name, "device")
+        try:
+            with open(os.path.join(device_dir, "id", "vendor")) as f:
+                vendor = int(f.read(), 16)
+            with open(os.path.join(device_dir, "id", "product")) as f:
+                product = int(f.read(), 16)
+            with open(os.path.join(device_dir, "capabilities", "ev")) as f:
+                capabilities = int(f.read(), 16)
+        except (OSError, ValueError):
+            continue
+        if (vendor, product) == (vid, pid) and capabilities >> EV_KEY & 1 and capabilities >> EV_REP & 1:
+            paths.append(os.path.join(dev, "input", name))
+    return paths
+
+
+def open_key_source(path=None):
+    """
+    Opens ``path`` (an event node or a hidraw keyboard interface) or finds
+    the keyboard's: its event node if readable, else its boot interface.
+    """
+    if path:
+        if os.path.basename(path).startswith("hidraw"):
+            return HidrawKeyboardSource(path)
+        return EvdevSource(path)
+    denied = None
+    for node in find_event_nodes():
+        try:
+            return EvdevSource(node)
+        except PermissionError as ex:
+            denied = ex
+    from gembird.discovery import scan
+
+    for node in scan():
+        if (node.usage_page, node.usage) == (0x01, 0x06):
+            return HidrawKeyboardSource(node.path)
+    if denied is not None:
+        raise PermissionError(f"{denied.filename} is not readable; add yourself to the 'input' group")
+    raise FileNotFoundError("no key input interface of the keyboard found")
+
+
+# --- Lighting ---
+
+class Reactive:
+    """
+    Lights pressed keys in ``color`` over ``background``. A key stays lit
+    while held and fades out over ``fade`` seconds after release; with
+    ``ripple``, each press also sends a ring outwards at ``speed`` keys per
+    second, ``width`` keys wide.
+    """
+
+    def __init__(self, writer, layout, color=(255, 255, 255), background=(0, 0, 0),
+                 fade=0.4, ripple=False, speed=12.0, width=1.5, max_fps=60, clock=time.monotonic):
+        self.writer = writer
+        self.layout = layout
+        self.leds = layout.led_for_code()
+        self.color = color
+        self.background = background
+        self.fade = fade
+        self.ripple = ripple
+        self.speed = speed
+        self.width = width
+        self.interval = 1.0 / max_fps
+        self.clock = clock
+        self.reach = math.hypot(layout.width, layout.height)
+        self.held = {}
+        self.fading = {}
+        self.ripples = []
+        self.levels = {}
+        self.frame = bytearray(FRAME_SIZE)
+        for index in range(len(layout)):
+            self._paint(index, 0.0)
+        self.submitted = None
+        self.next_frame = 0.0
+        self.waiting = deque()
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.presses = 0
+        self.unmapped = 0
+        self.renders = 0
+        self.wakeups = 0
+        self.wake_read, self.wake_write = os.pipe()
+        writer.on_shown = self._shown
+
+    def key(self, code, pressed, when):
+        """
+        Applies one key event; returns whether a frame must go out now. A
+        press is painted straight away, on its own, so its frame carries
+        only the pressed key and not the next step of every animation.
+        """
+        led = self.leds.get(code)
+        if not pressed:
+            if led is not None and self.held.pop(led, None) is not None:
+                self.fading[led] = when
+            return False
+        self.presses += 1
+        if led is None:
+            self.unmapped += 1
+            lit = range(len(self.layout))
+            for index in lit:
+                self.fading[index] = when
+        else:
+            lit = (led,)
+            self.held[led] = when
+            self.fading.pop(led, None)
+            if self.ripple:
+                self.ripples.append((self.layout.positions[led], when))
+        for index in lit:
+            if self.levels.get(index) != 1.0:
+                self._paint(index, 1.0)
+                self.levels[index] = 1.0
+        with self.lock:
+            self.waiting.append((when, None))
+        return True
+
+    def levels_at(self, now):
+        """Returns {LED index: 0..1} for the LEDs lit at ``now``, dropping finished effects."""
+        levels = dict.fromkeys(self.held, 1.0)
+        for led, start in list(self.fading.items()):
+            level = 1.0 - (now - start) / self.fade if self.fade > 0 else 0.0
+            if level <= 0:
+                del self.fading[led]
+            elif level > levels.get(led, 0.0):
+                levels[led] = level
+        if self.ripples:
+            live = []
+            for (x0, y0), start in self.ripples:
+                radius = (now - start) * self.speed
+                if radius - self.width > self.reach:
+                    continue
+                live.append(((x0, y0), start))
+                strength = 1.0 - radius / (self.reach + self.width)
+                for index, (x, y) in enumerate(self.layout.positions):
+                    level = strength * (1.0 - abs(math.hypot(x - x0, y - y0) - radius) / self.width)
+                    if level > levels.get(index, 0.0):
+                        levels[index] = level
+            self.ripples = live
+        return levels
+
+    def _paint(self, index, level):
+        base = self.layout.slots[index] * 3
+        frame = self.frame
+        (r0, g0, b0), (r1, g1, b1) = self.background, self.color
+        frame[base + SLOT_RED] = round(r0 + (r1 - r0) * level)
+        frame[base + SLOT_GREEN] = round(g0 + (g1 - g0) * level)
+        frame[base + SLOT_BLUE] = round(b0 + (b1 - b0) * level)
+
+    def render(self, now):
+        """Advances the animations to ``now`` and submits the frame."""
+        levels = self.levels_at(now)
+        for index in self.levels.keys() | levels.keys():
+            level = levels.get(index, 0.0)
+            if self.levels.get(index, 0.0) != level:
+                self._paint(index, level)
+        self.levels = levels
+        self.submit(now)
+        # Leave the link idle at least half the time, so a press never
+        # queues behind more than one animation frame.
+        cost = 0.0
+        if self.writer.frame_seconds:
+            cost = self.writer.frame_seconds * len(changed_chunks(self.submitted, self.frame)) / len(PER_KEY_CHUNKS)
+        self.next_frame = now + max(self.interval, 2 * cost)
+
+    def submit(self, now):
+        with self.lock:
+            # Presses waiting for this frame are matched to the write that carries it.
+            self.waiting = deque((when, submitted if submitted is not None else now)
+                                 for when, submitted in self.waiting)
+        self.writer.submit(self.frame)
+        self.submitted = bytes(self.frame)
+        self.renders += 1
+
+    def animating(self):
+        return bool(self.fading or self.ripples)
+
+    def _shown(self, taken, done):
+        with self.lock:
+            while self.waiting and self.waiting[0][1] is not None and self.waiting[0][1] <= taken:
+                when, _ = self.waiting.popleft()
+                self.latencies.append(done - when)
+
+    def run(self, source):
+        """Lights keys from ``source`` until it ends or ``stop`` is called."""
+        selector = selectors.DefaultSelector()
+        selector.register(source, selectors.EVENT_READ)
+        selector.register(self.wake_read, selectors.EVENT_READ)
+        self.render(self.clock())
+        try:
+            while True:
+                timeout = max(0.0, self.next_frame - self.clock()) if self.animating() else None
+                ready = selector.select(timeout)
+                self.wakeups += 1
+                dirty = False
+                for key, _ in ready:
+                    if key.fileobj == self.wake_read:
+                        os.read(self.wake_read, 64)
+                        return
+                    events = source.read()
+                    if events is None:
+                        return
+                    for code, pressed, when in events:
+                        dirty |= self.key(code, pressed, when)
+                now = self.clock()
+                if dirty:
+                    self.submit(now)
+                elif self.animating() and now >= self.next_frame:
+                    if self.writer.pending is None and not self.writer.busy:
+                        self.render(now)
+                    else:
+                        # Only start a frame on an idle link, so a press never
+                        # has an animation frame queued in front of it.
+                        self.next_frame = now + self.interval
+        finally:
+            selector.close()
+
+    def stop(self):
+        """Makes ``run`` return; safe from other threads and signal handlers."""
+        os.write(self.wake_write, b"x")
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(share):
+            return latencies[min(len(latencies) - 1, int(share * len(latencies)))] if latencies else 0.0
+
+        return {
+            "presses": self.presses,
+            "unmapped": self.unmapped,
+            "renders": self.renders,
+            "wakeups": self.wakeups,
+            "chunks_per_frame": self.writer.chunks / self.writer.frames if self.writer.frames else 0.0,
+            "latency_median": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+    def close(self):
+        os.close(self.wake_read)
+        os.close(self.wake_write)
@@ -0,0 +1,274 @@
+"""Reading the keyboard's lighting state back, and reconciling with it.
+
+Without readback the host cannot know what the keyboard shows after a
+power cycle, a replug or the official software, so every restart sends
+full sequences. The query format is not known yet. The hypothesis used
+here, and modelled by the emulator, is that reading feature report 0x04
+returns a report in the same format the host writes:
+
+* in normal mode, the data packet (0x06) that set the current state;
+* in per-key mode, one chunk (0x0b) of the applied map, the next chunk on
+  each read, so at most seven reads recover the whole map.
+
+Every reply is guarded: it must carry the report ID, a correct checksum and
+a known command, and chunks must sit at known offsets. Anything else makes
+the state unknown, and a transport that has answered garbage is not asked
+again; callers then fall back to sending everything, as before. A
+keyboard that has never answered is remembered in
+``$XDG_CACHE_HOME/gembird/readback-unsupported`` (by serial, or by USB
+port for keyboards without one), so daemons do not wait on a failing
+query at every start; ``gembird state`` asks again regardless.
+
+``Reconciler`` caches the state it read or wrote and sends only the
+difference: the chunks that changed, or nothing when the keyboard already
+shows the target. A reopened transport (see ``ResilientTransport``)
+invalidates the cache, so a reconnect costs one query plus a delta.
+"""
+
+import os
+
+from gembird.protocol import (
+    CMD_PER_KEY, CMD_SET_PROPERTIES, HEADER_SIZE, PER_KEY_CHUNKS, REPORT_ID, REPORT_SIZE, checksum,
+)
+
+
+class DeviceState:
+    """What the keyboard shows: ``effect`` in normal mode, ``frame`` in per-key mode."""
+
+    __slots__ = ("mode", "effect", "frame")
+
+    def __init__(self, mode, effect=None, frame=None):
+        self.mode = mode
+        self.effect = effect
+        self.frame = None if frame is None else bytes(frame)
+
+    def __repr__(self):
+        return f"DeviceState({self.mode!r}, effect={self.effect!r})"
+
+
+def parse_reply(reply):
+    """
+    Classifies one feature report: ("static", FirmwareEffect), ("chunk",
+    index, payload), or None when it is not a valid state report.
+    """
+    if reply is None or len(reply) != REPORT_SIZE or reply[0] != REPORT_ID:
+        return None
+    if reply[1] | reply[2] << 8 != checksum(reply):
+        return None
+    if reply[3] == CMD_SET_PROPERTIES:
+        from gembird.effects import FirmwareEffect
+
+        return "static", FirmwareEffect.from_report(reply)
+    if reply[3] == CMD_PER_KEY:
+        key = (reply[5] | reply[6] << 8, reply[4])
+        if key in PER_KEY_CHUNKS:
+            return "chunk", PER_KEY_CHUNKS.index(key), bytes(reply[HEADER_SIZE:HEADER_SIZE + key[1]])
+    return None
+
+
+def query_state(transport):
+    """
+    Asks the keyboard what it shows. Returns (DeviceState or None, number of
+    reads); None when the transport cannot read feature reports or a reply
+    fails the checks.
+    """
+    get = getattr(transport, "get_feature_report", None)
+    if get is None:
+        return None, 0
+    reads = 0
+    chunks = {}
+    while True:
+        try:
+            reply = get(REPORT_ID, REPORT_SIZE)
+        except (OSError, NotImplementedError):
+            return None, reads
+        reads += 1
+        parsed = parse_reply(bytes(reply))
+        if parsed is None:
+            return None, reads
+        if parsed[0] == "static":
+            return (DeviceState("static", effect=parsed[1]) if not chunks else None), reads
+        chunks[parsed[1]] = parsed[2]
+        if len(chunks) == len(PER_KEY_CHUNKS):
+            return DeviceState("per-key", frame=b"".join(chunks[index] for index in sorted(chunks))), reads
+        if reads >= 2 * len(PER_KEY_CHUNKS):
+            return None, reads
+
+
+def state_from_sequence(sequence):
+    """
+    The DeviceState a sequence leaves the keyboard in: its data packet's
+    effect, or the map of a full set of per-key chunks; else None.
+    """
+    effect, chunks = None, {}
+    for report in sequence:
+        parsed = parse_reply(bytes(report))
+        if parsed is None:
+            continue
+        if parsed[0] == "static":
+            effect = parsed[1]
+        else:
+            chunks[parsed[1]] = parsed[2]
+    if len(chunks) == len(PER_KEY_CHUNKS):
+        return DeviceState("per-key", frame=b"".join(chunks[index] for index in sorted(chunks)))
+    return DeviceState("static", effect=effect) if effect is not None else None
+
+
+class Reconciler:
+    """
+    Brings the keyboard to a target state with as few reports as the cached
+    state allows. ``transport`` is queried; sequences go through ``sink``
+    (default: the transport). Not thread-safe.
+    """
+
+    def __init__(self, transport, sink=None):
+        self.transport = transport
+        self.sink = sink
+        self.state = None
+        self.supported = None
+        self.reopens = self._reopens()
+        self.queries = 0
+        self.reads = 0
+        self.reports = 0
+
+    def _reopens(self):
+        return getattr(self.transport, "counters", {}).get("reopens", 0)
+
+    def _send(self, sequence):
+        if not sequence:
+            return 0
+        if self.sink is not None:
+            self.sink.send(sequence)
+        else:
+            from gembird.protocol import sequence_gap
+
+            self.transport.send_sequence(sequence, sequence_gap(sequence))
+        self.reports += len(sequence)
+        return len(sequence)
+
+    def invalidate(self):
+        """Forgets the cached state, e.g. after the official software ran."""
+        self.state = None
+
+    def refresh(self):
+        """Queries the keyboard (unless it has answered garbage before) and returns the state."""
+        self.reopens = self._reopens()
+        if self.supported is False:
+            self.state = None
+            return None
+        state, reads = query_state(self.transport)
+        self.queries += 1
+        self.reads += reads
+        if state is None and not self.supported:
+            # Never answered sensibly: stop asking.
+            self.supported = False
+        elif state is not None:
+            self.supported = True
+        self.state = state
+        return state
+
+    def current(self):
+        """The cached state, queried again if unknown or if the device was reopened since."""
+        if self.state is None or self._reopens() != self.reopens:
+            return self.refresh()
+        return self.state
+
+    def _settle(self, state):
+        # A reopen mid-sequence may have lost the start of it (the keyboard
+        # can have been power-cycled): what it shows must be asked again.
+        self.state = state if self._reopens() == self.reopens else None
+
+    def show_frame(self, frame):
+        """Shows a per-key framebuffer; returns the number of reports sent."""
+        from gembird.frames import delta_sequence
+
+        state = self.current()
+        previous = state.frame if state is not None and state.mode == "per-key" else None
+        try:
+            sent = self._send(delta_sequence(previous, frame))
+        except OSError:
+            self.state = None
+            raise
+        self._settle(DeviceState("per-key", frame=frame))
+        return sent
+
+    def show_effect(self, effect):
+        """Shows a FirmwareEffect (normal mode); returns the number of reports sent."""
+        state = self.current()
+        if state is not None and state.mode == "static" and state.effect == effect:
+            return 0
+        try:
+            sent = self._send(effect.sequence())
+        except OSError:
+            self.state = None
+            raise
+        self._settle(DeviceState("static", effect=effect))
+        return sent
+
+
+# --- Remembering keyboards without readback ---
+
+def unsupported_file():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "gembird", "readback-unsupported")
+
+
+def _device_key(transport):
+    """
+    The keyboard's serial; without one, its USB port as discovery keys it,
+    or else its interface path, so keyboards without serials stay apart.
+    """
+    from gembird.discovery import parse_uevent
+
+    path = getattr(transport, "path", None)
+    if path is None:
+        return "unknown"
+    path = path.decode() if isinstance(path, bytes) else str(path)
+    name = os.path.basename(path)
+    if name.startswith("hidraw"):
+        try:
+            with open(f"/sys/class/hidraw/{name}/device/uevent") as f:
+                uevent = parse_uevent(f.read())
+        except OSError:
+            uevent = {}
+        key = uevent.get("HID_UNIQ") or uevent.get("HID_PHYS", "").rpartition("/")[0]
+        if key:
+            return key
+    return "".join(c if c.isprintable() and not c.isspace() else "_" for c in path) or "unknown"
+
+
+def _unsupported():
+    try:
+        with open(unsupported_file()) as f:
+            return set(f.read().split())
+    except OSError:
+        return set()
+
+
+def remember_support(transport, supported):
+    """Records whether the keyboard behind ``transport`` answers state queries."""
+    key = _device_key(transport)
+    keys = _unsupported()
+    if supported == (key not in keys):
+        return
+    keys.symmetric_difference_update((key,))
+    target = unsupported_file()
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "w") as f:
+        f.write("".join(f"{key}\n" for key in sorted(keys)))
+
+
+def known_frame(session):
+    """
+    The per-key map a session's keyboard shows, when it can be read back,
+    else None. Use it to seed a FrameWriter so a restart sends only a delta.
+    """
+    transport = getattr(session, "transport", None)
+    if transport is None or getattr(transport, "get_feature_report", None) is None:
+        return None
+    if getattr(transport, "path", None) and _device_key(transport) in _unsupported():
+        return None
+    state, _ = query_state(transport)
+    if getattr(transport, "path", None):
+        remember_support(transport, state is not None)
+    return state.frame if state is not None and state.mode == "per-key" else None
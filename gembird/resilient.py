@@ -0,0 +1,266 @@
+"""A transport that survives USB hiccups.
+
+``ResilientTransport`` wraps another transport and an ``opener`` that can
+produce a fresh one. Every write error is classified:
+
+* transient (timeouts, EAGAIN, EIO, stalls): wait and retry the same packet;
+* disconnected (ENODEV, ENXIO, hidapi's errno-less failures, no device):
+  close, reopen through the opener and retry;
+* fatal (bad arguments, permission errors): raised immediately.
+
+Retries use bounded exponential backoff. A per-key sequence resumes at the
+chunk that failed, because each chunk carries its own framebuffer offset;
+a normal-mode sequence restarts from its prepare packet after a reopen,
+since the prepared state did not survive. Counters are exposed through
+``metrics()``.
+"""
+
+import errno
+import time
+
+from gembird.protocol import CMD_PER_KEY
+from gembird.transport import Transport
+
+TRANSIENT = "transient"
+DISCONNECTED = "disconnected"
+FATAL = "fatal"
+
+TRANSIENT_ERRNOS = frozenset((errno.EAGAIN, errno.EINTR, errno.ETIMEDOUT, errno.EIO,
+                              errno.EPIPE, errno.EBUSY, errno.EPROTO))
+DISCONNECTED_ERRNOS = frozenset((errno.ENODEV, errno.ENXIO, errno.ENOENT, errno.ESHUTDOWN,
+                                 errno.EBADF, errno.ENOTCONN))
+
+
+class RecoveryFailed(OSError):
+    """Raised when a packet could not be delivered within the retry budget."""
+
+    def __init__(self, message, index, cause):
+        super().__init__(message)
+        self.index = index
+        self.cause = cause
+
+
+def classify(error):
+    """Returns TRANSIENT, DISCONNECTED or FATAL for a write exception."""
+    status = getattr(getattr(error, "result", None), "status", None)
+    if status is not None:
+        from gembird import libusb
+
+        if status == libusb.TRANSFER_NO_DEVICE:
+            return DISCONNECTED
+        return TRANSIENT
+    if isinstance(error, (TimeoutError, BlockingIOError, InterruptedError)):
+        return TRANSIENT
+    if isinstance(error, (PermissionError, ValueError, TypeError)):
+        return FATAL
+    if isinstance(error, OSError):
+        if error.errno in TRANSIENT_ERRNOS:
+            return TRANSIENT
+        if error.errno in DISCONNECTED_ERRNOS:
+            return DISCONNECTED
+        # hidapi reports every failure as an errno-less OSError.
+        return DISCONNECTED
+    return FATAL
+
+
+class Backoff:
+    """Bounded exponential backoff with jitter."""
+
+    def __init__(self, base=0.005, factor=2.0, limit=0.5, attempts=6, jitter=0.2):
+        self.base = base
+        self.factor = factor
+        self.limit = limit
+        self.attempts = attempts
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        delay = min(self.limit, self.base * self.factor ** attempt)
+        # Only needed once something failed: kept off the one-shot path.
+        import random
+
+        return delay * (1.0 + random.uniform(-self.jitter, self.jitter))
+
+
+class ResilientTransport(Transport):
+    """
+    Wraps ``opener()`` (a callable returning a Transport) with retry,
+    reopen and resume. ``opener`` receives ``rediscover=True`` once the
+    cached path has failed to reopen.
+    """
+
+    name = "resilient"
+
+    def __init__(self, opener, backoff=None, sleep=time.sleep):
+        self.opener = opener
+        self.backoff = backoff or Backoff()
+        self.sleep = sleep
+        self.inner = opener(rediscover=False)
+        self.counters = {
+            "packets": 0,
+            "sequences": 0,
+            "retries": 0,
+            "reopens": 0,
+            "reopen_failures": 0,
+            "resumed_sequences": 0,
+            "packets_not_resent": 0,
+            "restarted_sequences": 0,
+            "failures": 0,
+            TRANSIENT: 0,
+            DISCONNECTED: 0,
+            FATAL: 0,
+        }
+        self.recovery_seconds = 0.0
+        self.last_error = None
+
+    @property
+    def path(self):
+        return getattr(self.inner, "path", None)
+
+    def metrics(self):
+        """Returns a snapshot of the retry and recovery counters."""
+        snapshot = dict(self.counters)
+        snapshot["recovery_seconds"] = round(self.recovery_seconds, 6)
+        snapshot["last_error"] = repr(self.last_error) if self.last_error else None
+        return snapshot
+
+    def _reopen(self, attempt):
+        try:
+            if self.inner is not None:
+                self.inner.close()
+        except Exception:
+            pass
+        self.inner = None
+        try:
+            self.inner = self.opener(rediscover=attempt > 0)
+        except OSError as ex:
+            self.counters["reopen_failures"] += 1
+            self.last_error = ex
+            return False
+        self.counters["reopens"] += 1
+        return True
+
+    def _recover(self, error, attempt):
+        """
+        Handles one failure after backing off. Returns None when the error
+        is fatal or the budget is spent, else whether the device was reopened.
+        """
+        kind = classify(error)
+        self.counters[kind] += 1
+        self.last_error = error
+        if kind == FATAL or attempt >= self.backoff.attempts:
+            return None
+        self.counters["retries"] += 1
+        self.sleep(self.backoff.delay(attempt))
+        if kind == DISCONNECTED or self.inner is None:
+            return self._reopen(attempt)
+        return False
+
+    def _deliver(self, sequence, start, gaps):
+        """Writes sequence[start:]; returns None or (index, error) on failure."""
+        inner = self.inner
+        if inner is None:
+            return start, OSError(errno.ENODEV, "device is not open")
+        if getattr(inner, "pipelined", False):
+            try:
+                inner.send_sequence(sequence[start:], gaps[start:])
+            except OSError as ex:
+                failed = getattr(getattr(ex, "result", None), "index", 0)
+                self.counters["packets"] += failed
+                return start + failed, ex
+            self.counters["packets"] += len(sequence) - start
+            return None
+        for index in range(start, len(sequence)):
+            try:
+                inner.write(sequence[index])
+            except OSError as ex:
+                return index, ex
+            self.counters["packets"] += 1
+            if gaps[index]:
+                time.sleep(gaps[index])
+        return None
+
+    def send_sequence(self, sequence, gap=0.0):
+        sequence = list(sequence)
+        gaps = [gap] * len(sequence) if isinstance(gap, (int, float)) else list(gap)
+        per_key = bool(sequence) and sequence[0][3] == CMD_PER_KEY
+        self.counters["sequences"] += 1
+        start = 0
+        attempt = 0
+        started = None
+        restarted = False
+        while True:
+            failure = self._deliver(sequence, start, gaps)
+            if failure is None:
+                break
+            index, error = failure
+            if started is None:
+                started = time.monotonic()
+            reopened = self._recover(error, attempt)
+            if reopened is None:
+                self.counters["failures"] += 1
+                self.recovery_seconds += time.monotonic() - started
+                raise RecoveryFailed(f"packet {index} of {len(sequence)} failed: {error}", index, error) from error
+            attempt += 1
+            if reopened and not per_key:
+                restarted = True
+                start = 0
+            else:
+                start = index
+
+        if started is not None:
+            self.recovery_seconds += time.monotonic() - started
+            if restarted:
+                self.counters["restarted_sequences"] += 1
+            elif start:
+                self.counters["resumed_sequences"] += 1
+                self.counters["packets_not_resent"] += start
+
+    def write(self, report):
+        self.send_sequence([report])
+        return len(report)
+
+    def read(self, size=64, timeout=None):
+        return self.inner.read(size, timeout) if self.inner is not None else None
+
+    def fileno(self):
+        return self.inner.fileno() if self.inner is not None else -1
+
+    def get_feature_report(self, report_id, size=64):
+        return self.inner.get_feature_report(report_id, size)
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+            self.inner = None
+
+
+class FlakyTransport(Transport):
+    """
+    Test double that fails writes on a schedule. ``failures`` maps a write
+    number (counted from zero across the transport's life) to the exception
+    raised instead of writing.
+    """
+
+    name = "flaky"
+
+    def __init__(self, inner, failures):
+        self.inner = inner
+        self.failures = failures
+        self.count = 0
+
+    def write(self, report):
+        number = self.count
+        self.count += 1
+        error = self.failures.pop(number, None)
+        if error is not None:
+            raise error
+        return self.inner.write(report)
+
+    def read(self, size=64, timeout=None):
+        return self.inner.read(size, timeout)
+
+    def get_feature_report(self, report_id, size=64):
+        return self.inner.get_feature_report(report_id, size)
+
+    def close(self):
+        pass
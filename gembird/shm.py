@@ -0,0 +1,258 @@
+"""A per-key framebuffer in shared memory.
+
+High-rate producers (games, visualisers, screen samplers) write pixels
+straight into a memory-mapped file instead of sending frames through a
+socket; one owner process pushes what changed to the keyboard. The file
+lives in the runtime directory (a tmpfs) and is laid out as::
+
+    0    magic b"GBFB" | version (uint32)
+    8    sequence (uint64)
+    16   7 chunk stamps (uint64): the sequence that last wrote each chunk
+    128  the 384-byte framebuffer, in wire layout
+
+Writers serialise with an ``flock`` on the file and bump the sequence to
+an odd value before writing and to the next even value after, stamping
+every chunk they touched with it. The owner reads without locking,
+seqlock-style: it copies the stamps and the chunks stamped after its last
+push, then re-reads the sequence and starts over if a writer got in
+between. The stamps work as a dirty bitmap that nobody has to clear, so
+the owner never writes to the segment and producers never wait on it.
+
+Producers write into ``memoryview``s of the mapping: no copy is made on
+their side. The owner copies only dirty chunks.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+from gembird.protocol import FRAME_SIZE, PER_KEY_CHUNKS, SLOT_BLUE, SLOT_GREEN, SLOT_RED
+
+MAGIC = b"GBFB"
+VERSION = 1
+SEQUENCE_OFFSET = 8
+STAMPS_OFFSET = 16
+FRAME_OFFSET = 128
+SEGMENT_SIZE = FRAME_OFFSET + FRAME_SIZE
+
+_HEADER = struct.Struct("<4sI")
+_SEQUENCE = struct.Struct("<Q")
+_STAMPS = struct.Struct(f"<{len(PER_KEY_CHUNKS)}Q")
+
+# Framebuffer byte -> index of the chunk that carries it.
+CHUNK_OF_BYTE = bytes(index for index, (_, length) in enumerate(PER_KEY_CHUNKS) for _ in range(length))
+
+
+def segment_path(name="default"):
+    from gembird.arbitration import lock_key, runtime_dir
+
+    return os.path.join(runtime_dir(), f"{lock_key(name)}.fb")
+
+
+def chunks_for(start, end):
+    """Bitmask of the chunks covering framebuffer bytes [start, end)."""
+    if start >= end:
+        return 0
+    mask = 0
+    for index in range(CHUNK_OF_BYTE[start], CHUNK_OF_BYTE[end - 1] + 1):
+        mask |= 1 << index
+    return mask
+
+
+class Segment:
+    """An open mapping of the framebuffer file."""
+
+    def __init__(self, path, create=False):
+        flags = os.O_RDWR | os.O_CLOEXEC | (os.O_CREAT if create else 0)
+        try:
+            self.fd = os.open(path, flags, 0o600)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"no shared framebuffer at {path}; is the owner running?") from None
+        self.path = path
+        fresh = create and os.fstat(self.fd).st_size != SEGMENT_SIZE
+        if fresh:
+            os.ftruncate(self.fd, SEGMENT_SIZE)
+        self.map = mmap.mmap(self.fd, SEGMENT_SIZE)
+        if fresh or create and _HEADER.unpack_from(self.map, 0) != (MAGIC, VERSION):
+            self.map[:SEGMENT_SIZE] = bytes(SEGMENT_SIZE)
+            _HEADER.pack_into(self.map, 0, MAGIC, VERSION)
+        elif _HEADER.unpack_from(self.map, 0) != (MAGIC, VERSION):
+            self.close()
+            raise OSError(f"{path} is not a gembird framebuffer")
+        self.view = memoryview(self.map)
+        self.frame = self.view[FRAME_OFFSET:SEGMENT_SIZE]
+
+    def sequence(self):
+        return _SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+
+    def close(self):
+        if self.map is None:
+            return
+        self.frame = self.view = None
+        self.map.close()
+        self.map = None
+        os.close(self.fd)
+
+
+class FrameProducer:
+    """
+    Writes frames into the shared framebuffer. Use one instance per thread
+    or process; each holds its own descriptor for the writer lock.
+    """
+
+    def __init__(self, name="default", path=None):
+        self.segment = Segment(path or segment_path(name))
+        self.frame = self.segment.frame
+        self.dirty = 0
+        self.frames = 0
+
+    def __enter__(self):
+        """Starts a frame: ``self.frame`` may be written until the block ends."""
+        segment = self.segment
+        fcntl.flock(segment.fd, fcntl.LOCK_EX)
+        self.dirty = 0
+        sequence = segment.sequence()
+        if sequence & 1:
+            # A writer died mid-frame: stay odd, and treat its frame as suspect.
+            sequence += 1
+            self.dirty = (1 << len(PER_KEY_CHUNKS)) - 1
+        _SEQUENCE.pack_into(segment.map, SEQUENCE_OFFSET, sequence + 1)
+        return self
+
+    def __exit__(self, *exc):
+        segment = self.segment
+        sequence = segment.sequence() + 1
+        dirty = self.dirty
+        if dirty:
+            stamps = list(_STAMPS.unpack_from(segment.map, STAMPS_OFFSET))
+            for index in range(len(stamps)):
+                if dirty >> index & 1:
+                    stamps[index] = sequence
+            _STAMPS.pack_into(segment.map, STAMPS_OFFSET, *stamps)
+        _SEQUENCE.pack_into(segment.map, SEQUENCE_OFFSET, sequence)
+        fcntl.flock(segment.fd, fcntl.LOCK_UN)
+        self.frames += 1
+
+    def touch(self, start=0, end=FRAME_SIZE):
+        """Marks framebuffer bytes [start, end) as written."""
+        self.dirty |= chunks_for(start, end)
+
+    def set_slot(self, slot, r, g, b):
+        base = slot * 3
+        frame = self.frame
+        frame[base + SLOT_RED] = r
+        frame[base + SLOT_GREEN] = g
+        frame[base + SLOT_BLUE] = b
+        self.dirty |= chunks_for(base, base + 3)
+
+    def write(self, data, offset=0):
+        """Copies a whole or partial framebuffer in and marks it."""
+        self.frame[offset:offset + len(data)] = data
+        self.dirty |= chunks_for(offset, offset + len(data))
+
+    def close(self):
+        self.frame = None
+        self.segment.close()
+
+
+class FramebufferOwner:
+    """
+    Creates the shared framebuffer and pushes changed chunks through a
+    ``FrameWriter``. ``poll`` does one consistent read; ``run`` polls until
+    ``stop`` is set. An existing segment is reused, so producers survive an
+    owner restart and the frame they left is shown again.
+    """
+
+    # A writer that holds the sequence odd this long has died mid-frame.
+    STALE_WRITER_SECONDS = 0.5
+
+    def __init__(self, writer, name="default", path=None, interval=1 / 120):
+        from gembird.arbitration import DeviceBusy
+
+        self.path = path or segment_path(name)
+        self.owner_fd = os.open(self.path + ".owner", os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        try:
+            fcntl.flock(self.owner_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self.owner_fd)
+            raise DeviceBusy(f"{self.path} already has an owner") from None
+        self.segment = Segment(self.path, create=True)
+        self.writer = writer
+        self.interval = interval
+        self.snapshot = bytearray(FRAME_SIZE)
+        self.seen = 0
+        self.pushed = 0
+        self.retries = 0
+        self.repaired = 0
+        self.odd_since = None
+
+    def read(self):
+        """
+        Copies the chunks written since the last read into ``snapshot``.
+        Returns the sequence read, or None if a writer is mid-frame.
+        """
+        segment = self.segment
+        source = segment.frame
+        snapshot = self.snapshot
+        while True:
+            before = segment.sequence()
+            if before & 1:
+                return None
+            if before == self.seen:
+                return before
+            stamps = _STAMPS.unpack_from(segment.map, STAMPS_OFFSET)
+            for index, stamp in enumerate(stamps):
+                if stamp > self.seen:
+                    offset, length = PER_KEY_CHUNKS[index]
+                    snapshot[offset:offset + length] = source[offset:offset + length]
+            if segment.sequence() == before:
+                return before
+            self.retries += 1
+
+    def _repair(self):
+        """Closes a frame left open by a writer that died holding the lock."""
+        segment = self.segment
+        try:
+            fcntl.flock(segment.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        try:
+            sequence = segment.sequence()
+            if sequence & 1:
+                # Whatever it wrote is suspect: push the whole frame.
+                _STAMPS.pack_into(segment.map, STAMPS_OFFSET, *[sequence + 1] * len(PER_KEY_CHUNKS))
+                _SEQUENCE.pack_into(segment.map, SEQUENCE_OFFSET, sequence + 1)
+                self.repaired += 1
+        finally:
+            fcntl.flock(segment.fd, fcntl.LOCK_UN)
+
+    def poll(self):
+        """Pushes the latest consistent frame if anything changed; returns chunks written."""
+        sequence = self.read()
+        if sequence is None:
+            now = time.monotonic()
+            if self.odd_since is None:
+                self.odd_since = now
+            elif now - self.odd_since > self.STALE_WRITER_SECONDS:
+                self._repair()
+                self.odd_since = None
+            return 0
+        self.odd_since = None
+        if sequence == self.seen:
+            return 0
+        self.seen = sequence
+        self.pushed += 1
+        return self.writer.show(self.snapshot)
+
+    def run(self, stop):
+        """Polls every ``interval`` seconds until the ``stop`` event is set."""
+        while not stop.is_set():
+            if not self.poll():
+                stop.wait(self.interval)
+
+    def close(self):
+        """Unmaps the segment; the file stays so producers can keep writing."""
+        self.segment.close()
+        os.close(self.owner_fd)
@@ -0,0 +1,276 @@
+"""Showing one animation on several keyboards in step.
+
+A per-key frame is six data chunks followed by the commit chunk, which
+makes the firmware apply the map. Written one keyboard after another, each
+board commits a whole sequence (100+ ms at the default pacing) after the
+previous one and a row of keyboards visibly drifts.
+
+``SyncGroup`` splits every frame in two phases. Each keyboard has a
+``Lane``, a worker thread that stages the changed data chunks at that
+keyboard's own pacing; all lanes stage in parallel. Once every lane is
+staged (or the frame's deadline passes), the commit chunks are written
+back to back from one thread, so the keyboards apply the frame within a
+few hundred microseconds of each other.
+
+A lane that cannot stage a frame before its deadline skips frames: it
+stages the first later frame it can finish in time, judged by its measured
+staging time, and commits it together with the other keyboards. A slow
+keyboard shows fewer frames, but never a different one.
+"""
+
+import itertools
+import math
+import threading
+import time
+
+from gembird.protocol import COMMIT_CHUNK, PER_KEY_CHUNKS, encode_chunk, sequence_gap
+
+
+def data_chunks(staged, frame):
+    """Indices of the non-commit chunks that differ between two framebuffers."""
+    if staged is None:
+        return list(range(COMMIT_CHUNK))
+    return [index for index, (offset, length) in enumerate(PER_KEY_CHUNKS[:COMMIT_CHUNK])
+            if staged[offset:offset + length] != frame[offset:offset + length]]
+
+
+_numbers = itertools.count(1)
+
+
+def first_gap(gaps):
+    return gaps if isinstance(gaps, (int, float)) else gaps[0]
+
+
+class Lane:
+    """
+    One keyboard of a group. ``pacing`` maps a sequence to its gaps, as a
+    session's ``pacing`` or ``protocol.sequence_gap`` do.
+    """
+
+    def __init__(self, transport, pacing=sequence_gap, name=None):
+        self.transport = transport
+        self.pacing = pacing
+        path = getattr(transport, "path", None)
+        if isinstance(path, bytes):
+            path = path.decode()
+        self.name = name or path or f"keyboard-{next(_numbers)}"
+        self.staged = None
+        self.shown = None
+        self.target = None
+        self.ready_at = 0.0
+        self.stage_seconds = None
+        self.committed = 0
+        self.skipped = 0
+        self.error = None
+        self.job = None
+        self.busy = False
+        self.running = True
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name=f"gembird-lane-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stage(self, frame):
+        """Starts staging ``frame`` in the background; False if still busy."""
+        with self.cond:
+            if self.busy:
+                return False
+            self.job = frame
+            self.busy = True
+            self.cond.notify_all()
+            return True
+
+    def wait(self, deadline):
+        """Waits until staging is done or ``deadline`` passes (None: no limit); returns whether it is done."""
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.busy, timeout)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.job is not None or not self.running)
+                if self.job is None:
+                    return
+                frame = self.job
+            wait = self.ready_at - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            start = time.monotonic()
+            sequence = [encode_chunk(frame, index) for index in data_chunks(self.staged, frame)]
+            try:
+                if sequence:
+                    self.transport.send_sequence(sequence, self.pacing(sequence))
+                self.staged = frame
+            except OSError as ex:
+                self.error = ex
+                self.staged = None
+            elapsed = time.monotonic() - start
+            self.stage_seconds = elapsed if self.stage_seconds is None else 0.8 * self.stage_seconds + 0.2 * elapsed
+            with self.cond:
+                self.job = None
+                self.busy = False
+                self.cond.notify_all()
+
+    def commit(self, frame):
+        """Writes the commit chunk; the lane must have ``frame`` staged."""
+        report = encode_chunk(frame, COMMIT_CHUNK)
+        try:
+            self.transport.write(report)
+        except OSError as ex:
+            self.error = ex
+            self.staged = None
+            return None
+        now = time.monotonic()
+        self.ready_at = now + first_gap(self.pacing([report]))
+        self.shown = frame
+        self.committed += 1
+        return now
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+
+
+class SyncGroup:
+    """Commits frames on several keyboards at the same moment."""
+
+    def __init__(self, lanes):
+        self.lanes = list(lanes)
+        self.frames = 0
+        self.spreads = []
+        self.sessions = []
+
+    @classmethod
+    def open(cls, paths, backend="auto"):
+        """Opens every path through the arbitration layer; all must be free."""
+        from gembird.arbitration import DeviceBusy, LocalSession, open_session
+
+        group = cls([])
+        try:
+            for path in paths:
+                session = open_session(path, backend=backend, serve=False)
+                group.sessions.append(session)
+                if not isinstance(session, LocalSession):
+                    raise DeviceBusy(f"{path!r} is held by another process")
+                group.lanes.append(Lane(session.transport, session.pacing))
+        except BaseException:
+            group.close()
+            raise
+        return group
+
+    def _tick(self, tick, frame_at, deadline, period=None):
+        """
+        Commits frame ``tick`` on every lane that has it staged by ``deadline``.
+        Idle lanes first start staging: the current frame, or, if a lane is
+        too slow to make this deadline and ``period`` is known, the first
+        future frame it can make, so that it rejoins the group in phase.
+        """
+        if deadline is None:
+            # No deadline: let lanes finish their earlier frame, so every one stages this one.
+            for lane in self.lanes:
+                if lane.busy:
+                    lane.wait(None)
+        now = time.monotonic()
+        for lane in self.lanes:
+            if lane.busy or lane.target is not None and lane.target >= tick:
+                continue
+            target = tick
+            if period and lane.stage_seconds and deadline is not None:
+                target += max(0, math.ceil((now + lane.stage_seconds - deadline) / period))
+            frame = frame_at(target)
+            if frame is None:
+                target, frame = tick, frame_at(tick)
+            lane.target = target
+            lane.stage(frame)
+
+        frame = frame_at(tick)
+        ready = []
+        for lane in self.lanes:
+            if lane.target != tick:
+                if lane.shown != frame:
+                    lane.skipped += 1
+                continue
+            if lane.wait(deadline) and lane.staged == frame:
+                if lane.shown != frame:
+                    ready.append(lane)
+            else:
+                lane.skipped += 1
+        times = [when for when in (lane.commit(frame) for lane in ready) if when is not None]
+        if len(times) > 1:
+            self.spreads.append(times[-1] - times[0])
+        self.frames += 1
+        return len(times)
+
+    def show(self, frame, deadline=None):
+        """
+        Stages ``frame`` on every idle lane, waits for them until ``deadline``
+        (monotonic seconds; None waits for all), then commits the lanes that
+        have it staged. Returns the number of keyboards that committed.
+        Raises OSError if writing to any keyboard failed.
+        """
+        frame = bytes(frame)
+        tick = self.frames
+        committed = self._tick(tick, lambda target: frame, deadline)
+        self._raise_errors()
+        return committed
+
+    def play(self, frames, fps=30):
+        """
+        Shows a list of frames at ``fps``; each tick's commits go out before
+        its period ends. Slow keyboards skip frames to stay in phase.
+        Raises OSError at the end if writing to any keyboard failed.
+        """
+        frames = [bytes(frame) for frame in frames]
+        period = 1.0 / fps
+        base = self.frames
+        start = time.monotonic()
+
+        def frame_at(target):
+            index = target - base
+            return frames[index] if index < len(frames) else None
+
+        for index in range(len(frames)):
+            begin = start + index * period
+            self._tick(base + index, frame_at, begin + 0.9 * period, period)
+            wait = begin + period - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        # Leave every keyboard on the last frame, slow ones included.
+        if frames and any(lane.shown != frames[-1] for lane in self.lanes):
+            self.show(frames[-1])
+        self._raise_errors()
+
+    def _raise_errors(self):
+        failed = [lane for lane in self.lanes if lane.error is not None]
+        if not failed:
+            return
+        message = "; ".join(f"{lane.name}: {lane.error}" for lane in failed)
+        for lane in failed:
+            lane.error = None
+        raise OSError(message)
+
+    def stats(self):
+        spreads = sorted(self.spreads)
+        return {
+            "frames": self.frames,
+            "max_spread": spreads[-1] if spreads else 0.0,
+            "median_spread": spreads[len(spreads) // 2] if spreads else 0.0,
+            "lanes": {lane.name: {"committed": lane.committed, "skipped": lane.skipped,
+                                  "stage_seconds": lane.stage_seconds} for lane in self.lanes},
+        }
+
+    def close(self):
+        for lane in self.lanes:
+            lane.close()
+        for session in self.sessions:
+            session.close()
+        self.lanes = []
+        self.sessions = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
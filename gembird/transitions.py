@@ -0,0 +1,209 @@
+"""Smooth colour transitions paced by the measured device update rate.
+
+A fade is driven by the clock, not by a fixed frame count: each frame is
+rendered for the moment it is actually sent, so a slow link simply yields
+fewer, larger steps and the fade still ends on time. Easing curves are
+precomputed tables and colour-space conversions go through lookup tables,
+so rendering a frame costs a handful of multiplications per colour.
+
+Colour spaces:
+    "rgb"     straight interpolation of the sRGB byte values
+    "linear"  interpolation in linear light (no dark dip between hues)
+    "oklab"   perceptually uniform interpolation (Björn Ottosson's Oklab)
+"""
+
+import math
+import time
+
+from gembird.protocol import SLOT_COUNT, create_true_static_color_sequence, get_slot, new_frame, set_slot
+
+# --- Easing tables ---
+EASING_STEPS = 1024
+
+
+def _table(func):
+    return tuple(func(i / (EASING_STEPS - 1)) for i in range(EASING_STEPS))
+
+
+EASINGS = {
+    "linear": _table(lambda t: t),
+    "ease-in": _table(lambda t: t * t * t),
+    "ease-out": _table(lambda t: 1 - (1 - t) ** 3),
+    "ease-in-out": _table(lambda t: 4 * t * t * t if t < 0.5 else 1 - (-2 * t + 2) ** 3 / 2),
+    "sine": _table(lambda t: 0.5 - math.cos(math.pi * t) / 2),
+}
+
+
+def ease(table, t):
+    """Looks up eased progress for ``t`` in [0, 1]."""
+    if t <= 0.0:
+        return table[0]
+    if t >= 1.0:
+        return table[-1]
+    return table[int(t * (EASING_STEPS - 1) + 0.5)]
+
+
+# --- Colour spaces ---
+
+def _srgb_to_linear(c):
+    c /= 255.0
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+SRGB_TO_LINEAR = tuple(_srgb_to_linear(c) for c in range(256))
+LINEAR_STEPS = 4096
+LINEAR_TO_SRGB = bytes(
+    round(255 * (12.92 * x if x <= 0.0031308 else 1.055 * x ** (1 / 2.4) - 0.055))
+    for x in (i / (LINEAR_STEPS - 1) for i in range(LINEAR_STEPS))
+)
+
+
+def linear_to_srgb(x):
+    if x <= 0.0:
+        return 0
+    if x >= 1.0:
+        return 255
+    return LINEAR_TO_SRGB[int(x * (LINEAR_STEPS - 1) + 0.5)]
+
+
+def rgb_to_oklab(rgb):
+    r, g, b = (SRGB_TO_LINEAR[c] for c in rgb)
+    l = (0.4122214708 * r + 0.5363325363 * g + 0.0514459929 * b) ** (1 / 3)
+    m = (0.2119034982 * r + 0.6806995451 * g + 0.1073969566 * b) ** (1 / 3)
+    s = (0.0883024619 * r + 0.2817188376 * g + 0.6299787005 * b) ** (1 / 3)
+    return (0.2104542553 * l + 0.7936177850 * m - 0.0040720468 * s,
+            1.9779984951 * l - 2.4285922050 * m + 0.4505937099 * s,
+            0.0259040371 * l + 0.7827717662 * m - 0.8086757660 * s)
+
+
+def oklab_to_rgb(lab):
+    L, a, b = lab
+    l = (L + 0.3963377774 * a + 0.2158037573 * b) ** 3
+    m = (L - 0.1055613458 * a - 0.0638541728 * b) ** 3
+    s = (L - 0.0894841775 * a - 1.2914855480 * b) ** 3
+    return (linear_to_srgb(4.0767416621 * l - 3.3077115913 * m + 0.2309699292 * s),
+            linear_to_srgb(-1.2684380046 * l + 2.6097574011 * m - 0.3413193965 * s),
+            linear_to_srgb(-0.0041960863 * l - 0.7034186147 * m + 1.7076147010 * s))
+
+
+# name -> (to working space, from working space)
+SPACES = {
+    "rgb": (tuple, lambda c: tuple(min(255, max(0, round(v))) for v in c)),
+    "linear": (lambda rgb: tuple(SRGB_TO_LINEAR[c] for c in rgb), lambda c: tuple(linear_to_srgb(v) for v in c)),
+    "oklab": (rgb_to_oklab, oklab_to_rgb),
+}
+
+
+def mix(a, b, t):
+    return (a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t, a[2] + (b[2] - a[2]) * t)
+
+
+# --- Engine ---
+
+class TransitionEngine:
+    """
+    Renders fades onto the keyboard through a Controller (normal mode) or a
+    FrameWriter (per-key). ``max_fps`` caps the frame rate on fast links.
+    """
+
+    # Until something has been measured, assume the original scripts' pacing.
+    DEFAULT_NORMAL_SECONDS = 3 * 0.03
+
+    def __init__(self, controller, writer=None, max_fps=60, current=(0, 0, 0)):
+        self.controller = controller
+        self.writer = writer
+        self.max_fps = max_fps
+        self.current = tuple(current)
+        self.normal_seconds = None
+        self.last_stats = None
+
+    def _send_normal(self, rgb):
+        start = time.monotonic()
+        self.controller.send(create_true_static_color_sequence(*rgb))
+        elapsed = time.monotonic() - start
+        self.normal_seconds = elapsed if self.normal_seconds is None else 0.8 * self.normal_seconds + 0.2 * elapsed
+        self.current = tuple(rgb)
+
+    def _run(self, duration, frame_seconds, render, finish):
+        """Clock-driven frame loop shared by both paths."""
+        min_interval = 1.0 / self.max_fps
+        planned = max(1, int(duration / max(frame_seconds(), min_interval)))
+        frames = 0
+        start = time.monotonic()
+        end = start + duration
+        while True:
+            now = time.monotonic()
+            # Stop early rather than overrun: leave room for this frame and
+            # the exact final frame, which must land on time.
+            if now + 2 * frame_seconds() > end:
+                break
+            render((now - start) / duration)
+            frames += 1
+            wait = now + min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        wait = end - frame_seconds() - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        finish()
+        frames += 1
+        self.last_stats = {
+            "planned_frames": planned,
+            "frames": frames,
+            "duration": duration,
+            "elapsed": time.monotonic() - start,
+        }
+        return self.last_stats
+
+    def fade_to(self, rgb, duration_ms, easing="ease-in-out", space="oklab"):
+        """Fades the whole keyboard (normal mode) from the current colour to ``rgb``."""
+        table = EASINGS[easing]
+        encode, decode = SPACES[space]
+        a, b = encode(self.current), encode(tuple(rgb))
+
+        def render(t):
+            self._send_normal(decode(mix(a, b, ease(table, t))))
+
+        return self._run(duration_ms / 1000.0,
+                         lambda: self.normal_seconds or self.DEFAULT_NORMAL_SECONDS,
+                         render, lambda: self._send_normal(tuple(rgb)))
+
+    def fade_frame_to(self, target, duration_ms, easing="ease-in-out", space="oklab"):
+        """Fades every key from what the FrameWriter shows to ``target`` (per-key)."""
+        if self.writer is None:
+            raise ValueError("per-key transitions need a FrameWriter")
+        table = EASINGS[easing]
+        encode, decode = SPACES[space]
+        source = self.writer.shown or new_frame()
+        # Only slots that differ need interpolating each frame.
+        slots = [(slot, encode(get_slot(source, slot)), encode(get_slot(target, slot)))
+                 for slot in range(SLOT_COUNT) if get_slot(source, slot) != get_slot(target, slot)]
+        frame = bytearray(source)
+
+        def render(t):
+            k = ease(table, t)
+            for slot, a, b in slots:
+                set_slot(frame, slot, *decode(mix(a, b, k)))
+            self.writer.show(frame)
+
+        return self._run(duration_ms / 1000.0,
+                         lambda: self.writer.frame_seconds or 7 * 0.02,
+                         render, lambda: self.writer.show(target))
+
+    def gradient(self, stops, positions):
+        """
+        Builds a per-key frame from colour stops: ``positions`` maps slot ->
+        position in [0, 1]; ``stops`` is a list of RGB tuples spread evenly
+        over that range and blended in Oklab.
+        """
+        labs = [rgb_to_oklab(stop) for stop in stops]
+        frame = new_frame()
+        spans = len(labs) - 1
+        for slot, position in positions.items():
+            if spans <= 0:
+                set_slot(frame, slot, *stops[0])
+                continue
+            x = min(max(position, 0.0), 1.0) * spans
+            i = min(int(x), spans - 1)
+            set_slot(frame, slot, *oklab_to_rgb(mix(labs[i], labs[i + 1], x - i)))
+        return frame
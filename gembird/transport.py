@@ -0,0 +1,273 @@
+"""Pluggable transports that carry 64-byte reports to the keyboard.
+
+``HidapiTransport`` goes through the ``hid`` binding and works everywhere.
+``HidrawTransport`` talks to ``/dev/hidrawN`` directly on Linux: it writes
+with ``os.write``, reads into a preallocated buffer and keeps its fd in a
+selector so that full or empty queues wait in the kernel instead of
+spinning. Because it only needs a file descriptor, it can be pointed at a
+socketpair, pty or pipe as a stand-in for the device.
+"""
+
+import os
+import selectors
+import sys
+import time
+
+from gembird.protocol import REPORT_SIZE
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Transport:
+    """Base class of all transports; subclasses implement write/read/close."""
+
+    name = "base"
+
+    def write(self, report):
+        """Writes one report and returns the number of bytes written."""
+        raise NotImplementedError
+
+    def read(self, size=REPORT_SIZE, timeout=None):
+        """Reads one input report, or returns None on timeout."""
+        raise NotImplementedError
+
+    def fileno(self):
+        """Returns a selectable fd, or -1 if the transport has none."""
+        return -1
+
+    def close(self):
+        pass
+
+    def send_sequence(self, sequence, gap=0.0):
+        """
+        Writes a packet sequence, pausing after each packet. ``gap`` is
+        either one number of seconds or a list with one gap per packet.
+        """
+        write = self.write
+        if isinstance(gap, (int, float)):
+            for payload in sequence:
+                write(payload)
+                if gap:
+                    time.sleep(gap)
+            return
+        for payload, pause in zip(sequence, gap):
+            write(payload)
+            if pause:
+                time.sleep(pause)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HidapiTransport(Transport):
+    """Transport backed by an opened ``hid.device``."""
+
+    name = "hidapi"
+
+    def __init__(self, path=None, device=None):
+        if device is None:
+            import hid
+
+            device = hid.device()
+            device.open_path(path if isinstance(path, bytes) else path.encode())
+        self.device = device
+        self.path = path
+
+    def write(self, report):
+        written = self.device.write(report)
+        if written < 0:
+            raise OSError(f"hidapi write failed: {self.device.error()}")
+        return written
+
+    def read(self, size=REPORT_SIZE, timeout=None):
+        data = self.device.read(size, -1 if timeout is None else int(timeout * 1000))
+        return bytes(data) if data else None
+
+    def get_feature_report(self, report_id, size=REPORT_SIZE):
+        return bytes(self.device.get_feature_report(report_id, size))
+
+    def close(self):
+        if self.device is not None:
+            self.device.close()
+            self.device = None
+
+
+class HidrawTransport(Transport):
+    """
+    Transport writing straight to a Linux hidraw node (or any fd).
+    ``write_fd`` may be given separately when the stand-in is a pipe.
+    """
+
+    name = "hidraw"
+
+    def __init__(self, path=None, fd=None, write_fd=None, owns_fd=None):
+        if fd is None:
+            fd = os.open(path, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+            owns_fd = True if owns_fd is None else owns_fd
+        else:
+            os.set_blocking(fd, False)
+        self.path = path
+        self.fd = fd
+        self.write_fd = fd if write_fd is None else write_fd
+        if self.write_fd != fd:
+            os.set_blocking(self.write_fd, False)
+        self.owns_fd = bool(owns_fd)
+
+        # Preallocated buffers: callers can fill ``out_buffer`` in place and
+        # flush it with write_buffer(); reads land in ``in_buffer``.
+        self.out_buffer = bytearray(REPORT_SIZE)
+        self.in_buffer = bytearray(REPORT_SIZE)
+        self.in_view = memoryview(self.in_buffer)
+
+        # One selector per direction so a readable fd never wakes a writer.
+        self.read_selector = selectors.DefaultSelector()
+        self.read_selector.register(fd, selectors.EVENT_READ)
+        self.write_selector = selectors.DefaultSelector()
+        self.write_selector.register(self.write_fd, selectors.EVENT_WRITE)
+        self.write_timeout = 1.0
+
+    def write(self, report):
+        try:
+            return os.write(self.write_fd, report)
+        except BlockingIOError:
+            if not self.write_selector.select(self.write_timeout):
+                raise TimeoutError("hidraw write timed out") from None
+            return os.write(self.write_fd, report)
+
+    def write_buffer(self):
+        """Writes the preallocated ``out_buffer`` as one report."""
+        return self.write(self.out_buffer)
+
+    def readinto(self, timeout=None):
+        """Reads one report into ``in_buffer``; returns its length or 0 on timeout."""
+        try:
+            return os.readv(self.fd, (self.in_buffer,))
+        except BlockingIOError:
+            if not self.read_selector.select(timeout):
+                return 0
+            return os.readv(self.fd, (self.in_buffer,))
+
+    def read(self, size=REPORT_SIZE, timeout=None):
+        count = self.readinto(timeout)
+        return bytes(self.in_view[:min(count, size)]) if count else None
+
+    def get_feature_report(self, report_id, size=REPORT_SIZE):
+        import fcntl
+
+        buf = bytearray(size)
+        buf[0] = report_id
+        # HIDIOCGFEATURE(len) = _IOC(_IOC_READ|_IOC_WRITE, 'H', 0x07, len)
+        request = (3 << 30) | (size << 16) | (ord('H') << 8) | 0x07
+        count = fcntl.ioctl(self.fd, request, buf, True)
+        return bytes(buf[:count])
+
+    def fileno(self):
+        return self.fd
+
+    async def write_async(self, report):
+        """Writes one report from asyncio without blocking the event loop."""
+        import asyncio
+
+        while True:
+            try:
+                return os.write(self.write_fd, report)
+            except BlockingIOError:
+                loop = asyncio.get_running_loop()
+                ready = loop.create_future()
+                loop.add_writer(self.write_fd, _wake, ready)
+                try:
+                    await ready
+                finally:
+                    loop.remove_writer(self.write_fd)
+
+    async def read_async(self):
+        """Reads one report from asyncio without blocking the event loop."""
+        import asyncio
+
+        while True:
+            try:
+                count = os.readv(self.fd, (self.in_buffer,))
+                return bytes(self.in_view[:count])
+            except BlockingIOError:
+                loop = asyncio.get_running_loop()
+                ready = loop.create_future()
+                loop.add_reader(self.fd, _wake, ready)
+                try:
+                    await ready
+                finally:
+                    loop.remove_reader(self.fd)
+
+    def close(self):
+        if self.fd is None:
+            return
+        self.read_selector.close()
+        self.write_selector.close()
+        if self.owns_fd:
+            os.close(self.fd)
+        self.fd = None
+
+
+class MemoryTransport(Transport):
+    """Records written reports in memory; a stand-in for tests and benchmarks."""
+
+    name = "memory"
+
+    def __init__(self, path=None, sink=None):
+        self.path = path
+        self.sink = sink
+        self.written = []
+
+    def write(self, report):
+        report = bytes(report)
+        self.written.append(report)
+        if self.sink is not None:
+            self.sink(report)
+        return len(report)
+
+    def read(self, size=REPORT_SIZE, timeout=None):
+        return None
+
+
+# Backend name -> "module:class", imported on first use so optional
+# dependencies are only needed by the backend that uses them.
+BACKENDS = {
+    "hidapi": "gembird.transport:HidapiTransport",
+    "hidraw": "gembird.transport:HidrawTransport",
+    "libusb": "gembird.libusb:LibusbTransport",
+    "memory": "gembird.transport:MemoryTransport",
+}
+
+
+def is_hidraw_path(path):
+    """Whether a device path names a Linux hidraw node."""
+    text = path.decode() if isinstance(path, bytes) else path
+    return sys.platform.startswith("linux") and text.startswith("/dev/hidraw")
+
+
+def backend_class(backend):
+    """Resolves a backend name to its transport class."""
+    import importlib
+
+    try:
+        module_name, class_name = BACKENDS[backend].split(":")
+    except KeyError:
+        raise ValueError(f"Unknown transport backend '{backend}'") from None
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def open_transport(path, backend="auto"):
+    """
+    Opens ``path`` with the named backend. ``auto`` uses hidraw when the
+    path is a hidraw node and falls back to hidapi otherwise.
+    """
+    if backend == "auto":
+        backend = "hidraw" if is_hidraw_path(path) else "hidapi"
+    if backend == "hidraw" and isinstance(path, bytes):
+        path = path.decode()
+    return backend_class(backend)(path)